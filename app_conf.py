@@ -1,20 +1,65 @@
-import mysql.connector
-from flask import Flask
+from flask import Flask, request
 # from sqlalchemy import create_engine
 
 from config import consts
+from connection_pool import ConnectionPool
+from metrics import Metrics, MetricsMiddleware
+from request_profiler import ProfilingMiddleware, RequestProfiles
+from single_flight import SingleFlight
+from slow_query_log import SlowQueryLog
+from statement_cache import StatementCache
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app)
 
-db_conn = mysql.connector.connect(
-    host=consts.DB_HOST,
-    user=consts.DB_USER,
-    password=consts.DB_PASSWORD,
-    database=consts.DB_NAME,
-    connect_timeout=1000,
+db_pool = ConnectionPool(
+    connect_args=dict(
+        host=consts.DB_HOST,
+        port=consts.DB_PORT,
+        user=consts.DB_USER,
+        password=consts.DB_PASSWORD,
+        database=consts.DB_NAME,
+        connect_timeout=1000,
+        # The C extension does its socket IO outside of python, where gevent can not yield.
+        # The pure python implementation lets greenlets run their queries concurrently.
+        use_pure=True,
+    ),
+    min_size=consts.DB_POOL_MIN_SIZE,
+    max_size=consts.DB_POOL_MAX_SIZE,
+    timeout=consts.DB_POOL_TIMEOUT,
+    recycle=consts.DB_POOL_RECYCLE,
+    pre_ping=consts.DB_POOL_PRE_PING,
 )
 
+statement_cache = StatementCache(
+    size=consts.DB_PREPARED_STATEMENTS_PER_CONNECTION,
+    enabled=consts.DB_PREPARED_STATEMENTS,
+)
+
+query_flights = SingleFlight(timeout=consts.SINGLE_FLIGHT_TIMEOUT, enabled=consts.SINGLE_FLIGHT_ENABLED)
+
+metrics = Metrics(enabled=consts.METRICS_ENABLED, max_queries=consts.METRICS_MAX_QUERIES)
+profiles = RequestProfiles(token=consts.ADMIN_TOKEN, metrics=metrics, size=consts.PROFILE_STORE_SIZE,
+                           stats_limit=consts.PROFILE_STATS_LIMIT)
+app.wsgi_app = MetricsMiddleware(ProfilingMiddleware(app.wsgi_app, profiles), metrics)
+
+slow_queries = SlowQueryLog(
+    threshold=consts.SLOW_QUERY_THRESHOLD,
+    size=consts.SLOW_QUERY_LOG_SIZE,
+    connection=db_pool.connection,
+    explain=consts.SLOW_QUERY_EXPLAIN,
+    explain_interval=consts.SLOW_QUERY_EXPLAIN_INTERVAL,
+    dump_path=consts.SLOW_QUERY_LOG_FILE or None,
+)
+
+
+@app.before_request
+def record_route():
+    # Requests are measured by the URL rule they matched, rather than by their paths.
+    if request.url_rule is not None:
+        request.environ[MetricsMiddleware.ROUTE_KEY] = request.url_rule.rule
+
+
 # db_conn = create_engine(f'mysql+pymysql://{consts.DB_USER}:{consts.DB_PASSWORD}@{consts.DB_HOST}/{consts.DB_NAME}',
 #                         pool_recycle=60 * 5, pool_pre_ping=True).raw_connection()
@@ -0,0 +1,389 @@
+"""
+A seeded MySQL database for the benchmarks: a schema fixture with the tables (and the add_song procedure) the
+repositories use, filled with synthetic data at a configurable scale.
+The database is either created on an existing server, or on a throwaway local server that is started from the
+mysqld on the PATH, with its data directory in a temporary directory - no Docker needed.
+The schema follows the tables described in Software Documentation.md. It is only meant for benchmarks.
+"""
+import argparse
+import contextlib
+import getpass
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import mysql.connector
+import numpy as np
+
+from config import consts
+
+# The number of rows of each table per unit of scale. Genres and keys do not grow with the scale.
+ROWS_PER_SCALE = {
+    'artists': 2000,
+    'albums': 4000,
+    'songs': 20000,
+    'comments': 100000,
+    'favorites': 40000,
+}
+GENRE_COUNT = 80
+DEFAULT_DATABASE = 'music_social_network_bench'
+KEYS = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+# Song names are made of these words, so that searches by a word or a prefix match many songs, as they do for real.
+SONG_NAME_WORDS = ["love", "night", "heart", "baby", "dance", "dream", "fire", "rain", "summer", "light", "blue",
+                   "home", "time", "road", "world", "girl", "boy", "star", "moon", "river", "gold", "wild", "sweet",
+                   "lonely", "crazy", "forever", "tonight", "yesterday", "angel", "city"]
+
+SCHEMA = [
+    """
+    CREATE TABLE artists (
+        artist_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        artist_name VARCHAR(200) NOT NULL UNIQUE,
+        pwd VARCHAR(100) NOT NULL,
+        artist_spotify_id VARCHAR(50) NULL
+    );
+    """,
+    """
+    CREATE TABLE albums (
+        album_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        album_name VARCHAR(500) NOT NULL UNIQUE,
+        album_spotify_id VARCHAR(50) NULL
+    );
+    """,
+    """
+    CREATE TABLE artist_album_connector (
+        artist_id INT NOT NULL,
+        album_id INT NOT NULL,
+        PRIMARY KEY (artist_id, album_id),
+        INDEX artist_album_connector_album (album_id),
+        FOREIGN KEY (artist_id) REFERENCES artists (artist_id),
+        FOREIGN KEY (album_id) REFERENCES albums (album_id)
+    );
+    """,
+    """
+    CREATE TABLE genres (
+        genre_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        genre_name VARCHAR(100) NOT NULL UNIQUE
+    );
+    """,
+    """
+    CREATE TABLE artist_genre_connector (
+        artist_id INT NOT NULL,
+        genre_id INT NOT NULL,
+        PRIMARY KEY (artist_id, genre_id),
+        INDEX artist_genre_connector_genre (genre_id),
+        FOREIGN KEY (artist_id) REFERENCES artists (artist_id),
+        FOREIGN KEY (genre_id) REFERENCES genres (genre_id)
+    );
+    """,
+    """
+    CREATE TABLE musical_scales (
+        scale_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        scale_name VARCHAR(2) NOT NULL UNIQUE
+    );
+    """,
+    """
+    CREATE TABLE songs (
+        song_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        song_name VARCHAR(500) NOT NULL,
+        album INT NOT NULL,
+        duration INT NOT NULL,
+        song_key INT NOT NULL,
+        release_date DATE NOT NULL,
+        is_major TINYINT(1) NOT NULL,
+        energy FLOAT NOT NULL,
+        song_spotify_id VARCHAR(50) NULL,
+        UNIQUE songs_name_album (song_name, album),
+        INDEX songs_album (album),
+        FOREIGN KEY (album) REFERENCES albums (album_id),
+        FOREIGN KEY (song_key) REFERENCES musical_scales (scale_id)
+    );
+    """,
+    """
+    CREATE TABLE favorite_songs (
+        song_id INT NOT NULL,
+        artist_id INT NOT NULL,
+        PRIMARY KEY (song_id, artist_id),
+        INDEX favorite_songs_artist (artist_id),
+        FOREIGN KEY (song_id) REFERENCES songs (song_id),
+        FOREIGN KEY (artist_id) REFERENCES artists (artist_id)
+    );
+    """,
+    """
+    CREATE TABLE comment_on_song (
+        song_id INT NOT NULL,
+        commenter_id INT NOT NULL,
+        comment_text TEXT NOT NULL,
+        rating TINYINT NOT NULL,
+        PRIMARY KEY (song_id, commenter_id),
+        INDEX comment_on_song_commenter (commenter_id),
+        FOREIGN KEY (song_id) REFERENCES songs (song_id),
+        FOREIGN KEY (commenter_id) REFERENCES artists (artist_id)
+    );
+    """,
+    """
+    CREATE FUNCTION get_album_id(album VARCHAR(500)) RETURNS INT READS SQL DATA
+    RETURN (SELECT album_id FROM albums WHERE album_name = album);
+    """,
+    """
+    CREATE FUNCTION get_scale_id(scale TEXT) RETURNS INT READS SQL DATA
+    RETURN (SELECT scale_id FROM musical_scales WHERE scale_name = scale);
+    """,
+    """
+    CREATE PROCEDURE add_album(IN album VARCHAR(500), IN spotify_id TEXT)
+    INSERT INTO albums (album_name, album_spotify_id) VALUES (album, NULLIF(spotify_id, ''));
+    """,
+    """
+    CREATE PROCEDURE link_artist_to_album(IN artist VARCHAR(200), IN album VARCHAR(500))
+    INSERT INTO artist_album_connector (artist_id, album_id)
+    SELECT artist_id, get_album_id(album) FROM artists WHERE artist_name = artist;
+    """,
+    """
+    CREATE PROCEDURE add_song(IN song VARCHAR(500), IN album VARCHAR(500), IN artist VARCHAR(200), IN spotify_id TEXT,
+    IN dur INT, IN scale TEXT, IN rel_date TEXT, IN major BIT, IN enrgy FLOAT)
+    BEGIN
+        DECLARE returned_album_id INT DEFAULT -1;
+        SET returned_album_id = get_album_id(album);
+        IF returned_album_id < 0 OR returned_album_id IS NULL THEN
+        BEGIN
+            CALL add_album(album, '');
+            CALL link_artist_to_album(artist, album);
+            SET returned_album_id = get_album_id(album);
+        END;
+        END IF;
+        IF spotify_id = '' THEN
+            SET spotify_id = NULL;
+        END IF;
+        INSERT INTO songs(song_name, album, duration, song_key, release_date, is_major, energy, song_spotify_id)
+            VALUES(song, returned_album_id, dur, get_scale_id(scale), STR_TO_DATE(rel_date, "%Y-%m-%d"), major, enrgy,
+                   spotify_id);
+    END
+    """,
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def local_server(startup_timeout: float = 60):
+    """
+    Starts a throwaway MySQL server from the mysqld on the PATH, with an empty data directory in a temporary
+    directory, and stops it (deleting its data) on exit.
+    :return: the (host, port, user, password) to connect to it with.
+    """
+    mysqld = shutil.which('mysqld')
+    if mysqld is None:
+        raise RuntimeError("mysqld was not found on the PATH. Install MySQL, or pass --server existing.")
+    with tempfile.TemporaryDirectory(prefix='music_social_network_bench_') as directory:
+        data_directory = os.path.join(directory, 'data')
+        # mysqld refuses to run as root unless told to, and ignores --user when not started as root.
+        user = f'--user={getpass.getuser()}'
+        subprocess.run([mysqld, '--no-defaults', '--initialize-insecure', user, f'--datadir={data_directory}'],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        port = free_port()
+        server = subprocess.Popen([mysqld, '--no-defaults', user, f'--datadir={data_directory}', f'--port={port}',
+                                   '--bind-address=127.0.0.1', f'--socket={os.path.join(directory, "mysqld.sock")}',
+                                   '--mysqlx=OFF', '--skip-log-bin', '--log-bin-trust-function-creators=ON'],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + startup_timeout
+            while True:
+                try:
+                    mysql.connector.connect(host='127.0.0.1', port=port, user='root', password='').close()
+                    break
+                except mysql.connector.Error:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError("the local MySQL server did not start.")
+                    time.sleep(0.5)
+            yield '127.0.0.1', port, 'root', ''
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def create_database(host: str, port: int, user: str, password: str, database: str) -> None:
+    """
+    Creates the database from scratch (dropping it if it exists) with the schema fixture.
+    """
+    connection = mysql.connector.connect(host=host, port=port, user=user, password=password)
+    cursor = connection.cursor()
+    cursor.execute(f"DROP DATABASE IF EXISTS `{database}`;")
+    cursor.execute(f"CREATE DATABASE `{database}` CHARACTER SET utf8mb4;")
+    cursor.execute(f"USE `{database}`;")
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cursor.close()
+    connection.close()
+
+
+def use_database(host: str, port: int, user: str, password: str, database: str) -> None:
+    """
+    Points the server's settings at the database. Must be called before the repositories are imported,
+    as the connection pool is created with the settings on import.
+    """
+    consts.DB_HOST = host
+    consts.DB_PORT = port
+    consts.DB_USER = user
+    consts.DB_PASSWORD = password
+    consts.DB_NAME = database
+
+
+def spotify_ids(rng: np.random.Generator, count: int) -> list:
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'))
+    return [''.join(row) for row in rng.choice(letters, size=(count, 22))]
+
+
+def seed(scale: float, seed_value: int = 0) -> dict:
+    """
+    Fills the database use_database pointed at with synthetic data, then builds the derived tables.
+    :param scale: the size of the data, in units of ROWS_PER_SCALE.
+    :param seed_value: the seed of the data, so that the same scale and seed always give the same data.
+    :return: the number of rows of each table.
+    """
+    # Imported here, as they use the settings use_database sets.
+    from db_data_inserts_preprocessing import GeneratedDataAdder, connect, insert_rows
+    from repositories.rating_stats import RatingStatsRepository
+    from repositories.recommendations import RecommendationsRepository
+
+    counts = {table: max(int(rows * scale), 1) for table, rows in ROWS_PER_SCALE.items()}
+    rng = np.random.default_rng(seed_value)
+    connection = connect()
+    cursor = connection.cursor()
+    insert_rows(cursor, "INSERT INTO genres (genre_name) VALUES", [(f"genre {i}",) for i in range(GENRE_COUNT)])
+    insert_rows(cursor, "INSERT INTO musical_scales (scale_name) VALUES", [(key,) for key in KEYS])
+    insert_rows(cursor, "INSERT INTO artists (artist_name, pwd, artist_spotify_id) VALUES",
+                [(f"artist {i}", "password", spotify_id)
+                 for i, spotify_id in enumerate(spotify_ids(rng, counts['artists']))])
+    insert_rows(cursor, "INSERT INTO albums (album_name, album_spotify_id) VALUES",
+                [(f"album {i}", spotify_id) for i, spotify_id in enumerate(spotify_ids(rng, counts['albums']))])
+    # The ids are 1 to the number of rows, as the tables were just created.
+    # Every album has an artist, and some have a second one.
+    album_ids = np.arange(1, counts['albums'] + 1)
+    links = set(zip(rng.integers(1, counts['artists'] + 1, size=len(album_ids)).tolist(), album_ids.tolist()))
+    featured = album_ids[rng.random(len(album_ids)) < 0.3]
+    links.update(zip(rng.integers(1, counts['artists'] + 1, size=len(featured)).tolist(), featured.tolist()))
+    insert_rows(cursor, "INSERT INTO artist_album_connector (artist_id, album_id) VALUES", sorted(links))
+    artist_genres = zip(range(1, counts['artists'] + 1),
+                        rng.integers(1, GENRE_COUNT + 1, size=counts['artists']).tolist())
+    insert_rows(cursor, "INSERT INTO artist_genre_connector (artist_id, genre_id) VALUES", artist_genres)
+    words = np.array(SONG_NAME_WORDS, dtype=object)
+    song_count = counts['songs']
+    names = words[rng.integers(len(words), size=song_count)] + ' ' + words[rng.integers(len(words), size=song_count)]
+    release_days = rng.integers(np.datetime64('1950-01-01').astype(int), np.datetime64('2023-01-01').astype(int),
+                                size=song_count)
+    insert_rows(cursor, "INSERT INTO songs (song_name, album, duration, song_key, release_date, is_major, energy, "
+                        "song_spotify_id) VALUES",
+                zip([f"{name} {i}" for i, name in enumerate(names)],
+                    rng.integers(1, counts['albums'] + 1, size=song_count).tolist(),
+                    rng.integers(60000, 600000, size=song_count).tolist(),
+                    rng.integers(1, len(KEYS) + 1, size=song_count).tolist(),
+                    [str(day) for day in release_days.astype('datetime64[D]')],
+                    rng.integers(0, 2, size=song_count).tolist(),
+                    rng.random(song_count).round(3).tolist(),
+                    spotify_ids(rng, song_count)))
+    connection.commit()
+    cursor.close()
+    connection.close()
+
+    generated_data_adder = GeneratedDataAdder(seed=seed_value)
+    generated_data_adder.generate_and_add_comments(counts['comments'])
+    generated_data_adder.generate_and_add_favorite_songs(counts['favorites'])
+    generated_data_adder.finish_connection()
+
+    rating_stats = RatingStatsRepository.get_instance()
+    rating_stats.create_tables()
+    rating_stats.rebuild_song_rating_stats()
+    rating_stats.rebuild_rating_rollups()
+    recommendations = RecommendationsRepository.get_instance()
+    recommendations.create_tables()
+    recommendations.rebuild_taste_profiles()
+    return counts
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the arguments of seeded_database to a benchmark's argument parser.
+    """
+    parser.add_argument('--server', choices=['local', 'existing'], default='local',
+                        help="Start a throwaway local MySQL server, or use the one the DB_* settings point at.")
+    parser.add_argument('--database', default=DEFAULT_DATABASE,
+                        help="The benchmark database. It is dropped and created from scratch when seeding.")
+    parser.add_argument('--no-seed', action='store_true',
+                        help="Reuse the benchmark database as it is, e.g. one seeded by a previous run.")
+    parser.add_argument('--scale', type=float, default=1,
+                        help=f"The size of the seeded data, in units of {ROWS_PER_SCALE}.")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+@contextlib.contextmanager
+def seeded_database(args: argparse.Namespace):
+    """
+    Sets up the database the arguments add_arguments added ask for, on a local or an existing server,
+    seeds it unless told not to, and points the settings at it.
+    :return: the (host, port, user, password) of the server, and the number of rows of each table, or None if the
+    database was not seeded.
+    """
+    if args.server == 'existing' and args.database == consts.DB_NAME and not args.no_seed:
+        raise RuntimeError(f"seeding would drop {consts.DB_NAME}, the server's own database. Pick another --database.")
+    with contextlib.ExitStack() as stack:
+        if args.server == 'local':
+            server = stack.enter_context(local_server())
+        else:
+            server = consts.DB_HOST, consts.DB_PORT, consts.DB_USER, consts.DB_PASSWORD
+        use_database(*server, args.database)
+        counts = None
+        # A throwaway server has nothing to reuse.
+        if args.server == 'local' or not args.no_seed:
+            start = time.perf_counter()
+            create_database(*server, args.database)
+            counts = seed(args.scale, args.seed)
+            print(f"seeded {counts} in {time.perf_counter() - start:.1f}s")
+        yield server, counts
+
+
+def fetch_samples(sample_size: int = 200) -> dict:
+    """
+    Draws arguments for the benchmarks out of the database use_database pointed at: the most active users, and
+    random songs and albums.
+    :param sample_size: the number of users, songs and albums drawn.
+    """
+    from db_data_inserts_preprocessing import connect
+
+    connection = connect()
+    cursor = connection.cursor()
+
+    def query(raw, *args):
+        cursor.execute(raw, args)
+        return cursor.fetchall()
+
+    # The most active users, as they are the ones with favorites and taste profiles to work with.
+    users = query("SELECT artist_id, artist_name FROM artists JOIN "
+                  "(SELECT commenter_id, COUNT(*) AS comment_count FROM comment_on_song GROUP BY commenter_id "
+                  "ORDER BY comment_count DESC LIMIT %s) AS commenters ON commenters.commenter_id = artists.artist_id;",
+                  sample_size)
+    songs = query("SELECT song_id, song_name, album_name FROM songs JOIN albums ON albums.album_id = songs.album "
+                  "ORDER BY RAND(0) LIMIT %s;", sample_size)
+    albums = [row[0] for row in query("SELECT album_name FROM albums ORDER BY RAND(0) LIMIT %s;", sample_size)]
+    genres = [row[0] for row in query("SELECT genre_name FROM genres;")]
+    max_year, min_year = query("SELECT YEAR(MAX(release_date)), YEAR(MIN(release_date)) FROM songs;")[0]
+    max_album_id = query("SELECT MAX(album_id) FROM albums;")[0][0]
+    max_artist_id = query("SELECT MAX(artist_id) FROM artists;")[0][0]
+    cursor.close()
+    connection.close()
+    return {
+        'user_ids': [row[0] for row in users],
+        'users': [row[1] for row in users],
+        'song_ids': [row[0] for row in songs],
+        'songs': [(row[1], row[2]) for row in songs],
+        'albums': albums,
+        'genres': genres,
+        'years': (min_year, max_year),
+        'max_album_id': max_album_id,
+        'max_artist_id': max_artist_id,
+    }
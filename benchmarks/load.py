@@ -0,0 +1,446 @@
+"""
+Drives the whole server with concurrent virtual users, replaying a weighted mix of what the client's pages do:
+the home page, search-as-you-type, a song's page and its comments, rating songs, adding favorites, recommendations,
+and browsing albums and artists.
+Every virtual user signs up first, then repeatedly picks an action by its weight, performs its requests one after
+the other over a keep-alive connection, and thinks for a while.
+The number of users is ramped up in stages. For every stage, the throughput and the latency percentiles are reported
+per route, along with how saturated the database connection pool was, sampled from /admin/pool_stats.
+Usage, from the repository's root:
+    python -m benchmarks.load [--server local|existing] [--scale 1] [--users 1 10 25 50 100] [--stage-duration 30]
+        [--think-time 1] [--mix search=30 home=20 ...] [--url http://host:port] [--output results.json]
+By default, the server is started (as a single gevent process) against the benchmark database, seeded as for
+benchmarks.repositories. With --url, an already running server is driven instead - it must use the same database,
+e.g. with --server existing --no-seed --database <its database>. The pool stats of a server with several worker
+processes are of whichever worker answers.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import re
+import secrets
+import subprocess
+import sys
+import time
+import urllib.parse
+from typing import Callable, Dict, List, Optional
+
+import gevent
+
+from benchmarks import fixture
+from benchmarks.repositories import RESULTS_DIRECTORY, git_commit, percentile
+from config import consts
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Runs the server in its own process, the way main.py sets it up, with gevent's WSGI server.
+# Its socket has Nagle's algorithm off, as gunicorn's do: otherwise a keep-alive response written in several sends
+# waits for the client's delayed ACK, adding some 40ms to every request.
+SERVER_SCRIPT = """
+import sys
+import main
+import socket
+from gevent.pywsgi import WSGIServer
+listener = socket.create_server((sys.argv[1], int(sys.argv[2])), backlog=2048)
+listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+WSGIServer(listener, main.app, log=None).serve_forever()
+"""
+DEFAULT_MIX = {
+    'home': 20,
+    'search': 30,
+    'song_page': 25,
+    'rate': 8,
+    'favorite': 4,
+    'recommendations': 8,
+    'browse': 5,
+}
+TOP_LIMIT = 10
+# Search-as-you-type starts searching from this many characters, and stops at this many.
+SEARCH_MIN_CHARACTERS = 2
+SEARCH_MAX_CHARACTERS = 12
+
+
+class Recorder:
+    """
+    The latencies and statuses of the requests of a stage, by route.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.latencies: Dict[str, List[float]] = {}
+        # Responses with a 4xx status, e.g. recommendations for a user without any, are expected in the mix.
+        self.client_errors: Dict[str, int] = {}
+        # Responses with a 5xx status, and requests that got no response at all.
+        self.errors: Dict[str, int] = {}
+
+    def record(self, route: str, elapsed: float, status: Optional[int]) -> None:
+        self.latencies.setdefault(route, []).append(elapsed * 1000)
+        if status is None or status >= 500:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        elif status >= 400:
+            self.client_errors[route] = self.client_errors.get(route, 0) + 1
+
+    def summary(self, duration: float) -> dict:
+        """
+        :return: the request count, throughput (requests per second), latency percentiles (in milliseconds) and error
+        counts of every route, and of all of them together.
+        """
+        def summarize(latencies: List[float], errors: int, client_errors: int) -> dict:
+            latencies = sorted(latencies)
+            result = {'requests': len(latencies), 'throughput': len(latencies) / duration, 'errors': errors,
+                      'client_errors': client_errors}
+            if latencies:
+                result.update({'p50_ms': percentile(latencies, 50), 'p95_ms': percentile(latencies, 95),
+                               'p99_ms': percentile(latencies, 99), 'max_ms': latencies[-1]})
+            return result
+
+        routes = {route: summarize(latencies, self.errors.get(route, 0), self.client_errors.get(route, 0))
+                  for route, latencies in sorted(self.latencies.items())}
+        total = summarize([latency for latencies in self.latencies.values() for latency in latencies],
+                          sum(self.errors.values()), sum(self.client_errors.values()))
+        return {'total': total, 'routes': routes}
+
+
+class Load:
+    """
+    The state shared by the virtual users: where the server is, the arguments to draw from, and the recorder of the
+    current stage.
+    """
+
+    def __init__(self, host: str, port: int, samples: dict, tag: str, think_time: float, typing_delay: float,
+                 timeout: float, admin_token: str):
+        self.host = host
+        self.port = port
+        # Sent to the admin routes, for the pool stats.
+        self.admin_token = admin_token
+        self.samples = samples
+        self.tag = tag
+        self.think_time = think_time
+        self.typing_delay = typing_delay
+        self.timeout = timeout
+        self.recorder = Recorder()
+
+
+class VirtualUser:
+    """
+    A user of the client, with their own keep-alive connection to the server.
+    """
+
+    def __init__(self, load: Load, number: int):
+        self.load = load
+        self.name = f"load user {load.tag} {number}"
+        self.random = random.Random(number)
+        self.connection = None
+        # The songs the user did not rate or add to their favorites yet, in the order they will.
+        self.unrated_songs = self.random.sample(load.samples['songs'], len(load.samples['songs']))
+        self.unfavorite_songs = self.random.sample(load.samples['songs'], len(load.samples['songs']))
+
+    def request(self, method: str, route: str, *path_args, query: Optional[dict] = None,
+                body: Optional[dict] = None) -> Optional[int]:
+        """
+        Sends a request and reads its whole response.
+        :param route: the route's rule, e.g. /songs/approx/<song_name>. Its <...> parts are replaced by path_args,
+        in order. The statistics are kept by method and rule.
+        :return: the status of the response, or None if there was no response.
+        """
+        path_args = iter(path_args)
+        path = re.sub(r'<[^>]+>', lambda _: urllib.parse.quote(str(next(path_args)), safe=''), route)
+        if query:
+            path += '?' + urllib.parse.urlencode(query)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.load.host, self.load.port,
+                                                             timeout=self.load.timeout)
+            self.connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                                    headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            status = None
+        self.load.recorder.record(f"{method} {route}", time.perf_counter() - start, status)
+        return status
+
+    def get(self, route: str, *path_args, query: Optional[dict] = None) -> Optional[int]:
+        return self.request('GET', route, *path_args, query=query)
+
+    def post(self, route: str, body: dict) -> Optional[int]:
+        return self.request('POST', route, body=body)
+
+    def pick(self, name: str):
+        values = self.load.samples[name]
+        return values[self.random.randrange(len(values))]
+
+    def sign_up(self) -> None:
+        self.post('/artists/add', {'name': self.name, 'password': 'password'})
+        self.post('/artists/login', {'name': self.name, 'password': 'password'})
+
+    def home(self) -> None:
+        self.get('/songs/top_songs/<number_of_songs>', TOP_LIMIT)
+        self.get('/albums/get_x_highest_ranked_albums', query={'num': TOP_LIMIT})
+        self.get('/artists/top_rated/<int:n>', TOP_LIMIT)
+        self.get('/songs/random/<int:limit>', TOP_LIMIT)
+        self.get('/genres/all')
+
+    def search(self) -> None:
+        song_name, album_name = self.pick('songs')
+        for length in range(SEARCH_MIN_CHARACTERS, min(len(song_name), SEARCH_MAX_CHARACTERS) + 1):
+            self.get('/songs/approx/<song_name>', song_name[:length])
+            gevent.sleep(self.load.typing_delay)
+        self.get('/songs/exact/<song_name>', song_name)
+
+    def song_page(self) -> None:
+        song_name, album_name = self.pick('songs')
+        self.get('/songs/get_by_name_and_album/<song_name>/<album_name>', song_name, album_name)
+        self.get('/comments/<song_name>/<album_name>', song_name, album_name)
+        self.get('/songs/song_rating/<song_name>/<album_name>', song_name, album_name)
+        self.get('/songs/get_in_album/<album_name>', album_name)
+
+    def rate(self) -> None:
+        # A user who rated every sampled song only views songs.
+        if not self.unrated_songs:
+            self.song_page()
+            return
+        song_name, album_name = self.unrated_songs.pop()
+        self.post('/comments/', {'song_name': song_name, 'album_name': album_name, 'artist_name': self.name,
+                                 'comment': "load test comment", 'rating': self.random.randint(1, 5)})
+        self.get('/songs/song_rating/<song_name>/<album_name>', song_name, album_name)
+
+    def favorite(self) -> None:
+        if not self.unfavorite_songs:
+            self.song_page()
+            return
+        song_name, album_name = self.unfavorite_songs.pop()
+        self.post('/favorite-songs/', {'song_name': song_name, 'album_name': album_name, 'artist_name': self.name})
+        self.get('/favorite-songs/<artist_name>', self.name)
+
+    def recommendations(self) -> None:
+        # The seeded users have taste profiles, unlike the new users.
+        username = self.pick('users')
+        self.get('/songs/get_reccomendations/<username>/<limit>', username, TOP_LIMIT)
+        self.get('/albums/get_reccomendations/<username>/<limit>', username, TOP_LIMIT)
+        self.get('/artists/get_reccomendations/<username>/<limit>', username, TOP_LIMIT)
+
+    def browse(self) -> None:
+        album_name = self.pick('albums')
+        self.get('/albums/search/<album_name>', album_name)
+        self.get('/albums/get_artists/<album_name>', album_name)
+        artist_name = self.pick('users')
+        self.get('/artists/albums/<artist_name>', artist_name)
+        self.get('/artists/rating/<artist_name>', artist_name)
+        min_year, max_year = self.load.samples['years']
+        self.get('/songs/top_songs_per_year/<number_of_songs>/<year>', TOP_LIMIT,
+                 self.random.randint(min_year, max_year))
+        self.get('/songs/get_max_min_years')
+
+    def run(self, mix: Dict[str, int]) -> None:
+        actions: List[Callable[[], None]] = [getattr(self, action) for action in mix]
+        weights = list(mix.values())
+        self.sign_up()
+        while True:
+            self.random.choices(actions, weights)[0]()
+            if self.load.think_time > 0:
+                gevent.sleep(self.random.expovariate(1 / self.load.think_time))
+
+
+def get_pool_stats(host: str, port: int, timeout: float, admin_token: str) -> Optional[dict]:
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('GET', '/admin/pool_stats', headers={'X-Admin-Token': admin_token})
+        response = connection.getresponse()
+        return json.loads(response.read()) if response.status == 200 else None
+    except (OSError, http.client.HTTPException, ValueError):
+        return None
+    finally:
+        connection.close()
+
+
+def sample_pool(load: Load, interval: float, samples: List[dict]) -> None:
+    """
+    Samples the connection pool's stats every interval seconds, until killed.
+    """
+    while True:
+        stats = get_pool_stats(load.host, load.port, load.timeout, load.admin_token)
+        if stats is not None:
+            samples.append(stats)
+        gevent.sleep(interval)
+
+
+def summarize_pool(before: Optional[dict], after: Optional[dict], samples: List[dict]) -> Optional[dict]:
+    """
+    :return: how busy the connection pool was during a stage: the mean and peak connections in use, the share of the
+    samples in which every connection was in use, the peak number of requests waiting for one, and the mean wait
+    per checkout.
+    """
+    if before is None or after is None or not samples:
+        return None
+    checkouts = after['checkouts'] - before['checkouts']
+    in_use = [sample['in_use'] for sample in samples]
+    return {
+        'max_size': after['max_size'],
+        'in_use_mean': sum(in_use) / len(in_use),
+        'in_use_peak': max(in_use),
+        'saturated_share': sum(sample['in_use'] >= sample['max_size'] for sample in samples) / len(samples),
+        'waiting_peak': max(sample['waiting'] for sample in samples),
+        'checkouts': checkouts,
+        'timeouts': after['timeouts'] - before['timeouts'],
+        'wait_mean_ms': (after['wait_time_total'] - before['wait_time_total']) / checkouts * 1000 if checkouts else 0,
+    }
+
+
+def print_stage(stage: dict) -> None:
+    total = stage['total']
+    print(f"\n{stage['users']} users: {total['requests']} requests, {total['throughput']:.1f} requests/s, "
+          f"p50 {total.get('p50_ms', 0):.1f}ms, p95 {total.get('p95_ms', 0):.1f}ms, "
+          f"p99 {total.get('p99_ms', 0):.1f}ms, {total['errors']} errors")
+    pool = stage['pool']
+    if pool is not None:
+        print(f"pool: {pool['in_use_mean']:.1f} of {pool['max_size']} connections in use on average "
+              f"(peak {pool['in_use_peak']}), saturated {pool['saturated_share']:.0%} of the time, "
+              f"up to {pool['waiting_peak']} waiting, {pool['wait_mean_ms']:.2f}ms mean wait, "
+              f"{pool['timeouts']} timeouts")
+    print(f"{'route':<70} {'requests':>9} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'errors':>7} {'4xx':>6}")
+    for route, result in stage['routes'].items():
+        print(f"{route:<70} {result['requests']:>9} {result['throughput']:>8.1f} {result['p50_ms']:>9.1f} "
+              f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>7} {result['client_errors']:>6}")
+
+
+def run_stages(load: Load, mix: Dict[str, int], users: List[int], stage_duration: float,
+               pool_interval: float) -> List[dict]:
+    """
+    Ramps the virtual users up to each of the numbers of users in turn, keeping each number for stage_duration
+    seconds. The users of a stage keep running in the next ones.
+    :return: the summary of every stage.
+    """
+    virtual_users = []
+    stages = []
+    try:
+        for user_count in users:
+            load.recorder = Recorder()
+            while len(virtual_users) < user_count:
+                virtual_users.append(gevent.spawn(VirtualUser(load, len(virtual_users)).run, mix))
+            before = get_pool_stats(load.host, load.port, load.timeout, load.admin_token)
+            pool_samples = []
+            sampler = gevent.spawn(sample_pool, load, pool_interval, pool_samples)
+            gevent.sleep(stage_duration)
+            sampler.kill()
+            stage = {'users': user_count, 'duration': time.perf_counter() - load.recorder.started}
+            stage.update(load.recorder.summary(stage['duration']))
+            after = get_pool_stats(load.host, load.port, load.timeout, load.admin_token)
+            stage['pool'] = summarize_pool(before, after, pool_samples)
+            print_stage(stage)
+            stages.append(stage)
+    finally:
+        gevent.killall(virtual_users)
+    return stages
+
+
+def parse_mix(values: Optional[List[str]]) -> Dict[str, int]:
+    """
+    :param values: action=weight pairs, overriding the weights of DEFAULT_MIX. A weight of 0 leaves an action out.
+    """
+    mix = dict(DEFAULT_MIX)
+    for value in values or []:
+        action, _, weight = value.partition('=')
+        if action not in DEFAULT_MIX or not weight.isdigit():
+            raise ValueError(f"{value} is not an action=weight pair of one of the actions {list(DEFAULT_MIX)}")
+        mix[action] = int(weight)
+    return {action: weight for action, weight in mix.items() if weight > 0}
+
+
+def start_server(server: tuple, database: str, host: str, port: int, admin_token: str, startup_timeout: float = 120):
+    """
+    Starts the server in its own process against the database, and waits for it to answer.
+    :param admin_token: the server's admin token, with which its pool stats are sampled.
+    :return: the server's process.
+    """
+    env = dict(os.environ)
+    env.update(DB_HOST=server[0], DB_PORT=str(server[1]), DB_USER=server[2], DB_PASSWORD=server[3], DB_NAME=database,
+               ADMIN_TOKEN=admin_token)
+    process = subprocess.Popen([sys.executable, '-c', SERVER_SCRIPT, host, str(port)], cwd=REPOSITORY_ROOT, env=env)
+    deadline = time.monotonic() + startup_timeout
+    while get_pool_stats(host, port, 5, admin_token) is None:
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError("the server did not start.")
+        gevent.sleep(0.5)
+    return process
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the server with a mix of concurrent virtual users.")
+    fixture.add_arguments(parser)
+    parser.add_argument('--url', help="An already running server to load, instead of starting one.")
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 25, 50, 100],
+                        help="The number of virtual users of each stage.")
+    parser.add_argument('--stage-duration', type=float, default=30, help="Seconds per stage.")
+    parser.add_argument('--think-time', type=float, default=1,
+                        help="The mean seconds a user waits between actions. 0 to send requests back to back.")
+    parser.add_argument('--typing-delay', type=float, default=0.1, help="Seconds between search-as-you-type requests.")
+    parser.add_argument('--mix', nargs='+', help=f"action=weight overrides of the default mix, {DEFAULT_MIX}.")
+    parser.add_argument('--pool-interval', type=float, default=0.5, help="Seconds between pool stats samples.")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds before a request is given up on.")
+    parser.add_argument('--output', help="Where to store the results. By default, a new file in benchmarks/results.")
+    parser.add_argument('--admin-token', default=consts.ADMIN_TOKEN,
+                        help="The admin token of the server given with --url, to sample its pool stats with. "
+                             "By default, the ADMIN_TOKEN setting.")
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    started_at = datetime.datetime.now()
+    with fixture.seeded_database(args) as (server, counts):
+        samples = fixture.fetch_samples()
+        server_process = None
+        admin_token = args.admin_token
+        if args.url:
+            url = urllib.parse.urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            host, port = '127.0.0.1', fixture.free_port()
+            # The server started here only needs a token of its own.
+            admin_token = admin_token or secrets.token_hex(16)
+            server_process = start_server(server, args.database, host, port, admin_token)
+        try:
+            load = Load(host, port, samples, started_at.strftime('%Y%m%d%H%M%S'), args.think_time, args.typing_delay,
+                        args.timeout, admin_token)
+            stages = run_stages(load, mix, args.users, args.stage_duration, args.pool_interval)
+        finally:
+            if server_process is not None:
+                server_process.terminate()
+                server_process.wait()
+
+    report = {
+        'meta': {
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'server': args.url or 'local',
+            'database_server': args.server,
+            'scale': args.scale if counts is not None else None,
+            'rows': counts,
+            'seed': args.seed,
+            'mix': mix,
+            'stage_duration': args.stage_duration,
+            'think_time': args.think_time,
+        },
+        'stages': stages,
+    }
+    output = args.output or os.path.join(RESULTS_DIRECTORY,
+                                         f"load-{report['meta']['started_at'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults stored in {output}")
@@ -0,0 +1,370 @@
+"""
+Times every public method of the repositories the routes use, against a seeded database (see benchmarks.fixture),
+and stores the latencies as JSON, so runs can be compared for regressions.
+Each method runs warm - after a few untimed calls, with the in-process caches (result caches, name -> id caches
+and the genre song sampler) kept - and cold, with those caches emptied before every call.
+Cold does not restart MySQL, so its buffer pool stays warm: it measures the cost of the queries the caches save,
+not of reading from disk.
+Usage, from the repository's root:
+    python -m benchmarks.repositories [--server local|existing] [--scale 1] [--runs 50] [--modes warm cold]
+        [--output results.json] [--compare baseline.json] [--threshold 0.2]
+The local server needs a MySQL 8 mysqld on the PATH. The existing server is the one the DB_* settings point at,
+on which the benchmark database (--database) is dropped and created from scratch, unless --no-seed is given.
+"""
+import argparse
+import datetime
+import inspect
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import types
+from typing import Callable, Dict, List, NamedTuple
+
+from benchmarks import fixture
+from config import consts
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'results')
+PAGE_SIZE = 1000
+TOP_LIMIT = 100
+RANDOM_SONGS = 20
+
+# Public methods that are not benchmarked: startup and maintenance jobs, and the helpers the write paths call
+# inside their transactions, which are timed as part of those writes.
+NOT_BENCHMARKED = {
+    'SongRepository': {'load_song_indexes', 'load_search_index', 'keep_leaderboard_synced',
+                       'add_rating_to_leaderboard'},
+    'RecommendationsRepository': {'create_tables', 'rebuild_taste_profiles', 'lock_user', 'apply_comment',
+                                  'apply_favorite', 'clear_sampler'},
+}
+
+
+class Benchmark(NamedTuple):
+    repository: str
+    method: str
+    # Called with the index of the call, so that the arguments vary between calls, and writes never repeat.
+    call: Callable[[int], object]
+
+
+def count_rows(result) -> int:
+    """
+    :return: the number of rows a repository method returned, consuming it if it is streamed.
+    """
+    if isinstance(result, types.GeneratorType):
+        return sum(len(batch) for batch in result)
+    if isinstance(result, dict):
+        return sum(len(rows) if isinstance(rows, list) else 1 for rows in result.values())
+    if isinstance(result, list):
+        return len(result)
+    return 0 if result is None else 1
+
+
+def build_benchmarks(samples: dict, tag: str) -> List[Benchmark]:
+    """
+    :param samples: the arguments to draw from, by fixture.fetch_samples.
+    :param tag: makes the names the writes add unique to this run and mode.
+    :return: the benchmarks, in the order they run. The writes run in dependency order: comments and favorites
+    are added by the users add_artist added, and add_artist_connection links the albums add_album added.
+    """
+    from repositories.albums import AlbumsRepository
+    from repositories.artists import ArtistsRepository
+    from repositories.favorite_songs import FavoriteSongsRepository
+    from repositories.recommendations import RecommendationsRepository
+    from repositories.song_comments import CommentsRepository
+    from repositories.songs import SongRepository
+
+    songs = SongRepository.get_instance()
+    albums = AlbumsRepository.get_instance()
+    artists = ArtistsRepository.get_instance()
+    comments = CommentsRepository.get_instance()
+    favorite_songs = FavoriteSongsRepository.get_instance()
+    recommendations = RecommendationsRepository.get_instance()
+
+    def pick(name: str) -> Callable[[int], object]:
+        values = samples[name]
+        return lambda i: values[i % len(values)]
+
+    song, album, user, user_id, genre = pick('songs'), pick('albums'), pick('users'), pick('user_ids'), pick('genres')
+    song_ids = samples['song_ids']
+    min_year, max_year = samples['years']
+    years = max_year - min_year + 1
+    genres = samples['genres']
+
+    def new_artist(i: int) -> str:
+        return f"bench artist {tag} {i}"
+
+    def new_album(i: int) -> str:
+        return f"bench album {tag} {i}"
+
+    return [
+        Benchmark('SongRepository', 'approx_song_search_with_artist_and_album',
+                  lambda i: songs.approx_song_search_with_artist_and_album(song(i)[0].split()[0])),
+        Benchmark('SongRepository', 'exact_song_search_with_artist_and_album',
+                  lambda i: songs.exact_song_search_with_artist_and_album(song(i)[0])),
+        Benchmark('SongRepository', 'get_songs_with_artist_and_album_by_ids',
+                  lambda i: songs.get_songs_with_artist_and_album_by_ids(
+                      [song_ids[(i + j) % len(song_ids)] for j in range(RANDOM_SONGS)])),
+        Benchmark('SongRepository', 'get_song_by_song_name_and_album_name',
+                  lambda i: songs.get_song_by_song_name_and_album_name(*song(i))),
+        Benchmark('SongRepository', 'get_songs_in_album', lambda i: songs.get_songs_in_album(song(i)[1])),
+        Benchmark('SongRepository', 'get_song_rating', lambda i: songs.get_song_rating(*song(i))),
+        Benchmark('SongRepository', 'get_top_rated_songs', lambda i: songs.get_top_rated_songs(TOP_LIMIT)),
+        Benchmark('SongRepository', 'get_top_rated_songs_per_year',
+                  lambda i: songs.get_top_rated_songs_per_year(min_year + i % years, 10)),
+        Benchmark('SongRepository', 'get_top_rated_songs_per_years',
+                  lambda i: songs.get_top_rated_songs_per_years(min_year, max_year, 10)),
+        Benchmark('SongRepository', 'get_max_and_min_song_years', lambda i: songs.get_max_and_min_song_years()),
+        Benchmark('SongRepository', 'get_random', lambda i: songs.get_random(RANDOM_SONGS)),
+        Benchmark('AlbumsRepository', 'get_all_albums',
+                  lambda i: albums.get_all_albums(i * PAGE_SIZE % samples['max_album_id'], PAGE_SIZE)),
+        Benchmark('AlbumsRepository', 'get_album_artists', lambda i: albums.get_album_artists(album(i))),
+        Benchmark('AlbumsRepository', 'get_album_by_name', lambda i: albums.get_album_by_name(album(i))),
+        Benchmark('AlbumsRepository', 'get_all_albums_ratings',
+                  lambda i: albums.get_all_albums_ratings(i * PAGE_SIZE % samples['max_album_id'], PAGE_SIZE)),
+        Benchmark('AlbumsRepository', 'get_x_highest_ranked_albums',
+                  lambda i: albums.get_x_highest_ranked_albums(TOP_LIMIT)),
+        Benchmark('ArtistsRepository', 'get_all_artists',
+                  lambda i: artists.get_all_artists(i * PAGE_SIZE % samples['max_artist_id'], PAGE_SIZE)),
+        Benchmark('ArtistsRepository', 'get_artist_by_name', lambda i: artists.get_artist_by_name(user(i))),
+        Benchmark('ArtistsRepository', 'login_artist_check',
+                  lambda i: artists.login_artist_check(user(i), "password")),
+        Benchmark('ArtistsRepository', 'get_artist_albums', lambda i: artists.get_artist_albums(user_id(i))),
+        Benchmark('ArtistsRepository', 'get_artist_albums_by_name',
+                  lambda i: artists.get_artist_albums_by_name(user(i))),
+        Benchmark('ArtistsRepository', 'get_artist_avg_rating', lambda i: artists.get_artist_avg_rating(user(i))),
+        Benchmark('ArtistsRepository', 'get_highest_rated_artists',
+                  lambda i: artists.get_highest_rated_artists(TOP_LIMIT)),
+        Benchmark('CommentsRepository', 'get_comments_on_song', lambda i: comments.get_comments_on_song(*song(i))),
+        Benchmark('FavoriteSongsRepository', 'get_favorite_songs',
+                  lambda i: favorite_songs.get_favorite_songs(user(i))),
+        Benchmark('RecommendationsRepository', 'get_best_genres',
+                  lambda i: recommendations.get_best_genres(user(i), 3)),
+        Benchmark('RecommendationsRepository', 'get_recommendation_info_by_liked_songs',
+                  lambda i: recommendations.get_recommendation_info_by_liked_songs(user(i))),
+        Benchmark('RecommendationsRepository', 'get_recommendations_by_liked_genres',
+                  lambda i: recommendations.get_recommendations_by_liked_genres(
+                      {genres[(i + j) % len(genres)]: 1 for j in range(3)}, 10)),
+        Benchmark('ArtistsRepository', 'add_artist', lambda i: artists.add_artist(new_artist(i), "password")),
+        Benchmark('ArtistsRepository', 'link_artist_to_genre',
+                  lambda i: artists.link_artist_to_genre(new_artist(i), genre(i))),
+        Benchmark('AlbumsRepository', 'add_album', lambda i: albums.add_album(new_album(i), "")),
+        Benchmark('AlbumsRepository', 'add_artist_connection',
+                  lambda i: albums.add_artist_connection(new_album(i), user(i))),
+        Benchmark('SongRepository', 'add_song',
+                  lambda i: songs.add_song(f"bench song {tag} {i}", album(i), user(i), "", 200000, "C", "2000-01-01",
+                                           True, 0.5)),
+        Benchmark('CommentsRepository', 'add_comment_to_song',
+                  lambda i: comments.add_comment_to_song(*song(i), new_artist(i), "bench comment", i % 5 + 1)),
+        Benchmark('FavoriteSongsRepository', 'add_favorite_song',
+                  lambda i: favorite_songs.add_favorite_song(*song(i), new_artist(i))),
+    ]
+
+
+def unbenchmarked_methods(benchmarks: List[Benchmark]) -> List[str]:
+    """
+    :return: the public methods of the benchmarked repositories that have no benchmark and are not known to be
+    left out, so that new methods are not silently left out.
+    """
+    from repositories.albums import AlbumsRepository
+    from repositories.artists import ArtistsRepository
+    from repositories.favorite_songs import FavoriteSongsRepository
+    from repositories.recommendations import RecommendationsRepository
+    from repositories.song_comments import CommentsRepository
+    from repositories.songs import SongRepository
+
+    benchmarked = {(benchmark.repository, benchmark.method) for benchmark in benchmarks}
+    missing = []
+    for repository in (SongRepository, AlbumsRepository, ArtistsRepository, CommentsRepository,
+                       FavoriteSongsRepository, RecommendationsRepository):
+        skipped = NOT_BENCHMARKED.get(repository.__name__, set())
+        for method, _ in inspect.getmembers(repository, inspect.isfunction):
+            if (not method.startswith('_') and method not in skipped and method != 'get_instance'
+                    and (repository.__name__, method) not in benchmarked):
+                missing.append(f"{repository.__name__}.{method}")
+    return missing
+
+
+def clear_caches() -> None:
+    """
+    Empties every in-process cache the repositories keep.
+    """
+    from repositories.ids import IdsRepository
+    from repositories.recommendations import RecommendationsRepository
+    from repositories.result_cache import invalidate_results, result_cache_stats
+
+    invalidate_results(*result_cache_stats().keys())
+    IdsRepository.get_instance().clear()
+    RecommendationsRepository.get_instance().clear_sampler()
+
+
+def percentile(latencies: List[float], p: float) -> float:
+    """
+    :return: the nearest rank p-th percentile of the sorted latencies.
+    """
+    return latencies[max(math.ceil(p / 100 * len(latencies)) - 1, 0)]
+
+
+def run_benchmark(benchmark: Benchmark, runs: int, warmup: int, cold: bool) -> dict:
+    """
+    Calls a benchmark warmup times untimed, then runs times timed.
+    Calls that fail (e.g. a write of a name that already exists) are counted, and left out of the latencies.
+    :return: the latency percentiles (in milliseconds), the mean number of rows returned and the number of errors.
+    """
+    latencies = []
+    rows = 0
+    errors = 0
+    first_error = None
+    for i in range(warmup + runs):
+        if cold:
+            clear_caches()
+        start = time.perf_counter()
+        try:
+            row_count = count_rows(benchmark.call(i))
+        except Exception as e:
+            if i >= warmup:
+                errors += 1
+            if first_error is None:
+                first_error = str(e)
+            continue
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            rows += row_count
+    latencies.sort()
+    result = {'runs': len(latencies), 'errors': errors, 'rows': rows / len(latencies) if latencies else 0}
+    if latencies:
+        result.update({
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'mean_ms': sum(latencies) / len(latencies),
+            'max_ms': latencies[-1],
+        })
+    if first_error is not None:
+        result['first_error'] = first_error
+    return result
+
+
+def print_results(mode: str, results: Dict[str, dict]) -> None:
+    print(f"\n{mode}:")
+    print(f"{'method':<70} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'rows':>8} {'errors':>7}")
+    for name, result in results.items():
+        if result['runs'] == 0:
+            print(f"{name:<70} {'failed':>10} {'-':>10} {'-':>10} {'-':>8} {result['errors']:>7}"
+                  f"  {result.get('first_error', '')[:200]}")
+            continue
+        print(f"{name:<70} {result['p50_ms']:>10.2f} {result['p95_ms']:>10.2f} {result['p99_ms']:>10.2f} "
+              f"{result['rows']:>8.0f} {result['errors']:>7}")
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """
+    Prints the change of every benchmark's p50 and p95 since the baseline run.
+    :param threshold: the relative slowdown of the p50 above which a benchmark is a regression, e.g. 0.2 for 20%.
+    :return: the regressed benchmarks.
+    """
+    regressions = []
+    print(f"\ncompared to {baseline['meta']['started_at']} ({baseline['meta']['commit'] or 'unknown commit'}):")
+    print(f"{'method':<76} {'p50 (ms)':>20} {'p95 (ms)':>20} {'p50 change':>10}")
+    for mode, results in current['results'].items():
+        baseline_results = baseline['results'].get(mode, {})
+        for name, result in results.items():
+            old = baseline_results.get(name)
+            if old is None or 'p50_ms' not in old or 'p50_ms' not in result:
+                continue
+            change = result['p50_ms'] / old['p50_ms'] - 1 if old['p50_ms'] else 0.0
+            regressed = change > threshold
+            if regressed:
+                regressions.append(f"{mode} {name}")
+            p50 = f"{old['p50_ms']:.2f} -> {result['p50_ms']:.2f}"
+            p95 = f"{old['p95_ms']:.2f} -> {result['p95_ms']:.2f}"
+            print(f"{mode + ' ' + name:<76} {p50:>20} {p95:>20} {change:>+10.0%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(args, counts) -> dict:
+    """
+    Runs the benchmarks against the database seeded_database set up.
+    :return: the results, in the format they are stored in.
+    """
+    if args.load_indexes:
+        from repositories.songs import SongRepository
+        SongRepository.get_instance().load_song_indexes()
+
+    started_at = datetime.datetime.now()
+    tag = started_at.strftime('%Y%m%d%H%M%S')
+    samples = fixture.fetch_samples()
+    if not args.only:
+        for method in unbenchmarked_methods(build_benchmarks(samples, tag)):
+            print(f"not benchmarked: {method}")
+
+    results = {}
+    for mode in args.modes:
+        # The writes add names unique to the mode, as the warm and cold runs add the same number of rows.
+        benchmarks = [benchmark for benchmark in build_benchmarks(samples, f"{tag} {mode}")
+                      if not args.only or any(only in f"{benchmark.repository}.{benchmark.method}"
+                                              for only in args.only)]
+        clear_caches()
+        results[mode] = {f"{benchmark.repository}.{benchmark.method}":
+                         run_benchmark(benchmark, args.runs, args.warmup if mode == 'warm' else 0, mode == 'cold')
+                         for benchmark in benchmarks}
+        print_results(mode, results[mode])
+    return {
+        'meta': {
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'server': args.server,
+            'scale': args.scale if counts is not None else None,
+            'rows': counts,
+            'seed': args.seed,
+            'runs': args.runs,
+            'warmup': args.warmup,
+            'load_indexes': args.load_indexes,
+            'result_cache': consts.RESULT_CACHE_ENABLED,
+            'prepared_statements': consts.DB_PREPARED_STATEMENTS,
+            'python': sys.version.split()[0],
+        },
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the repositories against a seeded database.")
+    fixture.add_arguments(parser)
+    parser.add_argument('--runs', type=int, default=50, help="Timed calls per method and mode.")
+    parser.add_argument('--warmup', type=int, default=5, help="Untimed calls per method before the warm runs.")
+    parser.add_argument('--modes', nargs='+', choices=['warm', 'cold'], default=['warm', 'cold'])
+    parser.add_argument('--only', nargs='+', help="Only run the methods whose Repository.method contains one of these.")
+    parser.add_argument('--load-indexes', action='store_true',
+                        help="Load the in-memory song id table and search index first, as the server does.")
+    parser.add_argument('--output', help="Where to store the results. By default, a new file in benchmarks/results.")
+    parser.add_argument('--compare', help="Results of a previous run to compare with.")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="The relative p50 slowdown reported as a regression by --compare.")
+    args = parser.parse_args()
+
+    with fixture.seeded_database(args) as (_, counts):
+        report = run(args, counts)
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY,
+                                         f"repositories-{report['meta']['started_at'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\nresults stored in {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
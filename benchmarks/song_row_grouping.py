@@ -0,0 +1,84 @@
+"""
+Compares the song routes' old way of merging the rows of multi-artist songs (a list membership check and
+list.index per row, both linear scans) with group_song_rows (a single pass with a dict).
+Does not need a database.
+Usage, from the repository's root:
+    python -m benchmarks.song_row_grouping [--sizes 1000 10000 100000] [--max-legacy-rows 10000]
+"""
+import argparse
+import datetime
+import random
+import string
+import time
+
+from routes.songs import SongWithArtistAndAlbum, group_song_rows
+
+# The share of songs that have a second row, for a second artist.
+MULTI_ARTIST_RATIO = 0.3
+
+
+def gen_rows(count: int) -> list:
+    """
+    Generates rows in the format of the song searches, with some songs spanning 2 rows.
+    """
+    rows = []
+    song_num = 0
+    while len(rows) < count:
+        spotify_id = ''.join(random.choices(string.ascii_letters + string.digits, k=22))
+        song = [f"song {song_num}", 200000, 'C', datetime.date(2000, 1, 1), 1, 0.5, spotify_id, f"artist {song_num}",
+                song_num, f"album {song_num}"]
+        rows.append(tuple(song))
+        if random.random() < MULTI_ARTIST_RATIO and len(rows) < count:
+            song[7] = f"featured artist {song_num}"
+            rows.append(tuple(song))
+        song_num += 1
+    return rows
+
+
+def legacy_group_song_rows(rows: list) -> list:
+    """
+    The grouping the song routes did before group_song_rows.
+    """
+    song_list = []
+    for song in rows:
+        song_item = SongWithArtistAndAlbum.from_search_row(song)
+        if song_item not in song_list:
+            song_list.append(song_item)
+        else:
+            song_list[song_list.index(song_item)].add_artist(song[7])
+    return song_list
+
+
+def time_call(f, *args) -> tuple:
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the grouping of song rows into songs.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--max-legacy-rows', type=int, default=10000,
+                        help="Larger sizes estimate the legacy time from the largest measured one, as it is quadratic.")
+    args = parser.parse_args()
+
+    legacy_measured = None
+    print(f"{'rows':>8} {'legacy (s)':>14} {'group_song_rows (s)':>20} {'speedup':>10}")
+    for size in args.sizes:
+        rows = gen_rows(size)
+        new_time, songs = time_call(group_song_rows, rows, SongWithArtistAndAlbum.from_search_row, 6, 7)
+        if size <= args.max_legacy_rows:
+            legacy_time, legacy_songs = time_call(legacy_group_song_rows, rows)
+            # Both must give the exact same output.
+            assert [song.to_dict() for song in songs] == [song.to_dict() for song in legacy_songs]
+            legacy_measured = (size, legacy_time)
+            legacy_text = f"{legacy_time:.4f}"
+        elif legacy_measured is not None:
+            measured_size, measured_time = legacy_measured
+            legacy_time = measured_time * (size / measured_size) ** 2
+            legacy_text = f"~{legacy_time:.1f} (est.)"
+        else:
+            legacy_time = None
+            legacy_text = "skipped"
+        speedup = f"{legacy_time / new_time:.0f}x" if legacy_time is not None else "-"
+        print(f"{size:>8} {legacy_text:>14} {new_time:>20.4f} {speedup:>10}")
@@ -4,6 +4,104 @@ from dotenv import load_dotenv
 load_dotenv("config/.env")
 
 DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = int(os.getenv("DB_PORT", "3306"))
 DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "1234")
-DB_NAME = os.getenv("DB_NAME", "music_social_network")
\ No newline at end of file
+DB_NAME = os.getenv("DB_NAME", "music_social_network")
+
+# Connection pool settings. Timeouts and ages are in seconds.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# The secret the admin routes require in the X-Admin-Token header, and profiled requests in the X-Profile header.
+# While it is empty, the admin routes and profiling are off.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Server side prepared statements, cached per connection. Can also be switched at runtime via the admin routes.
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "1") == "1"
+DB_PREPARED_STATEMENTS_PER_CONNECTION = int(os.getenv("DB_PREPARED_STATEMENTS_PER_CONNECTION", "64"))
+
+# How many rows the streamed list endpoints read from the database and send to the client at a time.
+DB_STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "1000"))
+# The most ids a single query looks up with an IN (...) list. Longer lists of ids are looked up in several queries.
+DB_ID_BATCH_SIZE = int(os.getenv("DB_ID_BATCH_SIZE", "1000"))
+
+# Song name search index. When enabled, it is built in the background on startup, or loaded from the snapshot file
+# if one is set and exists. An empty snapshot path disables snapshots.
+# The approximate song search returns at most SONG_SEARCH_MAX_RESULTS songs.
+SONG_SEARCH_INDEX_ENABLED = os.getenv("SONG_SEARCH_INDEX_ENABLED", "1") == "1"
+SONG_SEARCH_INDEX_SNAPSHOT = os.getenv("SONG_SEARCH_INDEX_SNAPSHOT", "")
+SONG_SEARCH_MAX_RESULTS = int(os.getenv("SONG_SEARCH_MAX_RESULTS", "200"))
+
+# The most random songs a single request can ask for. Larger limits are lowered to it.
+RANDOM_SONGS_MAX_LIMIT = int(os.getenv("RANDOM_SONGS_MAX_LIMIT", "1000"))
+
+# Concurrent identical read queries of the heavy read paths share a single execution. A query that waited
+# SINGLE_FLIGHT_TIMEOUT seconds for an identical one to finish runs by itself.
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1"
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "30"))
+
+# Name to id caches, per kind of name (artists, albums, genres and songs). Names that do not exist are cached for
+# NAME_ID_CACHE_MISSING_TTL seconds. NAME_ID_CACHE_WARM_SIZE ids of each kind are loaded on startup.
+NAME_ID_CACHE_SIZE = int(os.getenv("NAME_ID_CACHE_SIZE", "100000"))
+NAME_ID_CACHE_MISSING_TTL = float(os.getenv("NAME_ID_CACHE_MISSING_TTL", "60"))
+NAME_ID_CACHE_WARM_SIZE = int(os.getenv("NAME_ID_CACHE_WARM_SIZE", "10000"))
+
+# Cached results of the leaderboard and catalog wide queries. TTLs are in seconds. Leaderboards are fetched with a
+# limit of at least RESULT_CACHE_MIN_LIMIT, so that smaller limits are served out of the same cached result.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_LEADERBOARD_TTL = float(os.getenv("RESULT_CACHE_LEADERBOARD_TTL", "60"))
+RESULT_CACHE_CATALOG_TTL = float(os.getenv("RESULT_CACHE_CATALOG_TTL", "3600"))
+RESULT_CACHE_MIN_LIMIT = int(os.getenv("RESULT_CACHE_MIN_LIMIT", "100"))
+
+# The most top songs per year a single request for a range of years can ask for. Larger limits are lowered to it.
+TOP_SONGS_PER_YEARS_MAX_LIMIT = int(os.getenv("TOP_SONGS_PER_YEARS_MAX_LIMIT", "100"))
+
+# The in-memory top songs leaderboard. Songs need LEADERBOARD_MIN_RATINGS ratings to be ranked, and a prior weight
+# above 0 ranks them by a Bayesian average, as if each had that many extra ratings of the mean rating.
+# Top song requests for more than LEADERBOARD_MAX_SIZE songs go to the database.
+LEADERBOARD_ENABLED = os.getenv("LEADERBOARD_ENABLED", "1") == "1"
+LEADERBOARD_MAX_SIZE = int(os.getenv("LEADERBOARD_MAX_SIZE", "1000"))
+LEADERBOARD_MIN_RATINGS = int(os.getenv("LEADERBOARD_MIN_RATINGS", "1"))
+LEADERBOARD_PRIOR_WEIGHT = float(os.getenv("LEADERBOARD_PRIOR_WEIGHT", "0"))
+LEADERBOARD_RESYNC_INTERVAL = float(os.getenv("LEADERBOARD_RESYNC_INTERVAL", "600"))
+
+# How many rows db_data_inserts_preprocessing.py reads from a csv file at a time, and inserts with each multi-row
+# INSERT statement.
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "10000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# The file the import's progress is saved to, so an interrupted import can be resumed, and how often (in seconds)
+# the import reports its progress.
+IMPORT_CHECKPOINT_FILE = os.getenv("IMPORT_CHECKPOINT_FILE", "import_checkpoint.json")
+IMPORT_PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", "10"))
+# The Zipf exponents of the generated data's song popularity and user activity. Higher is more skewed, 0 is uniform.
+GENERATED_SONG_ZIPF_EXPONENT = float(os.getenv("GENERATED_SONG_ZIPF_EXPONENT", "1.0"))
+GENERATED_USER_ZIPF_EXPONENT = float(os.getenv("GENERATED_USER_ZIPF_EXPONENT", "0.8"))
+
+# How long (in seconds) the recommendations use a genre's list of songs before reloading it from the database.
+RECOMMENDATION_SAMPLER_TTL = float(os.getenv("RECOMMENDATION_SAMPLER_TTL", "600"))
+# The most recommendations of each genre a single request can ask for. Larger limits are lowered to it.
+RECOMMENDATIONS_MAX_LIMIT = int(os.getenv("RECOMMENDATIONS_MAX_LIMIT", "100"))
+
+# Per route and per query metrics, served on /metrics. Queries beyond METRICS_MAX_QUERIES distinct fingerprints are
+# measured together.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_MAX_QUERIES = int(os.getenv("METRICS_MAX_QUERIES", "1000"))
+
+# The slow query log, served on /admin/slow_queries. Queries taking at least SLOW_QUERY_THRESHOLD seconds (0 to log
+# none) are kept, up to SLOW_QUERY_LOG_SIZE of them, and each query's plan is captured with EXPLAIN at most once per
+# SLOW_QUERY_EXPLAIN_INTERVAL seconds. If SLOW_QUERY_LOG_FILE is set, they are also appended to it as json lines.
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.5"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "500"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE", "")
+
+# On demand profiling of single requests: a request with an X-Profile header holding ADMIN_TOKEN runs under cProfile.
+# The latest PROFILE_STORE_SIZE profiles are kept, served on /admin/profiles, each with the PROFILE_STATS_LIMIT
+# functions that took the most time.
+PROFILE_STORE_SIZE = int(os.getenv("PROFILE_STORE_SIZE", "20"))
+PROFILE_STATS_LIMIT = int(os.getenv("PROFILE_STATS_LIMIT", "50"))
@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+
+_CONNECTION_ERRORS = (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError)
+
+
+class PoolTimeoutError(Exception):
+    """
+    Raised when no connection could be checked out of the pool before the checkout timeout expired.
+    """
+    pass
+
+
+class ConnectionPool:
+    """
+    A pool of MySQL connections shared by all the repositories.
+    Connections are checked out per query and returned right after, so greenlets (main.py patches everything
+    with gevent) each get their own socket instead of serializing on a single global connection.
+    The pool only uses threading primitives, which gevent's monkey patching turns into greenlet aware ones.
+    """
+
+    def __init__(self, connect_args: dict, min_size: int = 1, max_size: int = 10, timeout: float = 10.0,
+                 recycle: float = 3600.0, pre_ping: bool = True):
+        """
+        :param connect_args: keyword arguments passed to mysql.connector.connect for every new connection.
+        :param min_size: the number of connections opened up front by warm.
+        :param max_size: the maximal number of connections open at the same time.
+        :param timeout: how long (in seconds) a checkout waits for a free connection before giving up.
+        :param recycle: connections older than this (in seconds) are closed and replaced on checkout.
+        0 or less disables recycling.
+        :param pre_ping: whether to ping a connection before handing it out, replacing it if it is dead.
+        """
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"illegal pool size bounds: min {min_size}, max {max_size}")
+        self._connect_args = connect_args
+        self._min_size = min_size
+        self._max_size = max_size
+        self._timeout = timeout
+        self._recycle = recycle
+        self._pre_ping = pre_ping
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._created_at = {}
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def warm(self) -> None:
+        """
+        Opens connections until the pool has at least its min size of them.
+        Not done on construction, so that importing the modules that use the pool does not require a database.
+        """
+        while True:
+            with self._cond:
+                if self._size >= self._min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def _open(self):
+        conn = mysql.connector.connect(**self._connect_args)
+        self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _close(self, conn) -> None:
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        # The connection is being thrown away anyway, so a failure to close it cleanly does not matter.
+        except Exception:
+            pass
+
+    def _validate(self, conn):
+        """
+        Makes sure a connection taken from the idle queue is usable, replacing it if it is too old or dead.
+        """
+        created_at = self._created_at.get(id(conn), 0.0)
+        if 0 < self._recycle < time.monotonic() - created_at:
+            self._close(conn)
+            self._recycled += 1
+            return self._open()
+        if self._pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._close(conn)
+                self._ping_failures += 1
+                return self._open()
+        return conn
+
+    def acquire(self):
+        """
+        Checks a connection out of the pool, waiting up to the pool's timeout for one to be returned if the pool
+        is at its max size.
+        :return: an open connection. Must be given back via release.
+        """
+        start = time.perf_counter()
+        deadline = start + self._timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    # Take the most recently used connection, it is the least likely to have gone stale.
+                    conn = self._idle.pop()
+                    break
+                if self._size < self._max_size:
+                    # Reserve a slot, the connection itself is opened outside the lock.
+                    self._size += 1
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(f"no database connection became available within {self._timeout}s")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+        try:
+            conn = self._open() if conn is None else self._validate(conn)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        waited = time.perf_counter() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+        return conn
+
+    def release(self, conn, discard: bool = False) -> None:
+        """
+        Returns a connection to the pool.
+        :param conn: a connection previously returned by acquire.
+        :param discard: close the connection instead of reusing it, e.g. after it errored at the socket level.
+        """
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+        if discard:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager version of acquire / release.
+        Connections that failed at the connection level (directly or as the cause of a wrapping exception)
+        are discarded rather than returned to the pool.
+        """
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception as e:
+            discard = isinstance(e, _CONNECTION_ERRORS) or isinstance(e.__cause__, _CONNECTION_ERRORS)
+            raise
+        finally:
+            self.release(conn, discard)
+
+    def close_all(self) -> None:
+        """
+        Closes every idle connection. Connections that are currently checked out are not affected.
+        """
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        """
+        :return: a snapshot of the pool's state and counters. Wait times are in seconds.
+        """
+        with self._cond:
+            return {
+                'min_size': self._min_size,
+                'max_size': self._max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'recycled': self._recycled,
+                'ping_failures': self._ping_failures,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+                'wait_time_avg': self._wait_time_total / self._checkouts if self._checkouts else 0.0,
+            }
@@ -1,9 +1,18 @@
+import argparse
 import csv
+import functools
+import itertools
+import json
+import multiprocessing
+import os
 import string
 import time
+import zlib
 
 import mysql.connector
+import numpy as np
 import random
+from mysql.connector import errorcode
 
 from config import consts
 
@@ -29,21 +38,352 @@ def gen_rand_string(length):
     return ''.join(random.choice(letters) for i in range(length))
 
 
-@timed
 def read_csv(filename):
+    """
+    Reads a csv file one row at a time, instead of all at once.
+    :return: a generator of the file's rows.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        yield from csv.reader(f)
+
+
+def read_csv_chunks(filename, chunk_size):
+    """
+    Reads a csv file one chunk of rows at a time, instead of all at once.
+    :return: a generator of lists of up to chunk_size rows.
+    """
     with open(filename, 'r', encoding='utf-8') as f:
         reader = csv.reader(f)
-        return list(reader)
+        while True:
+            rows = list(itertools.islice(reader, chunk_size))
+            if len(rows) == 0:
+                return
+            yield rows
+
+
+def insert_rows(cursor, statement, rows, batch_size=consts.IMPORT_BATCH_SIZE):
+    """
+    Inserts rows with multi-row INSERT statements, instead of a statement (and a round trip) per row.
+    :param cursor: the cursor to insert with.
+    :param statement: the INSERT statement up to and including its VALUES keyword. The rows are appended to it.
+    :param rows: an iterable of tuples, all of the same length.
+    :param batch_size: the number of rows inserted by each statement.
+    :return: the number of rows inserted. Rows an INSERT IGNORE skipped are not counted.
+    """
+    rows = iter(rows)
+    inserted = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if len(batch) == 0:
+            return inserted
+        row_placeholder = '(' + ', '.join(['%s'] * len(batch[0])) + ')'
+        cursor.execute(f"{statement} {', '.join([row_placeholder] * len(batch))}",
+                       [value for row in batch for value in row])
+        inserted += cursor.rowcount
 
 
 def connect():
     return mysql.connector.connect(
         host=consts.DB_HOST,
+        port=consts.DB_PORT,
         user=consts.DB_USER,
         password=consts.DB_PASSWORD,
         database=consts.DB_NAME,)
 
 
+# The import stages: (staging table, statement inserting the stage's rows, statement moving the staged rows to their
+# table). The rows of the track features stages name their artists, albums and keys, so they are staged into
+# temporary tables, and moved by joining on the names. The generated data is inserted directly.
+# All of them skip duplicates, so running a stage with the same rows again inserts nothing.
+IMPORT_STAGES = {
+    'artists': ('staged_artists', "INSERT IGNORE INTO staged_artists VALUES",
+                "INSERT IGNORE INTO artists (artist_name, pwd, artist_spotify_id) "
+                "SELECT artist_name, pwd, artist_spotify_id FROM staged_artists;"),
+    'albums': ('staged_albums', "INSERT IGNORE INTO staged_albums VALUES",
+               "INSERT IGNORE INTO albums (album_name, album_spotify_id) "
+               "SELECT album_name, album_spotify_id FROM staged_albums;"),
+    'artist_albums': ('staged_artist_albums', "INSERT IGNORE INTO staged_artist_albums VALUES",
+                      "INSERT IGNORE INTO artist_album_connector (artist_id, album_id) "
+                      "SELECT artists.artist_id, albums.album_id FROM staged_artist_albums AS staged "
+                      "JOIN artists ON artists.artist_name = staged.artist_name "
+                      "JOIN albums ON albums.album_name = staged.album_name;"),
+    # Every album was added by the albums stage, so unlike the add_song procedure, this never needs to create one.
+    'songs': ('staged_songs', "INSERT IGNORE INTO staged_songs VALUES",
+              "INSERT IGNORE INTO songs "
+              "(song_name, album, duration, song_key, release_date, is_major, energy, song_spotify_id) "
+              "SELECT song_name, albums.album_id, duration, musical_scales.scale_id, release_date, "
+              "is_major, energy, NULLIF(song_spotify_id, '') FROM staged_songs AS staged "
+              "JOIN albums ON albums.album_name = staged.album_name "
+              "JOIN musical_scales ON musical_scales.scale_name = staged.song_key;"),
+    'comments': (None, "INSERT IGNORE INTO comment_on_song VALUES", None),
+    'favorites': (None, "INSERT IGNORE INTO favorite_songs VALUES", None),
+    'artist_genres': (None, "INSERT IGNORE INTO artist_genre_connector (artist_id, genre_id) VALUES", None),
+}
+
+
+def create_staging_tables(cursor):
+    """
+    Creates the temporary staging tables of the import stages, for the cursor's connection.
+    The staging tables copy their columns' types from the real tables, so the joins compare names
+    with the same collation the unique keys use.
+    """
+    cursor.execute("CREATE TEMPORARY TABLE staged_artists (INDEX (artist_name)) "
+                   "SELECT artist_name, pwd, artist_spotify_id FROM artists LIMIT 0;")
+    cursor.execute("CREATE TEMPORARY TABLE staged_albums (INDEX (album_name)) "
+                   "SELECT album_name, album_spotify_id FROM albums LIMIT 0;")
+    cursor.execute("CREATE TEMPORARY TABLE staged_artist_albums (INDEX (artist_name), INDEX (album_name)) "
+                   "SELECT artist_name, album_name FROM artists JOIN albums LIMIT 0;")
+    cursor.execute("CREATE TEMPORARY TABLE staged_songs (INDEX (album_name)) "
+                   "SELECT song_name, album_name, song_spotify_id, duration, scale_name AS song_key, "
+                   "release_date, is_major, energy FROM songs JOIN albums JOIN musical_scales LIMIT 0;")
+
+
+def import_rows(cursor, stage, rows):
+    """
+    Inserts rows of an import stage into their table, through the stage's staging table if it has one.
+    :return: the number of rows inserted into the stage's table.
+    """
+    staging_table, insert_statement, move_statement = IMPORT_STAGES[stage]
+    if staging_table is not None:
+        cursor.execute(f"DELETE FROM {staging_table};")
+    inserted = insert_rows(cursor, insert_statement, rows)
+    if move_statement is None:
+        return inserted
+    cursor.execute(move_statement)
+    return cursor.rowcount
+
+
+# The connection of an import worker process, opened by init_import_worker.
+_worker_connection = None
+# How many times a worker tries to import its part of a stage, when it fails on a deadlock with another worker.
+IMPORT_PART_ATTEMPTS = 3
+
+
+def init_import_worker():
+    global _worker_connection
+    _worker_connection = connect()
+    create_staging_tables(_worker_connection.cursor())
+
+
+def import_part(stage_and_rows):
+    """
+    Imports a part of a stage's rows in a worker process, in a single transaction.
+    :return: the worker's process id, the number of rows, the number of rows inserted, and how long (in seconds)
+    importing them took.
+    """
+    stage, rows = stage_and_rows
+    start = time.perf_counter()
+    cursor = _worker_connection.cursor()
+    inserted = 0
+    for attempt in range(1, IMPORT_PART_ATTEMPTS + 1):
+        try:
+            inserted = import_rows(cursor, stage, rows)
+            _worker_connection.commit()
+            break
+        # The stages only skip duplicates, so a part that was rolled back can simply be imported again.
+        except mysql.connector.errors.DatabaseError as e:
+            _worker_connection.rollback()
+            if e.errno not in (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT) \
+                    or attempt == IMPORT_PART_ATTEMPTS:
+                raise
+    cursor.close()
+    return os.getpid(), len(rows), inserted, time.perf_counter() - start
+
+
+def import_in_parallel(pool, workers, stage, rows, key, throughput):
+    """
+    Imports the rows of a stage with a pool of worker processes, each with its own connection.
+    Rows are deduplicated by key, sorted by it and split into a contiguous range per worker, so that rows that
+    would be duplicates of each other are always imported by the same worker, and which of them is imported
+    does not depend on the workers' timing.
+    :param pool: a multiprocessing pool, initialized with init_import_worker.
+    :param workers: the number of worker processes in the pool.
+    :param stage: the name of the stage, from IMPORT_STAGES.
+    :param rows: the rows of the stage.
+    :param key: returns the key of a row, by which duplicates are identified. Names should be case folded, as the
+    database compares them case insensitively.
+    :param throughput: a dictionary of worker process id -> (rows, seconds) to add the workers' throughput to.
+    :return: the number of rows inserted.
+    """
+    unique_rows = {}
+    for row in sorted(rows, key=lambda row: (key(row), row)):
+        unique_rows.setdefault(key(row), row)
+    parts = split(list(unique_rows.values()), workers)
+    inserted = 0
+    for pid, count, part_inserted, elapsed in pool.imap_unordered(import_part, [(stage, part) for part in parts]):
+        total_count, total_elapsed = throughput.get(pid, (0, 0.0))
+        throughput[pid] = (total_count + count, total_elapsed + elapsed)
+        inserted += part_inserted
+    return inserted
+
+
+def print_throughput(stage, throughput):
+    for pid, (count, elapsed) in sorted(throughput.items()):
+        rate = count / elapsed if elapsed else 0
+        print(f"{stage} - worker {pid}: {count} rows in {elapsed:.2f}s ({rate:.0f} rows/s)")
+
+
+class ImportProgress:
+    """
+    Reports the progress of an import stage every IMPORT_PROGRESS_INTERVAL seconds: the number of rows done, the rows
+    per second, and the estimated time left if the total number of rows is known.
+    """
+
+    def __init__(self, stage, total=None, done=0):
+        """
+        :param stage: the name of the stage.
+        :param total: the total number of rows of the stage, None if unknown.
+        :param done: the number of rows done before this run, when resuming the stage.
+        """
+        self.stage = stage
+        self.total = total
+        self.done = done
+        self.start_done = done
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def advance(self, rows=1):
+        self.done += rows
+        now = time.perf_counter()
+        if now - self.last_report >= consts.IMPORT_PROGRESS_INTERVAL:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now):
+        elapsed = now - self.start
+        rate = (self.done - self.start_done) / elapsed if elapsed else 0
+        if self.total is None:
+            print(f"{self.stage}: {self.done} rows, {rate:.0f} rows/s")
+            return
+        eta = f"{(self.total - self.done) / rate:.0f}s" if rate else "unknown"
+        print(f"{self.stage}: {self.done} / {self.total} rows, {rate:.0f} rows/s, ETA {eta}")
+
+    def finish(self):
+        self.report(time.perf_counter())
+
+
+class ImportRun:
+    """
+    The state of an import: which stages were completed, how many rows of an interrupted stage were committed,
+    and how many rows each stage inserted, skipped as duplicates, and failed on. Stages imported through a staging
+    table in bulk count the rows they staged instead of the ones they skipped (see BulkTrackFeaturesMethods).
+    With a checkpoint file, the state is saved to it as the import goes, and loaded from it when the import is run
+    again. The import then resumes where it stopped: completed stages are skipped, and an interrupted stage continues
+    after its last committed row. Running a completed import again does nothing.
+    """
+
+    def __init__(self, checkpoint_path=None):
+        """
+        :param checkpoint_path: the path of the checkpoint file. None to not save the state.
+        """
+        self.checkpoint_path = checkpoint_path
+        self.state = {'completed': [], 'offsets': {}, 'counts': {}}
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def is_completed(self, stage):
+        return stage in self.state['completed']
+
+    def offset(self, stage):
+        """
+        :return: the number of rows of the stage that were committed before this run.
+        """
+        return self.state['offsets'].get(stage, 0)
+
+    def progress(self, stage, total=None):
+        return ImportProgress(stage, total, self.offset(stage))
+
+    def count(self, stage, inserted=0, skipped=0, failed=0, staged=None):
+        counts = self.state['counts'].setdefault(stage, {'inserted': 0, 'skipped': 0, 'failed': 0})
+        counts['inserted'] += inserted
+        counts['skipped'] += skipped
+        counts['failed'] += failed
+        if staged is not None:
+            counts['staged'] = counts.get('staged', 0) + staged
+
+    def save(self, stage, offset):
+        """
+        Called after committing the first offset rows of the stage.
+        """
+        self.state['offsets'][stage] = offset
+        self.write()
+
+    def complete(self, stage):
+        self.state['completed'].append(stage)
+        self.state['offsets'].pop(stage, None)
+        self.write()
+
+    def write(self):
+        if self.checkpoint_path is None:
+            return
+        # Written to a temporary file first, so that a crash while writing never leaves a broken checkpoint.
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def print_summary(self):
+        print(f"{'stage':<24}{'staged':>12}{'inserted':>12}{'skipped':>12}{'failed':>12}")
+        for stage, counts in self.state['counts'].items():
+            print(f"{stage:<24}{counts.get('staged', '-'):>12}{counts['inserted']:>12}{counts['skipped']:>12}"
+                  f"{counts['failed']:>12}")
+
+
+def import_stage(stage):
+    """
+    Decorator for the methods that run an import stage, in classes with an ImportRun as their run attribute.
+    Skips the stage if it was completed by a previous run, and marks it completed once the method returns.
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrap(self, *args, **kwargs):
+            if self.run.is_completed(stage):
+                print(f"{stage}: completed by a previous run, skipped.")
+                return
+            f(self, *args, **kwargs)
+            self.run.complete(stage)
+
+        return wrap
+
+    return decorator
+
+
+def call_per_row(run, connection, stage, rows, call, total=None):
+    """
+    Runs a stored procedure call per row, committing and saving the stage's offset every IMPORT_CHUNK_SIZE rows,
+    so that an interrupted stage resumes after its last committed row.
+    Rows that would be duplicates are counted as skipped, and rows that fail on anything else are counted as failed.
+    :param run: the ImportRun.
+    :param connection: the connection the calls are made with.
+    :param stage: the name of the stage.
+    :param rows: an iterable of the rows of the stage, e.g. a generator reading them from a file. Must be in the same
+    order on every run.
+    :param call: makes the call of a single row.
+    :param total: the number of rows, for the progress reports. By default, the length of rows if it has one.
+    """
+    offset = run.offset(stage)
+    if total is None and hasattr(rows, '__len__'):
+        total = len(rows)
+    progress = run.progress(stage, total)
+    for row_num, row in enumerate(itertools.islice(rows, offset, None), offset):
+        try:
+            call(row)
+            run.count(stage, inserted=1)
+        except mysql.connector.errors.IntegrityError:
+            run.count(stage, skipped=1)
+        # Ignore any odd data that can cause errors. There should not be any, but still.
+        except mysql.connector.errors.Error:
+            run.count(stage, failed=1)
+        progress.advance()
+        if (row_num + 1) % consts.IMPORT_CHUNK_SIZE == 0:
+            connection.commit()
+            run.save(stage, row_num + 1)
+    connection.commit()
+    progress.finish()
+
+
 class ArtistDataMethods:
     """
     A collection of methods for the artist-data.csv file.
@@ -51,9 +391,13 @@ class ArtistDataMethods:
     To use for each type of data, run the "get" method, then the "add" or "link" method for that data.
     """
 
-    def __init__(self):
+    def __init__(self, run=None):
+        """
+        :param run: the ImportRun of the import. By default, a run without a checkpoint file.
+        """
         self.connection = connect()
         self.cursor = self.connection.cursor()
+        self.run = run if run is not None else ImportRun()
 
     def finish_connection(self):
         self.connection.commit()
@@ -76,32 +420,30 @@ class ArtistDataMethods:
             artists_set.add(artist)
         return artists_set
 
+    @import_stage('genres')
     def add_genres(self, genres):
-        for genre in genres:
-            self.cursor.execute("CALL add_genre(%s)", (genre,))
-        self.connection.commit()
+        call_per_row(self.run, self.connection, 'genres', sorted(genres),
+                     lambda genre: self.cursor.execute("CALL add_genre(%s)", (genre,)))
 
+    @import_stage('dataset_artists')
     def add_artists(self, artists):
-        for artist in artists:
-            pwd = gen_rand_string(8)
-            self.cursor.execute("CALL add_artist(%s, %s, %s)", (artist, pwd, ''))
-        self.connection.commit()
+        call_per_row(self.run, self.connection, 'dataset_artists', sorted(artists),
+                     lambda artist: self.cursor.execute("CALL add_artist(%s, %s, %s)",
+                                                        (artist, gen_rand_string(8), '')))
 
     @staticmethod
     def get_artist_genre_connections(csv_data):
-        artist_genre_tuples = []
         for row in csv_data:
             artist = row[0]
             genres = row[1].split(';')
             for genre in genres:
-                artist_genre_tuples.append((artist, genre.strip()))
-        return artist_genre_tuples
+                yield artist, genre.strip()
 
     # If executing, execute this last from this class.
+    @import_stage('dataset_artist_genres')
     def link_artist_to_genres(self, artist_genres_tuples):
-        for artist, genre in artist_genres_tuples:
-            self.cursor.execute("CALL link_artist_to_genre(%s, %s)", (artist, genre,))
-        self.connection.commit()
+        call_per_row(self.run, self.connection, 'dataset_artist_genres', artist_genres_tuples,
+                     lambda artist_genre: self.cursor.execute("CALL link_artist_to_genre(%s, %s)", artist_genre))
 
 
 def split(a, n):
@@ -110,6 +452,7 @@ def split(a, n):
 
 
 class Song:
+    __slots__ = ('song_id', 'song_name', 'album', 'artist', 'date', 'duration', 'is_major', 'energy', 'key')
 
     def __init__(self, song_id, song_name, album, artist, date, duration, is_major, energy, key):
         self.song_id = song_id
@@ -124,316 +467,575 @@ class Song:
         self.artist = artist
 
 
+def song_row(song):
+    """
+    :return: the row of a song in the songs import stage.
+    """
+    return song.song_name, song.album, song.song_id, song.duration, song.key, song.date, song.is_major, song.energy
+
+
+class Track:
+    """
+    A parsed row of the track-features.csv file: the song, its album's spotify id, and its artists.
+    """
+    __slots__ = ('song', 'album_spotify_id', 'artists')
+
+    def __init__(self, song, album_spotify_id, artists):
+        self.song = song
+        self.album_spotify_id = album_spotify_id
+        # (artist name, spotify id) tuples. Artists without a spotify id have an empty string instead.
+        self.artists = artists
+
+
 class TrackFeaturesMethods:
     """
     A collection of methods for the track-features.csv file.
     Generally, what the methods do is all in their names.
-    To use for each type of data, run the "get" method, then the "add" or "link" method for that data.
+    To use, run collect_track_features with the file, then the "add" and "link" methods.
+    The distinct artists, albums and links between them are collected in memory. The songs are not: add_songs reads
+    them from the file again, one chunk at a time.
     """
 
-    def __init__(self):
+    def __init__(self, run=None):
+        """
+        :param run: the ImportRun of the import. By default, a run without a checkpoint file.
+        """
         self.connection = connect()
         self.cursor = self.connection.cursor()
-        self.data = dict()
+        self.run = run if run is not None else ImportRun()
+        self.data = {
+            'artist_spotify_id_tuples': set(),
+            'album_spotify_id_tuples': set(),
+            'artist_album_tuples': set(),
+        }
+        # Set by collect_track_features.
+        self.filename = None
+        self.song_count = 0
 
     def finish_connection(self):
         self.connection.commit()
         self.cursor.close()
         self.connection.close()
 
+    @staticmethod
+    def parse_track(row):
+        song_id = row[0].strip()
+        song_name = row[1].strip()
+        album = row[2].strip()
+        date = row[23].strip()
+        artists = row[4].replace('[', '').replace(']', '').split(',')
+        spotify_ids = row[5].replace('[', '').replace(']', '').split(',')
+        # Handle cases where the date is incomplete or unknown by going with the "eh, close enough" approach.
+        if date == '':
+            # If no date is given (or the song was performed by Jesus), just use this nonsense date.
+            date = "0001-01-01"
+        if len(date) == 4:
+            date += "-01-01"
+        elif len(date) == 7:
+            date += "-01"
+        duration = row[20].strip()
+        is_major = int(row[13].strip())
+        energy = row[10].strip()
+        key = TrackFeaturesMethods.map_index_to_key(int(row[11].strip()))
+        song = Song(song_id, song_name, album, artists[0].strip(), date, duration, is_major, energy, key)
+        artist_tuples = []
+        for index, artist in enumerate(artists):
+            # If an artist has no spotify id, give them an empty string as their spotify id.
+            spotify_id = spotify_ids[index].strip() if index < len(spotify_ids) else ''
+            artist_tuples.append((artist.strip().replace("'", ""), spotify_id))
+        return Track(song, row[3].strip(), tuple(artist_tuples))
+
+    @staticmethod
+    def read_track_features(filename, chunk_size=consts.IMPORT_CHUNK_SIZE):
+        """
+        Reads the track-features.csv file one chunk at a time.
+        :return: a generator of lists of up to chunk_size Track records.
+        """
+        for rows in read_csv_chunks(filename, chunk_size):
+            yield [TrackFeaturesMethods.parse_track(row) for row in rows]
+
     @timed
-    def collect_artist_and_spotify_ids(self, csv_data):
-        artist_spotify_id_tuples = set()
-        row_num = 0
-        for row in csv_data:
-            artists = row[4].replace('[', '').replace(']', '').split(',')
-            spotify_ids = row[5].replace('[', '').replace(']', '').split(',')
-            for index, artist in enumerate(artists):
-                artist = artist.strip().replace("'", "")
-                try:
-                    artist_spotify_id_tuples.add((artist, spotify_ids[index].strip()))
-                # If an artist has no spotify id, give them an empty string as their spotify id.
-                except IndexError:
-                    artist_spotify_id_tuples.add((artist, ''))
-            print(f"Row {row_num} processed.")
-            row_num += 1
-        self.data['artist_spotify_id_tuples'] = artist_spotify_id_tuples
-
-    # Run this after collect_artist_and_spotify_ids
-    @timed
-    def add_artists(self):
-        row_num = 0
-        for artist, spotify_id in self.data['artist_spotify_id_tuples']:
-            try:
-                pwd = gen_rand_string(8)
-                self.cursor.execute("CALL add_artist(%s, %s, %s)", (artist, pwd, spotify_id))
-                print(f"Row {row_num} processed.")
-            except mysql.connector.errors.IntegrityError:
-                pass
-            row_num += 1
-        self.connection.commit()
+    def collect_track_features(self, filename):
+        """
+        Collects the artists, albums, links between them and songs of the whole file in a single pass over it.
+        """
+        self.filename = filename
+        progress = ImportProgress('collect_track_features')
+        for tracks in self.read_track_features(filename):
+            self.collect_tracks(tracks)
+            progress.advance(len(tracks))
+        progress.finish()
+
+    def collect_tracks(self, tracks):
+        for track in tracks:
+            song = track.song
+            self.data['album_spotify_id_tuples'].add((song.album, track.album_spotify_id))
+            for artist, spotify_id in track.artists:
+                self.data['artist_spotify_id_tuples'].add((artist, spotify_id))
+                self.data['artist_album_tuples'].add((artist, song.album))
+        self.song_count += len(tracks)
+
+    def read_songs(self):
+        """
+        Reads the songs of the collected file again, in the same order on every run.
+        :return: a generator of lists of up to IMPORT_CHUNK_SIZE songs.
+        """
+        for tracks in self.read_track_features(self.filename):
+            yield [track.song for track in tracks]
 
+    # Run this after collect_track_features
     @timed
-    def collect_albums_and_spotify_ids(self, csv_data):
-        album_spotify_id_tuples = set()
-        row_num = 0
-        for row in csv_data:
-            album = row[2].strip()
-            album_spotify_id_tuples.add((album, row[3].strip()))
-            print(f"Row {row_num} processed.")
-            row_num += 1
-        self.data['album_spotify_id_tuples'] = album_spotify_id_tuples
+    @import_stage('artists')
+    def add_artists(self):
+        call_per_row(self.run, self.connection, 'artists', sorted(self.data['artist_spotify_id_tuples']),
+                     lambda artist: self.cursor.execute("CALL add_artist(%s, %s, %s)",
+                                                        (artist[0], gen_rand_string(8), artist[1])))
 
-    # Run this after collect_albums_and_spotify_ids
+    # Run this after collect_track_features
     @timed
+    @import_stage('albums')
     def add_albums(self):
-        row_num = 0
-        for album, album_id in self.data['album_spotify_id_tuples']:
-            try:
-                self.cursor.execute("CALL add_album(%s, %s)", (album, album_id))
-                print(f"Row {row_num} processed.")
-            # There are duplicate album names in the dataset, so we ignore them.
-            # This does cause some albums to not be added, but it's not a big deal.
-            # At worst, some songs will be associated to the wrong artists.
-            except mysql.connector.errors.IntegrityError:
-                pass
-            row_num += 1
-        self.connection.commit()
+        # There are duplicate album names in the dataset, so we ignore them.
+        # This does cause some albums to not be added, but it's not a big deal.
+        # At worst, some songs will be associated to the wrong artists.
+        call_per_row(self.run, self.connection, 'albums', sorted(self.data['album_spotify_id_tuples']),
+                     lambda album: self.cursor.execute("CALL add_album(%s, %s)", album))
 
+    # Run this after collect_track_features, add_artists and add_albums
+    # Takes a long time. Like 10 hours long. BulkTrackFeaturesMethods does it in minutes.
     @timed
-    def collect_artist_and_album_connections(self, csv_data):
-        artist_album_tuples = set()
-        row_num = 0
-        for row in csv_data:
-            artists = row[4].replace('[', '').replace(']', '').split(',')
-            album = row[2].strip()
-            for artist in artists:
-                artist_album_tuples.add((artist.strip().replace("'", ""), album))
-            print(f"Row {row_num} processed.")
-            row_num += 1
-        self.data['artist_album_tuples'] = artist_album_tuples
-
-    # Run this after collect_artist_and_album_connections
-    # Must be run async because it takes a long time. Like 10 hours long.
+    @import_stage('artist_albums')
     def link_artists_to_albums(self):
-        row_num = 0
-        current = 0
-        batch = 0
-        artist_album_tuples = list(self.data['artist_album_tuples'])
-        total = len(artist_album_tuples)
-        print(total)
-        # for artist_album_tuple in artist_album_tuples:
-        #     try:
-        #         self.cursor.executemany("CALL link_artist_to_album(%s, %s)", artist_album_tuple)
-        #         self.connection.commit()
-        #         print(f"Batch {batch} / 30000 processed.")
-        #         batch += 1
-        #     except:
-        #         print(f"Error on batch {batch} / 30000.")
-        for artist, album in artist_album_tuples:
-            try:
-                self.cursor.execute("CALL link_artist_to_album(%s, %s)", (artist, album,))
-                row_num += 1
-                current += 1
-                if current == 1000:
-                    print(f"Row {row_num} / {total} processed.")
-                    self.connection.commit()
-                    current = 0
-            # Ignore any odd data that can cause errors. There should not be any, but still.
-            except:
-                pass
-        self.connection.commit()
+        call_per_row(self.run, self.connection, 'artist_albums', sorted(self.data['artist_album_tuples']),
+                     lambda artist_album: self.cursor.execute("CALL link_artist_to_album(%s, %s)", artist_album))
 
     @timed
+    @import_stage('keys')
     def add_keys(self):
         key_list = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
         for key in key_list:
             self.cursor.execute("CALL add_scale(%s)", (key,))
         self.connection.commit()
+        self.run.count('keys', inserted=len(key_list))
 
     @staticmethod
     def map_index_to_key(key_index):
         key_list = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
         return key_list[key_index]
 
+    # Run this after collect_track_features
     @timed
-    def collect_track_features(self, csv_data):
-        songs = []
-        row_num = 0
-        for row in csv_data:
-            song_id = row[0].strip()
-            song_name = row[1].strip()
-            album = row[2].strip()
-            date = row[23].strip()
-            artists = row[4].replace('[', '').replace(']', '').split(',')
-            artist = artists[0].strip()
-            # Handle cases where the date is incomplete or unknown by going with the "eh, close enough" approach.
-            if date == '':
-                # If no date is given (or the song was performed by Jesus), just use this nonsense date.
-                date = "0001-01-01"
-            if len(date) == 4:
-                date += "-01-01"
-            elif len(date) == 7:
-                date += "-01"
-            duration = row[20].strip()
-            is_major = int(row[13].strip())
-            energy = row[10].strip()
-            key = TrackFeaturesMethods.map_index_to_key(int(row[11].strip()))
-            songs.append(Song(song_id, song_name, album, artist, date, duration, is_major, energy, key))
-            print(f"Row {row_num} processed.")
-            row_num += 1
-        self.data['songs'] = songs
+    @import_stage('songs')
+    def add_songs(self):
+        # Very unlikely to happen, but if 2 songs with the same album exist, we skip the second one.
+        # Also, for some reason, 1 specific song causes a "data truncated" error, so that one fails.
+        # We have enough data to work with, so it's not a big deal.
+        call_per_row(self.run, self.connection, 'songs', itertools.chain.from_iterable(self.read_songs()),
+                     lambda song: self.cursor.execute("CALL add_song(%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                                                      (song.song_name, song.album, '', song.song_id, song.duration,
+                                                       song.key, song.date, song.is_major, song.energy)),
+                     total=self.song_count)
+
+
+class BulkTrackFeaturesMethods(TrackFeaturesMethods):
+    """
+    TrackFeaturesMethods, with every "add" and "link" method done in bulk instead of a stored procedure call per row.
+    Every kind of data is staged into a temporary table with multi-row INSERTs as it is collected, one chunk of
+    the file at a time, so memory use does not grow with the file's size.
+    The "add" and "link" methods then move each kind to its table with a single INSERT IGNORE ... SELECT,
+    which resolves names to ids by joining on them.
+    As with the row by row methods, rows that would be duplicates (by the tables' unique keys) are skipped.
+    The staged rows are only deduplicated within each chunk, and the joins drop rows whose names do not resolve,
+    so the difference between the rows staged and inserted is not the number of duplicates. Each stage reports the
+    two counts instead of a number of skipped rows.
+    Used the same way as TrackFeaturesMethods.
+    """
+
+    def __init__(self, run=None):
+        super().__init__(run)
+        create_staging_tables(self.cursor)
+        # The number of rows staged for each stage.
+        self.staged = {stage: 0 for stage in ('artists', 'albums', 'artist_albums', 'songs')}
+
+    def collect_tracks(self, tracks):
+        artists = set()
+        albums = set()
+        artist_albums = set()
+        for track in tracks:
+            albums.add((track.song.album, track.album_spotify_id))
+            for artist, spotify_id in track.artists:
+                artists.add((artist, spotify_id))
+                artist_albums.add((artist, track.song.album))
+        # The staging statements are INSERT IGNORE, so a malformed value is truncated instead of failing its batch.
+        insert_rows(self.cursor, IMPORT_STAGES['artists'][1],
+                    ((artist, gen_rand_string(8), spotify_id) for artist, spotify_id in artists))
+        insert_rows(self.cursor, IMPORT_STAGES['albums'][1], albums)
+        insert_rows(self.cursor, IMPORT_STAGES['artist_albums'][1], artist_albums)
+        insert_rows(self.cursor, IMPORT_STAGES['songs'][1], (song_row(track.song) for track in tracks))
+        self.staged['artists'] += len(artists)
+        self.staged['albums'] += len(albums)
+        self.staged['artist_albums'] += len(artist_albums)
+        self.staged['songs'] += len(tracks)
+
+    def move_staged(self, stage):
+        self.cursor.execute(IMPORT_STAGES[stage][2])
+        inserted = self.cursor.rowcount
+        self.connection.commit()
+        self.run.count(stage, inserted=inserted, staged=self.staged[stage])
+
+    # Run this after collect_track_features
+    @timed
+    @import_stage('artists')
+    def add_artists(self):
+        self.move_staged('artists')
 
     # Run this after collect_track_features
     @timed
+    @import_stage('albums')
+    def add_albums(self):
+        self.move_staged('albums')
+
+    # Run this after collect_track_features, add_artists and add_albums
+    @timed
+    @import_stage('artist_albums')
+    def link_artists_to_albums(self):
+        self.move_staged('artist_albums')
+
+    # Run this after collect_track_features, add_albums and add_keys
+    @timed
+    @import_stage('songs')
     def add_songs(self):
-        row_num = 0
-        for song in self.data['songs']:
-            try:
-                self.cursor.execute("CALL add_song(%s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                                    (song.song_name, song.album, '', song.song_id, song.duration, song.key,
-                                     song.date, song.is_major, song.energy))
-            # Very unlikely to happen, but if 2 songs with the same album exist, we ignore the second one.
-            # Also, for some reason, 1 specific song causes a "data truncated" error, so we ignore that one too.
-            # We have enough data to work with, so it's not a big deal.
-            except:
-                pass
-            print(f"Row {row_num} processed.")
-            row_num += 1
-        self.connection.commit()
+        self.move_staged('songs')
+
+
+class ParallelTrackFeaturesMethods(TrackFeaturesMethods):
+    """
+    TrackFeaturesMethods, with every "add" and "link" method done in bulk by a pool of worker processes,
+    each with its own connection, and each importing a part of the collected data (see import_in_parallel).
+    Every method waits for all the workers to finish, so running the methods in order keeps the foreign keys valid.
+    An interrupted method imports all of its rows again when resumed, skipping the ones it already inserted, except
+    for add_songs, which resumes after the last chunk of the file it imported.
+    Used the same way as TrackFeaturesMethods.
+    """
+
+    def __init__(self, pool, workers, run=None):
+        """
+        :param pool: a multiprocessing pool, initialized with init_import_worker.
+        :param workers: the number of worker processes in the pool.
+        :param run: the ImportRun of the import. By default, a run without a checkpoint file.
+        """
+        super().__init__(run)
+        self.pool = pool
+        self.workers = workers
+
+    def import_in_parallel(self, stage, rows, key):
+        throughput = {}
+        inserted = import_in_parallel(self.pool, self.workers, stage, rows, key, throughput)
+        print_throughput(stage, throughput)
+        self.run.count(stage, inserted=inserted, skipped=len(rows) - inserted)
+
+    # Run this after collect_track_features
+    @timed
+    @import_stage('artists')
+    def add_artists(self):
+        self.import_in_parallel('artists', [(artist, gen_rand_string(8), spotify_id)
+                                            for artist, spotify_id in self.data['artist_spotify_id_tuples']],
+                                key=lambda row: row[0].casefold())
+
+    # Run this after collect_track_features
+    @timed
+    @import_stage('albums')
+    def add_albums(self):
+        self.import_in_parallel('albums', list(self.data['album_spotify_id_tuples']),
+                                key=lambda row: row[0].casefold())
+
+    # Run this after collect_track_features, add_artists and add_albums
+    @timed
+    @import_stage('artist_albums')
+    def link_artists_to_albums(self):
+        self.import_in_parallel('artist_albums', list(self.data['artist_album_tuples']),
+                                key=lambda row: (row[0].casefold(), row[1].casefold()))
+
+    # Run this after collect_track_features, add_albums and add_keys
+    @timed
+    @import_stage('songs')
+    def add_songs(self):
+        # The songs are imported one chunk of the file at a time, saving the stage's offset after each one, so an
+        # interrupted stage resumes after its last imported chunk. Duplicates in different chunks are skipped by the
+        # database instead of by import_in_parallel.
+        offset = self.run.offset('songs')
+        progress = self.run.progress('songs', self.song_count)
+        throughput = {}
+        done = 0
+        for songs in self.read_songs():
+            done += len(songs)
+            if done <= offset:
+                continue
+            inserted = import_in_parallel(self.pool, self.workers, 'songs', [song_row(song) for song in songs],
+                                          lambda row: (row[0].casefold(), row[1].casefold()), throughput)
+            self.run.count('songs', inserted=inserted, skipped=len(songs) - inserted)
+            self.run.save('songs', done)
+            progress.advance(len(songs))
+        progress.finish()
+        print_throughput('songs', throughput)
+
+
+# How many times the generated data's (song, user) pairs are drawn, to replace the pairs that were drawn twice.
+GENERATED_PAIR_DRAWS = 10
+
+
+def zipf_cdf(count, exponent):
+    """
+    :return: the cumulative distribution of ranks 0 to count - 1, where the probability of rank r is proportional to
+    1 / (r + 1) ^ exponent.
+    """
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
 
 
 class GeneratedDataAdder:
     """
     This class is used to add data to the database that is not in the original dataset.
     It generates the data then adds it to the database.
+    The data is drawn with NumPy, a block of users at a time, from the ids actually in the database.
+    Song popularity and user activity follow Zipf's law, so a few songs get most of the comments and favorites,
+    as they would in reality.
+    The draws are seeded per block, so the same seed and counts always generate the same data, which also lets an
+    interrupted stage skip the blocks it already added when resumed.
     """
 
-    def __init__(self):
+    def __init__(self, pool=None, workers=1, run=None, seed=0):
+        """
+        :param pool: a multiprocessing pool, initialized with init_import_worker, to add the data in parallel with.
+        None to add it with this class' connection.
+        :param workers: the number of worker processes in the pool.
+        :param run: the ImportRun of the import. By default, a run without a checkpoint file.
+        :param seed: the seed of the random draws.
+        """
         self.connection = connect()
         self.cursor = self.connection.cursor()
-        # Hard coded the values because this should only be executed once, ever.
-        self.min_song_id = 348602
-        self.max_song_id = 1552596
-        self.min_artist_id = 146790
-        self.max_artist_id = 289347
+        self.run = run if run is not None else ImportRun()
+        self.pool = pool
+        self.workers = workers
+        self.seed = seed
+        self.song_ids = self.fetch_ids("SELECT song_id FROM songs ORDER BY song_id;")
+        self.artist_ids = self.fetch_ids("SELECT artist_id FROM artists ORDER BY artist_id;")
+        # Genre 1 is left out of the random links, as it was by the original script.
+        self.genre_ids = self.fetch_ids("SELECT genre_id FROM genres WHERE genre_id > 1 ORDER BY genre_id;")
+        # Popularity is by a random ranking of the songs, rather than by their ids.
+        ranking = np.random.default_rng(seed).permutation(len(self.song_ids))
+        self.song_ids_by_popularity = self.song_ids[ranking]
+        self.song_popularity_cdf = zipf_cdf(len(self.song_ids), consts.GENERATED_SONG_ZIPF_EXPONENT)
 
     def finish_connection(self):
         self.connection.commit()
         self.cursor.close()
         self.connection.close()
 
+    def fetch_ids(self, query):
+        self.cursor.execute(query)
+        chunks = []
+        while True:
+            rows = self.cursor.fetchmany(consts.IMPORT_CHUNK_SIZE)
+            if len(rows) == 0:
+                break
+            chunks.append(np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)))
+        return np.concatenate(chunks) if len(chunks) > 0 else np.empty(0, dtype=np.int64)
+
+    def draw_song_and_user_pairs(self, stage, count):
+        """
+        Draws count distinct (song id, user id) pairs, or as close to it as the number of songs allows.
+        Every user gets a number of pairs by their activity, and every pair gets a song by its popularity. Pairs drawn
+        twice are dropped and drawn again, so no pair violates the tables' primary keys.
+        :return: a generator of (song ids, user ids) arrays, a block of about IMPORT_CHUNK_SIZE pairs per worker
+        at a time.
+        """
+        song_count = len(self.song_ids)
+        stage_seed = [self.seed, zlib.crc32(stage.encode())]
+        rng = np.random.default_rng(stage_seed)
+        # Users are also ranked randomly, and none can have more pairs than there are songs.
+        user_ids = self.artist_ids[rng.permutation(len(self.artist_ids))]
+        user_weights = np.diff(zipf_cdf(len(user_ids), consts.GENERATED_USER_ZIPF_EXPONENT), prepend=0)
+        user_counts = np.minimum(rng.multinomial(count, user_weights), song_count)
+        # Blocks of consecutive users, with about block_size pairs each.
+        block_size = consts.IMPORT_CHUNK_SIZE * self.workers
+        ends = np.searchsorted(np.cumsum(user_counts), np.arange(block_size, user_counts.sum(), block_size))
+        for block, (start, end) in enumerate(zip(np.concatenate(([0], ends)), np.append(ends, len(user_ids)))):
+            block_rng = np.random.default_rng(stage_seed + [block])
+            wanted = user_counts[start:end]
+            users = np.repeat(np.arange(end - start), wanted)
+            keys = np.empty(0, dtype=np.int64)
+            # A few rounds are enough, except for the rare users with almost as many pairs as there are songs.
+            for attempt in range(GENERATED_PAIR_DRAWS):
+                songs = np.searchsorted(self.song_popularity_cdf, block_rng.random(len(users)), side='right')
+                keys = np.unique(np.concatenate((keys, users * song_count + songs)))
+                missing = wanted - np.bincount(keys // song_count, minlength=end - start)
+                if missing.sum() == 0:
+                    break
+                users = np.repeat(np.arange(end - start), missing)
+            # Shuffled, so that the rows are not inserted in the order of their keys.
+            keys = block_rng.permutation(keys)
+            yield self.song_ids_by_popularity[keys % song_count], user_ids[start:end][keys // song_count]
+
+    def add_blocks(self, stage, blocks, total, offset=None):
+        """
+        Adds the rows of a stage a block at a time, saving the stage's offset after each block. Blocks that were
+        added by a previous run are skipped.
+        :param blocks: the blocks of rows, the same on every run.
+        :param total: the expected number of rows, for the progress reports.
+        :param offset: the number of rows added by a previous run. By default, the stage's saved offset.
+        """
+        if offset is None:
+            offset = self.run.offset(stage)
+        progress = ImportProgress(stage, total, offset)
+        throughput = {}
+        done = 0
+        for rows in blocks:
+            done += len(rows)
+            if done <= offset:
+                continue
+            # Not impossible to add duplicates of existing rows which will violate PK constraints,
+            # so the stages ignore them.
+            if self.pool is not None:
+                inserted = import_in_parallel(self.pool, self.workers, stage, rows, lambda row: row[:2], throughput)
+            else:
+                inserted = import_rows(self.cursor, stage, rows)
+                self.connection.commit()
+            self.run.count(stage, inserted=inserted, skipped=len(rows) - inserted)
+            self.run.save(stage, done)
+            progress.advance(len(rows))
+        progress.finish()
+        print_throughput(stage, throughput)
+
+    @import_stage('comments')
     def generate_and_add_comments(self, count):
         """
         Generates and adds comments to the database.
-        :param count:
-        :return:
-        """
-        great_comments = ["Great song!", "I love this song!", "This song is amazing!", "This song is so good!",
-                          "This song is so catchy!", "This song is so fun!", "This song is so groovy!", ]
-        good_comments = ["This song is good!", "This song is alright.", "This song is pretty good.",
-                         "This song is decent.",
-                         "This song is okay.", "This song is not bad.", "This song is not too bad."]
-        bad_comments = ["This song is bad.", "This song is not good.", "This song is not very good.",
-                        "This song is not too good.",
-                        "This song is awful.", "I hate this song!", "This song is terrible!", "This song is so bad!"]
-
-        for i in range(count):
-            comment = ""
-            rating = random.randint(1, 5)
-            if rating == 5:
-                comment = random.choice(great_comments)
-            elif rating == 4 or rating == 3:
-                comment = random.choice(good_comments)
-            else:
-                comment = random.choice(bad_comments)
-            song_id = random.randint(self.min_song_id, self.max_song_id)
-            user_id = random.randint(self.min_artist_id, self.max_artist_id)
-            try:
-                self.cursor.execute("CALL add_comment_by_ids(%s, %s, %s, %s)", (song_id, user_id, comment, rating))
-            # Not impossible to add duplicates which will violate PK constraints, so we ignore them.
-            except:
-                pass
-        self.connection.commit()
+        :param count: the number of comments.
+        """
+        great_comments = np.array(["Great song!", "I love this song!", "This song is amazing!", "This song is so good!",
+                                   "This song is so catchy!", "This song is so fun!", "This song is so groovy!"],
+                                  dtype=object)
+        good_comments = np.array(["This song is good!", "This song is alright.", "This song is pretty good.",
+                                  "This song is decent.", "This song is okay.", "This song is not bad.",
+                                  "This song is not too bad."], dtype=object)
+        bad_comments = np.array(["This song is bad.", "This song is not good.", "This song is not very good.",
+                                 "This song is not too good.", "This song is awful.", "I hate this song!",
+                                 "This song is terrible!", "This song is so bad!"], dtype=object)
 
+        def blocks():
+            rng = np.random.default_rng([self.seed, zlib.crc32(b'comment texts')])
+            for song_ids, user_ids in self.draw_song_and_user_pairs('comments', count):
+                ratings = rng.integers(1, 6, size=len(song_ids))
+                comments = np.where(ratings == 5, rng.choice(great_comments, size=len(ratings)),
+                                    np.where(ratings >= 3, rng.choice(good_comments, size=len(ratings)),
+                                             rng.choice(bad_comments, size=len(ratings))))
+                yield list(zip(song_ids.tolist(), user_ids.tolist(), comments.tolist(), ratings.tolist()))
+
+        self.add_blocks('comments', blocks(), count)
+
+    @import_stage('favorites')
     def generate_and_add_favorite_songs(self, count):
         """
         Generates and adds favorite songs to the database.
-        :param count:
-        :return:
-        """
-        for i in range(count):
-            song_id = random.randint(self.min_song_id, self.max_song_id)
-            user_id = random.randint(self.min_artist_id, self.max_artist_id)
-            try:
-                self.cursor.execute("CALL add_favorite_song_by_ids(%s, %s)", (song_id, user_id))
-            # Not impossible to add duplicates which will violate PK constraints, so we ignore them.
-            except:
-                pass
-        self.connection.commit()
+        :param count: the number of favorite songs.
+        """
+        blocks = (list(zip(song_ids.tolist(), user_ids.tolist()))
+                  for song_ids, user_ids in self.draw_song_and_user_pairs('favorites', count))
+        self.add_blocks('favorites', blocks, count)
 
+    @import_stage('artist_genres')
     def add_random_links(self):
         """
-        This method adds random links between artists and genres to the database.
-        :return:
-        """
-        genres_start = 2
-        genres_end = 81
-        for i in range(self.min_artist_id, self.max_artist_id):
-            rand_genre = random.randint(genres_start, genres_end)
-            try:
-                self.cursor.execute("INSERT INTO artist_genre_connector (artist_id, genre_id) VALUES (%s, %s)",
-                               (i, rand_genre))
-            except:
-                pass
-        self.connection.commit()
+        This method adds a link to a random genre to every artist in the database without any genre, so the artists
+        linked to their genres by artists-data.csv (or by a previous run) keep only their own genres.
+        """
+        artist_ids = self.fetch_ids("SELECT artist_id FROM artists WHERE artist_id NOT IN "
+                                    "(SELECT artist_id FROM artist_genre_connector) ORDER BY artist_id;")
+        rng = np.random.default_rng([self.seed, zlib.crc32(b'artist_genres')])
+        genre_ids = rng.choice(self.genre_ids, size=len(artist_ids))
+        block_size = consts.IMPORT_CHUNK_SIZE * self.workers
+        blocks = (list(zip(artist_ids[start:start + block_size].tolist(), genre_ids[start:start + block_size].tolist()))
+                  for start in range(0, len(artist_ids), block_size))
+        # The artists linked by an interrupted run are no longer without a genre, so the stage starts over with the
+        # rest of them instead of skipping its saved offset.
+        self.add_blocks('artist_genres', blocks, len(artist_ids), offset=0)
 
 
 if __name__ == '__main__':
-    csv_data = read_csv("artists-data.csv")
-
-    artist_data_methods = ArtistDataMethods()
-    # Process all the data in the artists-data.csv file.
-    # Collect and add genres
-    genres = artist_data_methods.collect_genres_set(csv_data)
-    artist_data_methods.add_genres(genres)
-    # Collect and add artists
-    artists = artist_data_methods.collect_artists_set(csv_data)
-    artist_data_methods.add_artists(artists)
-    # Link artists to genres
-    connections = artist_data_methods.get_artist_genre_connections(csv_data)
-    artist_data_methods.link_artist_to_genres(connections)
-    artist_data_methods.finish_connection()
-
-    track_features_methods = TrackFeaturesMethods()
-    # Process all the data in the track-features.csv file.
-    csv_data = read_csv("track-features.csv")
-    # Collect artists and add them
-    track_features_methods.collect_artist_and_spotify_ids(csv_data)
-    track_features_methods.add_artists()
-    # Collect albums and add them
-    track_features_methods.collect_albums_and_spotify_ids(csv_data)
-    track_features_methods.add_albums()
-    # Collect connections between artists and albums and add them
-    track_features_methods.collect_artist_and_album_connections(csv_data)
-    track_features_methods.link_artists_to_albums()
-    # Add song keys to database
-    track_features_methods.add_keys()
-    # Collect songs and add them
-    track_features_methods.collect_track_features(csv_data)
-    track_features_methods.add_songs()
-    track_features_methods.finish_connection()
+    parser = argparse.ArgumentParser(description="Fills the database with the datasets' data, and generated data.")
+    parser.add_argument('--row-by-row', action='store_true',
+                        help="add the track features with a stored procedure call per row, instead of in bulk")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="the number of processes to add the track features and generated data in bulk with")
+    parser.add_argument('--checkpoint', default=consts.IMPORT_CHECKPOINT_FILE,
+                        help="the file the import's progress is saved to, and resumed from when it exists")
+    parser.add_argument('--restart', action='store_true',
+                        help="start the import from the beginning, instead of resuming from the checkpoint")
+    parser.add_argument('--comments', type=int, default=1000000, help="the number of comments to generate")
+    parser.add_argument('--favorites', type=int, default=1000000, help="the number of favorite songs to generate")
+    parser.add_argument('--seed', type=int, default=0, help="the seed of the generated data")
+    parser.add_argument('--generated-only', action='store_true',
+                        help="only add generated data, e.g. to scale up an already filled database for benchmarks")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.row_by_row and args.workers > 1:
+        parser.error("--row-by-row can not be used with more than 1 worker")
+    # Each worker process opens its own connection.
+    pool = multiprocessing.Pool(args.workers, initializer=init_import_worker) if args.workers > 1 else None
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    run = ImportRun(args.checkpoint)
+
+    if not args.generated_only:
+        artist_data_methods = ArtistDataMethods(run)
+        # Process all the data in the artists-data.csv file.
+        # The file is read again for each kind of data, rather than held in memory.
+        # Collect and add genres
+        genres = artist_data_methods.collect_genres_set(row[1] for row in read_csv("artists-data.csv"))
+        artist_data_methods.add_genres(genres)
+        # Collect and add artists
+        artists = artist_data_methods.collect_artists_set(row[0] for row in read_csv("artists-data.csv"))
+        artist_data_methods.add_artists(artists)
+        # Link artists to genres
+        connections = artist_data_methods.get_artist_genre_connections(read_csv("artists-data.csv"))
+        artist_data_methods.link_artist_to_genres(connections)
+        artist_data_methods.finish_connection()
+
+        if args.row_by_row:
+            track_features_methods = TrackFeaturesMethods(run)
+        elif pool is not None:
+            track_features_methods = ParallelTrackFeaturesMethods(pool, args.workers, run)
+        else:
+            track_features_methods = BulkTrackFeaturesMethods(run)
+        # Process all the data in the track-features.csv file.
+        # Collect the artists, albums, links between them and songs, in a single pass over the file.
+        # The collected data is not saved, so it is collected again unless all the stages that use it were completed.
+        if not all(run.is_completed(stage) for stage in ('artists', 'albums', 'artist_albums', 'songs')):
+            track_features_methods.collect_track_features("track-features.csv")
+        # Add artists, albums and the connections between them
+        track_features_methods.add_artists()
+        track_features_methods.add_albums()
+        track_features_methods.link_artists_to_albums()
+        # Add song keys to database
+        track_features_methods.add_keys()
+        # Add songs
+        track_features_methods.add_songs()
+        track_features_methods.finish_connection()
 
     # Add generated data to the database
-    generated_data_adder = GeneratedDataAdder()
+    generated_data_adder = GeneratedDataAdder(pool, args.workers, run, args.seed)
     # Add comments
-    generated_data_adder.generate_and_add_comments(1000000)
+    generated_data_adder.generate_and_add_comments(args.comments)
     # Add favorite songs
-    generated_data_adder.generate_and_add_favorite_songs(1000000)
+    generated_data_adder.generate_and_add_favorite_songs(args.favorites)
     # Add random links between artists and genres
     generated_data_adder.add_random_links()
+    generated_data_adder.finish_connection()
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-
-
-
-
+    run.print_summary()
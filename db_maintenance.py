@@ -0,0 +1,46 @@
+"""
+Maintenance commands for the derived data the server keeps next to the main tables.
+Usage:
+    python db_maintenance.py <command>
+Run with --help to see the available commands.
+"""
+import argparse
+
+from db_data_inserts_preprocessing import timed
+from repositories.rating_stats import RatingStatsRepository
+from repositories.recommendations import RecommendationsRepository
+
+
+@timed
+def rebuild_rating_stats():
+    repository = RatingStatsRepository.get_instance()
+    repository.create_tables()
+    repository.rebuild_song_rating_stats()
+    repository.rebuild_rating_rollups()
+
+
+@timed
+def rebuild_rating_rollups():
+    repository = RatingStatsRepository.get_instance()
+    repository.create_tables()
+    repository.rebuild_rating_rollups()
+
+
+@timed
+def rebuild_taste_profiles():
+    repository = RecommendationsRepository.get_instance()
+    repository.create_tables()
+    repository.rebuild_taste_profiles()
+
+
+COMMANDS = {
+    'rebuild_rating_stats': rebuild_rating_stats,
+    'rebuild_rating_rollups': rebuild_rating_rollups,
+    'rebuild_taste_profiles': rebuild_taste_profiles,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintenance commands for the music social network database.")
+    parser.add_argument('command', choices=COMMANDS.keys())
+    COMMANDS[parser.parse_args().command]()
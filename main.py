@@ -1,8 +1,12 @@
 from gevent import monkey
 monkey.patch_all()
 
+import gevent
+
 import routes
-from app_conf import app
+from app_conf import app, db_pool
+from config import consts
+from repositories import IdsRepository, SongRepository
 
 app.register_blueprint(routes.albums_routes, url_prefix='/albums')
 app.register_blueprint(routes.songs_routes, url_prefix='/songs')
@@ -10,6 +14,17 @@ app.register_blueprint(routes.artists_routes, url_prefix='/artists')
 app.register_blueprint(routes.favorite_songs_routes, url_prefix='/favorite-songs')
 app.register_blueprint(routes.comment_routes, url_prefix='/comments')
 app.register_blueprint(routes.genres_routes, url_prefix='/genres')
+app.register_blueprint(routes.admin_routes, url_prefix='/admin')
+app.register_blueprint(routes.metrics_routes)
+
+db_pool.warm()
+
+# Built in the background, the song id table and search index are not used until they are ready.
+gevent.spawn(SongRepository.get_instance().load_song_indexes)
+if consts.LEADERBOARD_ENABLED:
+    gevent.spawn(SongRepository.get_instance().keep_leaderboard_synced)
+# Names that are not in the caches yet are simply looked up in the database.
+gevent.spawn(IdsRepository.get_instance().warm)
 
 if __name__ == '__main__':
 
@@ -0,0 +1,314 @@
+import bisect
+import contextvars
+import re
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Latency histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Rows per query histogram bucket upper bounds.
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+# The label of the requests that matched no route, so unknown paths do not each get their own series.
+UNMATCHED_ROUTE = 'unmatched'
+# The label of the queries beyond the maximal number of query fingerprints.
+OTHER_QUERIES = 'other'
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets, whose counts are allocated up front, so observing a value is a binary search and
+    a couple of additions.
+    """
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # The last count is of the values above every bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        :return: the (upper bound, count of values up to it) pairs of every bucket, ending with +Inf.
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            total += count
+            buckets.append((str(bound), total))
+        return buckets
+
+
+class RouteMetrics:
+    """
+    The metrics of a single route (method and URL rule).
+    """
+    __slots__ = ('statuses', 'latency', 'bytes_out', 'db_time', 'python_time')
+
+    def __init__(self):
+        self.statuses: Dict[str, int] = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.bytes_out = 0
+        # How much of the requests' time went to database queries, and how much to everything else.
+        self.db_time = 0.0
+        self.python_time = 0.0
+
+
+class QueryMetrics:
+    """
+    The metrics of a single query fingerprint.
+    """
+    __slots__ = ('text', 'latency', 'execute_time', 'fetch_time', 'rows', 'errors')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.latency = Histogram(LATENCY_BUCKETS)
+        # Executing is sending the query and waiting for the server, fetching is reading the rows into Python.
+        self.execute_time = 0.0
+        self.fetch_time = 0.0
+        self.rows = Histogram(ROW_BUCKETS)
+        self.errors = 0
+
+
+def normalize_query(raw: str) -> str:
+    """
+    :return: the text of a query with whitespace collapsed, literals replaced by ? and placeholder lists collapsed.
+    """
+    text = ' '.join(raw.split())
+    text = re.sub(r"'(?:[^'\\]|\\.|'')*'", '?', text)
+    text = re.sub(r'\b\d+(?:\.\d+)?\b', '?', text)
+    return re.sub(r'%s(?:, ?%s)+', '%s, ...', text)
+
+
+def query_fingerprint(raw: str) -> Tuple[str, str]:
+    """
+    :return: the (fingerprint, normalized text) of a query. Queries that only differ in their literals, whitespace
+    or number of placeholders in a list have the same fingerprint.
+    """
+    text = normalize_query(raw)
+    return format(zlib.crc32(text.encode()), '08x'), text
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels: str) -> str:
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+
+class Metrics:
+    """
+    Per route and per query metrics, exposed in the Prometheus text format.
+    Routes are measured by a WSGI middleware (see MetricsMiddleware), and queries by BaseRepository.
+    Queries are grouped by fingerprint - their SQL text with whitespace collapsed, literals replaced by ? and
+    placeholder lists collapsed - so the same query with a different number of ids is a single series.
+    Nothing here takes a lock: under gevent, a greenlet only yields on IO, so the counter updates of different
+    requests can not interleave. The time a request spent on queries is kept in a context variable, which gevent
+    keeps per greenlet.
+    """
+
+    def __init__(self, enabled: bool = True, max_queries: int = 1000):
+        """
+        :param enabled: whether anything is measured at all. Can be changed at runtime.
+        :param max_queries: the maximal number of query fingerprints measured separately. The queries of any
+        fingerprint beyond it are measured together, as 'other'.
+        """
+        self.enabled = enabled
+        self._max_queries = max_queries
+        self._routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self._queries: Dict[str, QueryMetrics] = {}
+        # SQL text -> fingerprint, so every text is only normalized once.
+        self._fingerprints: Dict[str, str] = {}
+        # The time the current request spent on queries so far and their number, as a list, or None outside of
+        # requests.
+        self._request_db_time = contextvars.ContextVar('request_db_time', default=None)
+
+    def _query_metrics(self, raw: str) -> QueryMetrics:
+        fingerprint = self._fingerprints.get(raw)
+        if fingerprint is None:
+            fingerprint, text = query_fingerprint(raw)
+            if fingerprint not in self._queries:
+                if len(self._queries) >= self._max_queries:
+                    fingerprint, text = OTHER_QUERIES, OTHER_QUERIES
+                self._queries.setdefault(fingerprint, QueryMetrics(text))
+            if len(self._fingerprints) < self._max_queries * 10:
+                self._fingerprints[raw] = fingerprint
+        return self._queries[fingerprint]
+
+    def record_query(self, raw: str, execute_time: float, fetch_time: float, rows: int, failed: bool = False) -> None:
+        """
+        Records a query's execution.
+        :param raw: the SQL text of the query.
+        :param execute_time: the seconds it took to execute the query.
+        :param fetch_time: the seconds it took to fetch its rows.
+        :param rows: the number of rows fetched.
+        :param failed: whether the query raised.
+        """
+        elapsed = execute_time + fetch_time
+        # Also counted while disabled, for the requests that are profiled (see request_profiler.py).
+        request_db_time = self._request_db_time.get()
+        if request_db_time is not None:
+            request_db_time[0] += elapsed
+            request_db_time[1] += 1
+        if not self.enabled:
+            return
+        query = self._query_metrics(raw)
+        query.latency.observe(elapsed)
+        query.execute_time += execute_time
+        query.fetch_time += fetch_time
+        query.rows.observe(rows)
+        if failed:
+            query.errors += 1
+
+    def start_request(self) -> list:
+        """
+        Starts counting the time the current request spends on queries.
+        :return: the time counted so far and the number of queries, as a list.
+        """
+        request_db_time = [0.0, 0]
+        self._request_db_time.set(request_db_time)
+        return request_db_time
+
+    def request_db_time(self) -> Optional[list]:
+        """
+        :return: the time the current request spent on queries so far and the number of queries, as a list,
+        or None if it is not being counted.
+        """
+        return self._request_db_time.get()
+
+    def record_request(self, method: str, route: Optional[str], status: str, elapsed: float, bytes_out: int,
+                       db_time: float) -> None:
+        """
+        Records a request, once its response was sent.
+        :param route: the URL rule the request matched, or None if it matched none.
+        :param status: the response's status code.
+        :param elapsed: the seconds from receiving the request to sending the end of its response.
+        :param bytes_out: the size of the response's body.
+        :param db_time: the seconds of elapsed that went to database queries.
+        """
+        key = (method, route or UNMATCHED_ROUTE)
+        metrics = self._routes.get(key)
+        if metrics is None:
+            metrics = self._routes.setdefault(key, RouteMetrics())
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        metrics.latency.observe(elapsed)
+        metrics.bytes_out += bytes_out
+        metrics.db_time += db_time
+        metrics.python_time += max(elapsed - db_time, 0.0)
+
+    @staticmethod
+    def _histogram_lines(name: str, labels: dict, histogram: Histogram) -> Iterable[str]:
+        for bound, count in histogram.cumulative():
+            yield f"{name}_bucket{_labels(**labels, le=bound)} {count}"
+        yield f"{name}_sum{_labels(**labels)} {histogram.sum}"
+        yield f"{name}_count{_labels(**labels)} {sum(histogram.counts)}"
+
+    def render(self) -> str:
+        """
+        :return: every metric, in the Prometheus text exposition format.
+        """
+        routes = sorted(self._routes.items())
+        queries = sorted(self._queries.items())
+        lines = [
+            "# HELP http_requests_total Requests, by route and response status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route), metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+        lines += ["# HELP http_request_duration_seconds Time from receiving a request to sending the end of its "
+                  "response.",
+                  "# TYPE http_request_duration_seconds histogram"]
+        for (method, route), metrics in routes:
+            lines += self._histogram_lines('http_request_duration_seconds', {'method': method, 'route': route},
+                                           metrics.latency)
+        for name, attribute, description in (
+                ('http_response_bytes_total', 'bytes_out', "Bytes of response bodies sent."),
+                ('http_request_db_seconds_total', 'db_time', "Time requests spent on database queries."),
+                ('http_request_python_seconds_total', 'python_time',
+                 "Time requests spent on anything but database queries.")):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            for (method, route), metrics in routes:
+                lines.append(f"{name}{_labels(method=method, route=route)} {getattr(metrics, attribute)}")
+
+        lines += ["# HELP db_query_info The normalized SQL text of each query fingerprint.",
+                  "# TYPE db_query_info gauge"]
+        for fingerprint, metrics in queries:
+            lines.append(f"db_query_info{_labels(fingerprint=fingerprint, query=metrics.text)} 1")
+        lines += ["# HELP db_query_duration_seconds Time to execute a query and fetch its rows.",
+                  "# TYPE db_query_duration_seconds histogram"]
+        for fingerprint, metrics in queries:
+            lines += self._histogram_lines('db_query_duration_seconds', {'fingerprint': fingerprint}, metrics.latency)
+        lines += ["# HELP db_query_rows Rows fetched per query.", "# TYPE db_query_rows histogram"]
+        for fingerprint, metrics in queries:
+            lines += self._histogram_lines('db_query_rows', {'fingerprint': fingerprint}, metrics.rows)
+        for name, attribute, description in (
+                ('db_query_execute_seconds_total', 'execute_time', "Time spent executing queries."),
+                ('db_query_fetch_seconds_total', 'fetch_time', "Time spent fetching the rows of queries."),
+                ('db_query_errors_total', 'errors', "Queries that raised.")):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            for fingerprint, metrics in queries:
+                lines.append(f"{name}{_labels(fingerprint=fingerprint)} {getattr(metrics, attribute)}")
+        return '\n'.join(lines) + '\n'
+
+
+class _RecordedResponse:
+    """
+    Wraps a WSGI response, counting the bytes of its body as they are sent, and recording the request once the
+    server closes it.
+    """
+
+    def __init__(self, response, record):
+        self._response = response
+        self._record = record
+        self._bytes_out = 0
+
+    def __iter__(self):
+        for chunk in self._response:
+            self._bytes_out += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._response, 'close'):
+                self._response.close()
+        finally:
+            self._record(self._bytes_out)
+
+
+class MetricsMiddleware:
+    """
+    WSGI middleware recording every request's route, status, latency, response size and time spent on queries.
+    The request is timed until its response's body was sent, so streamed responses are measured in full.
+    The route is the URL rule the request matched, which the app puts in the WSGI environ as ROUTE_KEY
+    (see app_conf.py).
+    """
+    ROUTE_KEY = 'metrics.route'
+
+    def __init__(self, wsgi_app, metrics: Metrics):
+        self._wsgi_app = wsgi_app
+        self._metrics = metrics
+
+    def __call__(self, environ, start_response):
+        metrics = self._metrics
+        if not metrics.enabled:
+            return self._wsgi_app(environ, start_response)
+        start = time.perf_counter()
+        db_time = metrics.start_request()
+        status = ['500']
+
+        def recording_start_response(response_status, headers, exc_info=None):
+            status[0] = response_status.split(' ', 1)[0]
+            return start_response(response_status, headers, exc_info)
+
+        def record(bytes_out: int) -> None:
+            metrics.record_request(environ.get('REQUEST_METHOD', ''), environ.get(self.ROUTE_KEY), status[0],
+                                   time.perf_counter() - start, bytes_out, db_time[0])
+
+        return _RecordedResponse(self._wsgi_app(environ, recording_start_response), record)
@@ -3,3 +3,5 @@ from repositories.artists import ArtistsRepository
 from repositories.songs import SongRepository
 from repositories.favorite_songs import FavoriteSongsRepository
 from repositories.genres import GenresRepository
+from repositories.rating_stats import RatingStatsRepository
+from repositories.ids import IdsRepository
@@ -1,15 +1,23 @@
 import string
+from typing import Optional
 
-from repositories.base import BaseRepository
+from config import consts
+from repositories.base import BaseRepository, RowBatches
+from repositories.ids import IdsRepository
+from repositories.rating_stats import RatingStatsRepository
+from repositories.result_cache import cached_result, invalidate_results
 
 
 class AlbumsRepository(BaseRepository):
-    def get_all_albums(self):
+    def get_all_albums(self, after_id: int = 0, limit: Optional[int] = None) -> RowBatches:
         """
         A slightly stupid query, returning all albums.
         For test measures.
+        :param after_id: only albums with a larger id are returned. The last id of the previous page, when paging.
+        :param limit: the maximal number of albums to return. None for no limit.
+        :return: the albums, ordered by id, streamed in batches.
         """
-        return self._execute_query("SELECT * FROM albums")
+        return self._stream_page("SELECT * FROM albums WHERE album_id > %s ORDER BY album_id", after_id, limit)
 
     def get_album_artists(self, album_name: str):
         """
@@ -19,9 +27,8 @@ class AlbumsRepository(BaseRepository):
         """
         return self._execute_query("""
             SELECT artist_name FROM artists WHERE artist_id IN(
-            SELECT artist_id FROM artist_album_connector WHERE album_id = 
-            (SELECT album_id FROM albums WHERE album_name = %s));
-        """, album_name)
+            SELECT artist_id FROM artist_album_connector WHERE album_id = %s);
+        """, IdsRepository.get_instance().get_album_id(album_name))
 
 
     def get_album_by_name(self, album_name: str):
@@ -31,69 +38,65 @@ class AlbumsRepository(BaseRepository):
         :return: album_id, album_name, spotify_album_id, average (new feature)
         """
         return self._execute_query("""
-            SELECT album_id, album_name, album_spotify_id, AVG(averages.rtg)
-             FROM albums JOIN (SELECT song_id, AVG(rating) AS rtg  FROM comment_on_song
-              WHERE song_id IN (SELECT song_id FROM songs WHERE album = 
-              (SELECT album_id FROM albums WHERE album_name= %s ))
-              GROUP BY song_id) AS averages
-               WHERE album_name = %s
-                GROUP by album_id;
-        """, album_name, album_name)
+            SELECT albums.album_id, album_name, album_spotify_id, ars.avg_rating
+             FROM albums JOIN album_rating_stats AS ars ON ars.album_id = albums.album_id
+               WHERE albums.album_id = %s;
+        """, IdsRepository.get_instance().get_album_id(album_name))
 
     def add_album(self, album_name: str, album_spotify_id: str):
         """
         Create an unrelated album in the Album table.
         :return: Create an ALBUM record in Album table.
         """
-        return self._execute_query("INSERT INTO albums VALUES (NULL, %s, %s);", album_name, album_spotify_id)
+        result = self._execute_query("INSERT INTO albums VALUES (NULL, %s, %s);", album_name, album_spotify_id)
+        IdsRepository.get_instance().invalidate_album(album_name)
+        return result
 
 
     def add_artist_connection(self, album_name: str, artist_name: str):
         """
         Relate an artist to an album.
+        The album's existing ratings are added to the artist's rating in the same transaction.
         :return: Create a CONNECTOR record in Album - Artist connector table.
         """
-        return self._execute_query("""
-            INSERT INTO artist_album_connector VALUES (
-                (SELECT artist_id FROM artists WHERE artist_name=%s),
-                (SELECT album_id FROM albums WHERE album_name=%s)
-            );
-        """, artist_name, album_name)
+        ids = IdsRepository.get_instance()
+        album_id = ids.get_album_id(album_name)
+        artist_id = ids.get_artist_id(artist_name)
+        with self._transaction() as execute:
+            # Locking the album keeps its rating from changing until the artist's rating includes it.
+            execute("SELECT album_id FROM albums WHERE album_id = %s FOR UPDATE;", album_id)
+            # Inserting a missing id fails on the NOT NULL constraint, the same as when using sub-queries.
+            result = execute("INSERT INTO artist_album_connector VALUES (%s, %s);", artist_id, album_id)
+            RatingStatsRepository.apply_artist_link(execute, artist_id, album_id)
+        invalidate_results('highest_rated_artists')
+        return result
 
-    def get_all_albums_ratings(self):
+    def get_all_albums_ratings(self, after_id: int = 0, limit: Optional[int] = None) -> RowBatches:
         """
         Get all album and their rating (as avg of all ratings they got).
-        :return: list of (album_id, album_name, rating)
+        :param after_id: only albums with a larger id are returned. The last id of the previous page, when paging.
+        :param limit: the maximal number of albums to return. None for no limit.
+        :return: (album_id, album_name, rating) of the albums, ordered by id, streamed in batches.
         """
-        return self._execute_query("SELECT album_id, album_name, by_id.avg_rtg"
-                                   " FROM albums"
-                                   " JOIN (SELECT album, AVG(rtg) AS avg_rtg FROM songs"
-                                   " JOIN (SELECT comment_on_song.song_id AS id, AVG(comment_on_song.rating) AS rtg"
-                                   " FROM comment_on_song"
-                                   " GROUP BY comment_on_song.song_id) AS avg_per_song"
-                                   " ON avg_per_song.id = songs.song_id"
-                                   " GROUP by album) AS by_id"
-                                   " ON album_id = by_id.album"
-                                   " ORDER BY album_id;")
+        return self._stream_page("SELECT albums.album_id, album_name, ars.avg_rating"
+                                 " FROM albums"
+                                 " JOIN album_rating_stats AS ars ON ars.album_id = albums.album_id"
+                                 " WHERE albums.album_id > %s"
+                                 " ORDER BY albums.album_id", after_id, limit)
 
+    @cached_result('highest_ranked_albums', ttl=consts.RESULT_CACHE_LEADERBOARD_TTL, limit_arg='num',
+                   min_limit=consts.RESULT_CACHE_MIN_LIMIT)
     def get_x_highest_ranked_albums(self, num):
         """
         Get the NUM highest ranked albums.
         :param num: num of albums.
         :return: (album_id, album_name, rating) of top NUM albums.
         """
-        qur_str = "SELECT album_id, album_name, by_id.avg_rtg" \
-                  " FROM albums" \
-                  " JOIN (select album, avg(rtg) as avg_rtg from songs" \
-                  " JOIN (select comment_on_song.song_id as id, avg(comment_on_song.rating) as rtg" \
-                  " FROM comment_on_song" \
-                  " GROUP by comment_on_song.song_id) AS avg_per_song" \
-                  " ON avg_per_song.id = songs.song_id" \
-                  " GROUP BY album) AS by_id" \
-                  " ON album_id = by_id.album" \
-                  " ORDER BY by_id.avg_rtg DESC" \
-                  " LIMIT {l_num};".format(l_num=num)
-        return self._execute_query(qur_str)
+        return self._execute_shared_query("SELECT albums.album_id, album_name, ars.avg_rating"
+                                          " FROM album_rating_stats AS ars"
+                                          " JOIN albums ON albums.album_id = ars.album_id"
+                                          " ORDER BY ars.avg_rating DESC, ars.album_id"
+                                          " LIMIT %s;", int(num))
 
 
 if __name__ == '__main__':
@@ -1,5 +1,9 @@
-from typing import List, Tuple
-from repositories.base import BaseRepository
+from typing import List, Optional, Tuple
+
+from config import consts
+from repositories.base import BaseRepository, RowBatches
+from repositories.ids import IdsRepository
+from repositories.result_cache import cached_result
 
 
 class ArtistAbstract:
@@ -57,10 +61,19 @@ class ArtistWithRating(Artist):
 
 class ArtistsRepository(BaseRepository):
     def add_artist(self, name: str, pwd: str):
-        return self._execute_query("INSERT INTO artists VALUES (NULL, %s, %s, NULL)", name, pwd)
+        result = self._execute_query("INSERT INTO artists VALUES (NULL, %s, %s, NULL)", name, pwd)
+        IdsRepository.get_instance().invalidate_artist(name)
+        return result
 
-    def get_all_artists(self):
-        return self._execute_query("SELECT * FROM artists")
+    def get_all_artists(self, after_id: int = 0, limit: Optional[int] = None) -> RowBatches:
+        """
+        Get all artists, without their passwords.
+        :param after_id: only artists with a larger id are returned. The last id of the previous page, when paging.
+        :param limit: the maximal number of artists to return. None for no limit.
+        :return: (artist_id, artist_name, artist_spotify_id) of the artists, ordered by id, streamed in batches.
+        """
+        return self._stream_page("SELECT artist_id, artist_name, artist_spotify_id FROM artists"
+                                 " WHERE artist_id > %s ORDER BY artist_id", after_id, limit)
 
     def get_artist_by_name(self, artist_name: str):
         return self._execute_query("SELECT * FROM artists WHERE artist_name=%s", artist_name)
@@ -82,37 +95,30 @@ class ArtistsRepository(BaseRepository):
     def get_artist_albums_by_name(self, artist_name: str) -> List[Tuple]:
         return self._execute_query("""
                                 SELECT * FROM albums WHERE album_id IN(
-                                    SELECT album_id FROM artist_album_connector WHERE artist_id = 
-                                        (SELECT artist_id FROM artists WHERE artist_name = %s))
-                                    """, artist_name)
+                                    SELECT album_id FROM artist_album_connector WHERE artist_id = %s)
+                                    """, IdsRepository.get_instance().get_artist_id(artist_name))
 
     def get_artist_avg_rating(self, artist_name: str) -> float:
-        avg_rating = self._execute_query("""SELECT AVG(rating) FROM comment_on_song WHERE song_id IN
-        (SELECT song_id FROM songs WHERE album IN
-            (SELECT album_id FROM albums WHERE album_id IN(
-                SELECT album_id FROM artist_album_connector WHERE artist_id = 
-                    (SELECT artist_id FROM artists WHERE artist_name = %s))))""", artist_name)
+        artist_id = IdsRepository.get_instance().get_artist_id(artist_name)
+        avg_rating = self._execute_query("SELECT (SELECT avg_comment_rating FROM artist_rating_stats "
+                                         "WHERE artist_id = %s)", artist_id)
         return avg_rating[0][0]
 
+    @cached_result('highest_rated_artists', ttl=consts.RESULT_CACHE_LEADERBOARD_TTL, limit_arg='n',
+                   min_limit=consts.RESULT_CACHE_MIN_LIMIT)
     def get_highest_rated_artists(self, n: int) -> List[Tuple[str, int]]:
-        top_n_artists = self._execute_query("""
-                                    SELECT artist_name, avg_art FROM artists JOIN
-                                    (SELECT artist_id, AVG(avg_alb) AS avg_art FROM artist_album_connector AS abc JOIN(
-                                    SELECT album, AVG(avg_rate) as avg_alb FROM songs JOIN
-                                    (SELECT AVG(rating) as avg_rate, song_id
-                                     FROM comment_on_song GROUP BY song_id) AS avg_ratings
-                                     ON avg_ratings.song_id = songs.song_id GROUP BY album) AS avg_album_ratings
-                                     ON avg_album_ratings.album = abc.album_id GROUP BY artist_id) AS avg_artist_rating
-                                     ON artists.artist_id = avg_artist_rating.artist_id ORDER BY avg_art DESC LIMIT %s;
+        top_n_artists = self._execute_shared_query("""
+                                    SELECT artist_name, ars.avg_rating FROM artist_rating_stats AS ars JOIN artists
+                                     ON artists.artist_id = ars.artist_id
+                                     ORDER BY ars.avg_rating DESC, ars.artist_id LIMIT %s;
                                     """, n)
         return top_n_artists
 
     def link_artist_to_genre(self, artist_name: str, genre_name: str):
         return self._execute_query("""
-                                    INSERT INTO artist_genre_connector VALUES
-                                    ((SELECT artist_id FROM artists WHERE artist_name = %s),
-                                    (SELECT genre_id FROM genres WHERE genre_name = %s))
-                                    """, artist_name, genre_name)
+                                    INSERT INTO artist_genre_connector VALUES (%s, %s)
+                                    """, IdsRepository.get_instance().get_artist_id(artist_name),
+                                   IdsRepository.get_instance().get_genre_id(genre_name))
 
 
 if __name__ == '__main__':
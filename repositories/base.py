@@ -1,6 +1,35 @@
-from app_conf import db_conn
+import contextlib
+import sys
+import time
+from contextlib import contextmanager
 
-from typing import Tuple, List
+from mysql.connector import errorcode
+
+import single_flight
+from app_conf import db_pool, metrics, query_flights, slow_queries, statement_cache
+from config import consts
+
+from typing import Generator, Optional, Tuple, List
+
+# The results of a streamed query, in batches of rows.
+RowBatches = Generator[List[Tuple], None, None]
+
+# The files of the frames between a repository method and its query, which are skipped when looking for the method.
+_QUERY_PLUMBING = {__file__, single_flight.__file__, contextlib.__file__}
+
+
+def _caller() -> Optional[str]:
+    """
+    :return: the qualified name of the function that ran the current query - the first frame on the stack outside
+    of this module and the query plumbing, e.g. "SongRepository.get_song_by_song_name_and_album_name". For streamed
+    queries, which run as their results are consumed, it is the consumer instead. Only looked up for slow queries.
+    """
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename in _QUERY_PLUMBING:
+        frame = frame.f_back
+    if frame is None:
+        return None
+    return getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)
 
 
 class BaseRepository:
@@ -12,14 +41,149 @@ class BaseRepository:
             cls._instance = cls()
         return cls._instance
 
+    @staticmethod
+    def _run(conn, raw: str, args: tuple) -> List[Tuple]:
+        """
+        Executes a query on a checked out connection and fetches its results.
+        Runs it as a cached prepared statement while the statement cache is enabled, and as a plain query otherwise.
+        """
+        prepared = statement_cache.is_preparable(raw)
+        start = time.perf_counter()
+        try:
+            if prepared:
+                session, prepared_raw = statement_cache.cursor(conn, raw)
+                try:
+                    session.execute(prepared_raw, args)
+                    fetch_start = time.perf_counter()
+                    results = session.fetchall()
+                except Exception as e:
+                    statement_cache.discard(conn, raw)
+                    errno = getattr(e, 'errno', None)
+                    # Statements the server can not prepare - of an unsupported type, or with more placeholders
+                    # than a prepared statement can have - still run as plain queries.
+                    if errno not in (errorcode.ER_UNSUPPORTED_PS, errorcode.ER_PS_MANY_PARAM):
+                        raise
+                    # Too many placeholders is a matter of the arguments' number, not of the SQL text (which is
+                    # usually a one off), so only unsupported statements are remembered.
+                    if errno == errorcode.ER_UNSUPPORTED_PS:
+                        statement_cache.mark_unpreparable(raw)
+                    prepared = False
+            if not prepared:
+                with conn.cursor() as session:
+                    session.execute(raw, args)
+                    fetch_start = time.perf_counter()
+                    results = session.fetchall()
+        except Exception as e:
+            elapsed = time.perf_counter() - start
+            metrics.record_query(raw, elapsed, 0.0, 0, failed=True)
+            if elapsed >= slow_queries.threshold:
+                slow_queries.record(raw, args, elapsed, _caller(), failed=True)
+            raise Exception(f"error on executing {raw} with args {args}: {str(e)}") from e
+        end = time.perf_counter()
+        statement_cache.record_latency(prepared, end - start)
+        metrics.record_query(raw, fetch_start - start, end - fetch_start, len(results))
+        if end - start >= slow_queries.threshold:
+            slow_queries.record(raw, args, end - start, _caller())
+        return results
+
     def _execute_query(self, raw: str, *args) -> List[Tuple]:
-        with db_conn.cursor() as session:
+        # Every query checks out its own connection, so concurrent requests do not share a socket.
+        with db_pool.connection() as conn:
+            try:
+                return self._run(conn, raw, tuple(args))
+            finally:
+                conn.commit()
+
+    def _execute_shared_query(self, raw: str, *args) -> List[Tuple]:
+        """
+        Like _execute_query, for the heavy read only queries: concurrent calls with the same query and arguments
+        share a single execution and its result, which they must not modify.
+        """
+        return query_flights.do((raw, args), lambda: self._execute_query(raw, *args))
+
+    def _stream_query(self, raw: str, *args, batch_size: int = consts.DB_STREAM_BATCH_SIZE) -> RowBatches:
+        """
+        Executes a query and yields its results in batches of up to batch_size rows, as they are read from the server,
+        instead of fetching them all into memory first.
+        The query holds its connection until the generator is exhausted or closed.
+        """
+        conn = db_pool.acquire()
+        discard = True
+        try:
+            # An unbuffered cursor, which reads rows off the socket only as they are fetched.
+            session = conn.cursor(buffered=False)
+            start = time.perf_counter()
+            execute_time = None
+            # Only the time spent reading rows counts as fetching, not the time the caller spends on each batch.
+            fetch_time = 0.0
+            row_count = 0
+            failed = False
             try:
                 session.execute(raw, tuple(args))
-                results = session.fetchall()
+                execute_time = time.perf_counter() - start
+                while True:
+                    fetch_start = time.perf_counter()
+                    rows = session.fetchmany(batch_size)
+                    fetch_time += time.perf_counter() - fetch_start
+                    if len(rows) == 0:
+                        break
+                    row_count += len(rows)
+                    yield rows
+                session.close()
+                conn.commit()
             except Exception as e:
-                raise Exception(f"error on executing {raw} with args {args}: {str(e)}")
+                failed = True
+                raise Exception(f"error on executing {raw} with args {args}: {str(e)}") from e
             finally:
-                db_conn.commit()
+                # Also recorded when the stream is closed before its end.
+                if execute_time is None:
+                    execute_time = time.perf_counter() - start
+                metrics.record_query(raw, execute_time, fetch_time, row_count, failed)
+                # Not counting the time the caller spent on each batch.
+                if execute_time + fetch_time >= slow_queries.threshold:
+                    slow_queries.record(raw, tuple(args), execute_time + fetch_time, _caller(), failed)
+            discard = False
+        finally:
+            # A stream that failed, or was closed before its end (e.g. the client went away), may have left rows
+            # unread on the connection, so the connection is closed instead of reused.
+            db_pool.release(conn, discard)
 
-        return results
+    def _stream_page(self, raw: str, after_id: int, limit: Optional[int]) -> RowBatches:
+        """
+        Streams a page of a query, by keyset pagination.
+        :param raw: the query, filtering on its key being greater than its only parameter and ordered by that key,
+        without a LIMIT clause or a closing semicolon.
+        :param after_id: the last key of the previous page, or 0 for the first page.
+        :param limit: the maximal number of rows in the page. None for all the remaining rows.
+        """
+        if limit is None:
+            return self._stream_query(raw + ";", after_id)
+        return self._stream_query(raw + " LIMIT %s;", after_id, limit)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs several queries on the same connection as a single transaction.
+        Yields a function with the same signature as _execute_query, for executing queries inside the transaction.
+        The transaction is committed if the block finishes, and rolled back if it raises.
+        """
+        with db_pool.connection() as conn:
+            def execute(raw: str, *args) -> List[Tuple]:
+                return self._run(conn, raw, tuple(args))
+
+            try:
+                yield execute
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _execute_transaction(self, *statements: Tuple[str, tuple]) -> List[List[Tuple]]:
+        """
+        Executes several statements on the same connection as a single transaction.
+        Either all of them are committed, or, if any of them fails, none are.
+        :param statements: (raw query, query args) pairs, executed in order.
+        :return: the results of each statement, in the same order.
+        """
+        with self._transaction() as execute:
+            return [execute(raw, *args) for raw, args in statements]
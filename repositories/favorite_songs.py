@@ -1,4 +1,6 @@
 from repositories.base import BaseRepository
+from repositories.ids import IdsRepository
+from repositories.recommendations import RecommendationsRepository
 from typing import List, Tuple
 
 
@@ -11,11 +13,15 @@ class FavoriteSongsRepository(BaseRepository):
         :param album_name: The name of the album.
         :param artist_name: The name of the artist.
         """
-        self._execute_query("""
-            INSERT INTO favorite_songs VALUES((SELECT song_id FROM songs WHERE song_name = %s AND album = 
-            (SELECT album_id FROM albums WHERE album_name = %s)),
-            (SELECT artist_id FROM artists WHERE artist_name = %s));
-        """, song_name, album_name, artist_name)
+        # The user's taste profile is updated in the same transaction.
+        ids = IdsRepository.get_instance()
+        song_id = ids.get_song_id(song_name, album_name)
+        album_id = ids.get_album_id(album_name)
+        with self._transaction() as execute:
+            user_id = RecommendationsRepository.lock_user(execute, ids.get_artist_id(artist_name))
+            # A missing song or user fails on the NOT NULL constraint.
+            execute("INSERT INTO favorite_songs VALUES (%s, %s);", song_id, user_id)
+            RecommendationsRepository.apply_favorite(execute, user_id, song_id, album_id)
 
     def get_favorite_songs(self, artist_name: str) -> List[Tuple]:
         """
@@ -33,8 +39,7 @@ class FavoriteSongsRepository(BaseRepository):
          release_date, is_major ,energy, song_spotify_id FROM artist_album_connector AS abc JOIN(
         SELECT * FROM albums JOIN (
         SELECT * FROM songs WHERE song_id IN
-         (SELECT song_id FROM favorite_songs WHERE artist_id = 
-            (SELECT artist_id FROM artists WHERE artist_name = %s))) AS ufs
+         (SELECT song_id FROM favorite_songs WHERE artist_id = %s)) AS ufs
             ON albums.album_id = ufs.album) AS alb ON abc.album_id = alb.album_id)
             as aac
-            ON aac.artist_id = a.artist_id;""", artist_name)
+            ON aac.artist_id = a.artist_id;""", IdsRepository.get_instance().get_artist_id(artist_name))
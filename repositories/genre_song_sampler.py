@@ -0,0 +1,64 @@
+import random
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+class GenreSongSampler:
+    """
+    Keeps, per genre, a compact array of the ids of the songs in that genre (songs on an album of an artist with that
+    genre), and draws uniform random samples out of it.
+    A sample costs O(k) for k songs, instead of the database sorting every song of the genre with ORDER BY RAND().
+    A genre's array is loaded the first time it is sampled, and reloaded once it is older than the ttl,
+    which is how new songs and changes to artists' genres and albums get in.
+    """
+
+    def __init__(self, load_song_ids: Callable[[str], Iterable[int]], ttl: float):
+        """
+        :param load_song_ids: returns the ids of all the songs in a genre, given the genre's name.
+        :param ttl: how long (in seconds) a genre's array is used before it is reloaded.
+        """
+        self._load_song_ids = load_song_ids
+        self._ttl = ttl
+        # genre name -> (load time, song ids)
+        self._song_ids: Dict[str, Tuple[float, array]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+
+    def _get_song_ids(self, genre: str) -> array:
+        loaded = self._song_ids.get(genre)
+        if loaded is not None and time.monotonic() - loaded[0] < self._ttl:
+            return loaded[1]
+        lock = self._locks.setdefault(genre, threading.Lock())
+        # Only one caller loads a genre. While a stale array is being reloaded, everyone else keeps using it.
+        if loaded is not None and not lock.acquire(blocking=False):
+            return loaded[1]
+        if loaded is None:
+            lock.acquire()
+        try:
+            current = self._song_ids.get(genre)
+            # Someone else may have loaded the genre while this caller waited for the lock.
+            if current is not None and current is not loaded:
+                return current[1]
+            song_ids = array('I', self._load_song_ids(genre))
+            self._song_ids[genre] = (time.monotonic(), song_ids)
+            return song_ids
+        finally:
+            lock.release()
+
+    def sample(self, genre: str, k: int) -> List[int]:
+        """
+        Draws up to k distinct songs of a genre, uniformly at random.
+        :param genre: the name of the genre.
+        :param k: the number of songs to draw.
+        :return: the ids of the drawn songs, in random order. All of the genre's songs if it has k or less.
+        """
+        song_ids = self._get_song_ids(genre)
+        positions = random.sample(range(len(song_ids)), min(k, len(song_ids)))
+        return [song_ids[position] for position in positions]
+
+    def clear(self) -> None:
+        """
+        Drops every loaded genre, so each is reloaded the next time it is sampled.
+        """
+        self._song_ids.clear()
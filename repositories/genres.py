@@ -1,7 +1,10 @@
+from config import consts
 from repositories.base import BaseRepository
+from repositories.result_cache import cached_result
 
 
 class GenresRepository(BaseRepository):
 
+    @cached_result('genres', ttl=consts.RESULT_CACHE_CATALOG_TTL)
     def get_all(self):
-        return self._execute_query("SELECT * FROM genres")
+        return self._execute_shared_query("SELECT * FROM genres")
@@ -0,0 +1,137 @@
+from config import consts
+from repositories.base import BaseRepository
+from repositories.lru_cache import LruCache
+from typing import Hashable, Optional
+
+
+class IdsRepository(BaseRepository):
+    """
+    Resolves the names the API works with - artist, album and genre names, and (song name, album name) pairs -
+    to their ids, through a bounded LRU cache per kind, so the other repositories' queries can filter by id instead
+    of each running its own (SELECT ... WHERE name = %s) sub-queries.
+    Ids never change and rows are never deleted, so a resolved id is cached for as long as it fits.
+    Names that do not exist are cached for a short while only, and the insert paths clear them for their kind,
+    as an insert under any spelling the collation considers equal can make them exist.
+    """
+
+    _QUERIES = {
+        'artist': "SELECT artist_id FROM artists WHERE artist_name = %s;",
+        'album': "SELECT album_id FROM albums WHERE album_name = %s;",
+        'genre': "SELECT genre_id FROM genres WHERE genre_name = %s;",
+        'song': "SELECT song_id FROM songs WHERE song_name = %s AND album = %s;",
+    }
+
+    def __init__(self):
+        # kind -> (name -> id, names that do not exist)
+        self._caches = {kind: (LruCache(consts.NAME_ID_CACHE_SIZE),
+                               LruCache(consts.NAME_ID_CACHE_SIZE, ttl=consts.NAME_ID_CACHE_MISSING_TTL))
+                        for kind in self._QUERIES}
+
+    def _resolve(self, kind: str, key: Hashable, *args) -> Optional[int]:
+        ids, missing = self._caches[kind]
+        resolved = ids.get(key)
+        if resolved is not None:
+            return resolved
+        if missing.get(key, False):
+            return None
+        result = self._execute_query(self._QUERIES[kind], *args)
+        if len(result) == 0:
+            missing.put(key, True)
+            return None
+        ids.put(key, result[0][0])
+        return result[0][0]
+
+    def get_artist_id(self, artist_name: str) -> Optional[int]:
+        """
+        :return: the id of the artist (user) with this name, or None if there is no such artist.
+        """
+        return self._resolve('artist', artist_name, artist_name)
+
+    def get_album_id(self, album_name: str) -> Optional[int]:
+        """
+        :return: the id of the album with this name, or None if there is no such album.
+        """
+        return self._resolve('album', album_name, album_name)
+
+    def get_genre_id(self, genre_name: str) -> Optional[int]:
+        """
+        :return: the id of the genre with this name, or None if there is no such genre.
+        """
+        return self._resolve('genre', genre_name, genre_name)
+
+    def get_song_id(self, song_name: str, album_name: str) -> Optional[int]:
+        """
+        :return: the id of the song with this name in the album with this name, or None if there is no such song.
+        """
+        album_id = self.get_album_id(album_name)
+        if album_id is None:
+            return None
+        return self._resolve('song', (song_name, album_name), song_name, album_id)
+
+    def _invalidate(self, kind: str, key: Hashable) -> None:
+        ids, missing = self._caches[kind]
+        ids.pop(key)
+        missing.clear()
+
+    def invalidate_artist(self, artist_name: str) -> None:
+        """
+        Called after inserting an artist, so that the artist's name is looked up again.
+        """
+        self._invalidate('artist', artist_name)
+
+    def invalidate_album(self, album_name: str) -> None:
+        """
+        Called after inserting an album, so that the album's name is looked up again.
+        """
+        self._invalidate('album', album_name)
+
+    def invalidate_song(self, song_name: str, album_name: str) -> None:
+        """
+        Called after inserting a song, so that the song's name is looked up again.
+        """
+        self._invalidate('song', (song_name, album_name))
+
+    def clear(self) -> None:
+        """
+        Empties the caches of every kind, e.g. to measure lookups without them.
+        """
+        for ids, missing in self._caches.values():
+            ids.clear()
+            missing.clear()
+
+    def warm(self) -> None:
+        """
+        Fills the caches with every genre, and the ids most likely to be asked for:
+        the most active commenters, and the most rated albums and songs.
+        Meant to be run in the background on startup.
+        """
+        warm_size = consts.NAME_ID_CACHE_WARM_SIZE
+        genre_ids = self._caches['genre'][0]
+        for genre_id, genre_name in self._execute_query("SELECT genre_id, genre_name FROM genres;"):
+            genre_ids.put(genre_name, genre_id)
+        artist_ids = self._caches['artist'][0]
+        for artist_id, artist_name in self._execute_query(
+                "SELECT artist_id, artist_name FROM artists JOIN "
+                "(SELECT commenter_id, COUNT(*) AS comment_count FROM comment_on_song GROUP BY commenter_id "
+                "ORDER BY comment_count DESC LIMIT %s) AS commenters ON commenters.commenter_id = artists.artist_id;",
+                warm_size):
+            artist_ids.put(artist_name, artist_id)
+        album_ids = self._caches['album'][0]
+        for album_id, album_name in self._execute_query(
+                "SELECT albums.album_id, album_name FROM albums JOIN "
+                "(SELECT album_id FROM album_rating_stats ORDER BY rating_count DESC LIMIT %s) AS rated "
+                "ON rated.album_id = albums.album_id;", warm_size):
+            album_ids.put(album_name, album_id)
+        song_ids = self._caches['song'][0]
+        for song_id, song_name, album_id, album_name in self._execute_query(
+                "SELECT songs.song_id, song_name, album_id, album_name FROM songs JOIN "
+                "(SELECT song_id FROM song_rating_stats ORDER BY rating_count DESC LIMIT %s) AS rated "
+                "ON rated.song_id = songs.song_id JOIN albums ON albums.album_id = songs.album;", warm_size):
+            album_ids.put(album_name, album_id)
+            song_ids.put((song_name, album_name), song_id)
+
+    def stats(self) -> dict:
+        """
+        :return: the hit rates of the caches of each kind.
+        """
+        return {kind: {'ids': ids.stats(), 'missing': missing.stats()} for kind, (ids, missing) in self._caches.items()}
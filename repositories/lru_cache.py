@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LruCache:
+    """
+    A bounded mapping that evicts its least recently used entry once it is full, and counts its hits and misses.
+    Entries can also expire a fixed time after they were put.
+    All operations are plain dict operations that never yield, so greenlets can share a cache without locks.
+    """
+
+    def __init__(self, size: int, ttl: Optional[float] = None):
+        """
+        :param size: the maximal number of entries.
+        :param ttl: how long (in seconds) an entry is kept after it was put. None for as long as it fits.
+        """
+        if size < 1:
+            raise ValueError(f"illegal cache size: {size}")
+        self._size = size
+        self._ttl = ttl
+        # key -> (expiry time or None, value)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        :return: the value of a key, or default if the key is not in the cache or has expired.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self._ttl if self._ttl is not None else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,169 @@
+from decimal import Decimal
+
+from repositories.base import BaseRepository
+from typing import Callable, Optional
+
+
+class RatingStatsRepository(BaseRepository):
+    """
+    Maintains the materialized rating aggregates of songs, albums and artists.
+    song_rating_stats keeps the sum and count of each song's ratings, along with the song's release year, so that
+    its (release_year, avg_rating) index holds a ready leaderboard of each year's songs.
+    album_rating_stats keeps the sum of its rated songs' averages, so an album's rating is the average of its songs'
+    ratings, and artist_rating_stats does the same with the artist's rated albums.
+    Both rollups also keep the plain sum and count of all the ratings under them.
+    Every new rating is propagated up the hierarchy by delta, instead of every rating read running nested
+    AVG(rating) ... GROUP BY aggregations over all the comments.
+    The generated average columns use the same decimal scales as the AVG queries they replace.
+    """
+
+    def create_tables(self) -> None:
+        """
+        Creates the rating aggregate tables if they do not exist yet.
+        """
+        self._execute_query("""
+            CREATE TABLE IF NOT EXISTS song_rating_stats (
+                song_id INT NOT NULL PRIMARY KEY,
+                release_year SMALLINT NULL,
+                rating_sum BIGINT NOT NULL,
+                rating_count INT NOT NULL,
+                avg_rating DECIMAL(14, 4) AS (rating_sum / rating_count) STORED,
+                INDEX song_rating_stats_avg_rating (avg_rating),
+                INDEX song_rating_stats_year_rating (release_year, avg_rating)
+            );
+        """)
+        # Tables created before release_year existed get it here. rebuild_song_rating_stats fills it.
+        if len(self._execute_query("SELECT 1 FROM information_schema.columns WHERE table_schema = DATABASE() "
+                                   "AND table_name = 'song_rating_stats' AND column_name = 'release_year';")) == 0:
+            self._execute_query("ALTER TABLE song_rating_stats ADD COLUMN release_year SMALLINT NULL AFTER song_id, "
+                                "ADD INDEX song_rating_stats_year_rating (release_year, avg_rating);")
+        self._execute_query("""
+            CREATE TABLE IF NOT EXISTS album_rating_stats (
+                album_id INT NOT NULL PRIMARY KEY,
+                song_avg_sum DECIMAL(30, 4) NOT NULL,
+                rated_song_count INT NOT NULL,
+                rating_sum BIGINT NOT NULL,
+                rating_count INT NOT NULL,
+                avg_rating DECIMAL(30, 8) AS (song_avg_sum / rated_song_count) STORED,
+                INDEX album_rating_stats_avg_rating (avg_rating)
+            );
+        """)
+        self._execute_query("""
+            CREATE TABLE IF NOT EXISTS artist_rating_stats (
+                artist_id INT NOT NULL PRIMARY KEY,
+                album_avg_sum DECIMAL(30, 8) NOT NULL,
+                rated_album_count INT NOT NULL,
+                rating_sum BIGINT NOT NULL,
+                rating_count INT NOT NULL,
+                avg_rating DECIMAL(30, 12) AS (album_avg_sum / rated_album_count) STORED,
+                avg_comment_rating DECIMAL(20, 4) AS (rating_sum / rating_count) STORED,
+                INDEX artist_rating_stats_avg_rating (avg_rating)
+            );
+        """)
+
+    @staticmethod
+    def lock_album_for_rating(execute: Callable, album_id: int) -> None:
+        """
+        Locks an album for the rest of the transaction, so that concurrent ratings of songs in the same
+        album apply their deltas one after the other.
+        Must be the first thing a transaction that calls apply_rating does, to keep the lock order consistent.
+        :param execute: the execute function of the current transaction.
+        :param album_id: The id of the album the rated song belongs to.
+        """
+        execute("SELECT album_id FROM albums WHERE album_id = %s FOR UPDATE;", album_id)
+
+    @staticmethod
+    def _locked_avg_rating(execute: Callable, table: str, key_column: str, key: int) -> Optional[Decimal]:
+        result = execute(f"SELECT avg_rating FROM {table} WHERE {key_column} = %s FOR UPDATE;", key)
+        return result[0][0] if len(result) > 0 else None
+
+    @staticmethod
+    def apply_rating(execute: Callable, song_id: int, album_id: int, rating: int) -> None:
+        """
+        Applies a new rating to the song's aggregates, then propagates the change in the song's average to its album,
+        and the change in the album's average to the album's artists.
+        Must run in the same transaction as the insert of the rating itself, after lock_album_for_rating.
+        :param execute: the execute function of the current transaction.
+        :param song_id: The id of the song that was rated.
+        :param album_id: The id of the album the song belongs to.
+        :param rating: The rating given.
+        """
+        old_song_avg = RatingStatsRepository._locked_avg_rating(execute, "song_rating_stats", "song_id", song_id)
+        execute("INSERT INTO song_rating_stats (song_id, release_year, rating_sum, rating_count) "
+                "SELECT song_id, YEAR(release_date), %s, 1 FROM songs WHERE song_id = %s "
+                "ON DUPLICATE KEY UPDATE rating_sum = rating_sum + %s, rating_count = rating_count + 1;",
+                rating, song_id, rating)
+        new_song_avg = RatingStatsRepository._locked_avg_rating(execute, "song_rating_stats", "song_id", song_id)
+
+        old_album_avg = RatingStatsRepository._locked_avg_rating(execute, "album_rating_stats", "album_id", album_id)
+        # A song rated for the first time starts counting towards its album's average.
+        execute("INSERT INTO album_rating_stats (album_id, song_avg_sum, rated_song_count, rating_sum, rating_count) "
+                "VALUES (%s, %s, 1, %s, 1) "
+                "ON DUPLICATE KEY UPDATE song_avg_sum = song_avg_sum + %s, rated_song_count = rated_song_count + %s, "
+                "rating_sum = rating_sum + %s, rating_count = rating_count + 1;",
+                album_id, new_song_avg, rating,
+                new_song_avg - (old_song_avg or 0), int(old_song_avg is None), rating)
+        new_album_avg = RatingStatsRepository._locked_avg_rating(execute, "album_rating_stats", "album_id", album_id)
+
+        execute("INSERT INTO artist_rating_stats "
+                "(artist_id, album_avg_sum, rated_album_count, rating_sum, rating_count) "
+                "SELECT artist_id, %s, 1, %s, 1 FROM artist_album_connector WHERE album_id = %s "
+                "ON DUPLICATE KEY UPDATE album_avg_sum = album_avg_sum + %s, "
+                "rated_album_count = rated_album_count + %s, "
+                "rating_sum = rating_sum + %s, rating_count = rating_count + 1;",
+                new_album_avg, rating, album_id,
+                new_album_avg - (old_album_avg or 0), int(old_album_avg is None), rating)
+
+    @staticmethod
+    def apply_artist_link(execute: Callable, artist_id: int, album_id: int) -> None:
+        """
+        Adds an album's ratings to the aggregates of an artist that was just linked to it.
+        Must run in the same transaction as the insert of the link itself, with the album's row locked.
+        :param execute: the execute function of the current transaction.
+        :param artist_id: The id of the artist.
+        :param album_id: The id of the album.
+        """
+        album_stats = execute("SELECT avg_rating, rating_sum, rating_count FROM album_rating_stats "
+                              "WHERE album_id = %s FOR UPDATE;", album_id)
+        # An album with no ratings does not affect its artists' ratings.
+        if len(album_stats) == 0:
+            return
+        album_avg, rating_sum, rating_count = album_stats[0]
+        execute("INSERT INTO artist_rating_stats "
+                "(artist_id, album_avg_sum, rated_album_count, rating_sum, rating_count) "
+                "VALUES (%s, %s, 1, %s, %s) "
+                "ON DUPLICATE KEY UPDATE album_avg_sum = album_avg_sum + %s, "
+                "rated_album_count = rated_album_count + 1, "
+                "rating_sum = rating_sum + %s, rating_count = rating_count + %s;",
+                artist_id, album_avg, rating_sum, rating_count, album_avg, rating_sum, rating_count)
+
+    def rebuild_song_rating_stats(self) -> None:
+        """
+        Recomputes song_rating_stats from scratch out of comment_on_song.
+        Used to backfill the table, or to fix it if it ever goes out of sync.
+        """
+        self._execute_transaction(
+            ("DELETE FROM song_rating_stats;", ()),
+            ("INSERT INTO song_rating_stats (song_id, release_year, rating_sum, rating_count) "
+             "SELECT songs.song_id, YEAR(release_date), rating_sum, rating_count FROM songs JOIN "
+             "(SELECT song_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count FROM comment_on_song "
+             "GROUP BY song_id) AS ratings ON ratings.song_id = songs.song_id;", ()),
+        )
+
+    def rebuild_rating_rollups(self) -> None:
+        """
+        Recomputes album_rating_stats and artist_rating_stats from scratch out of song_rating_stats.
+        Used to backfill the tables, or to fix them if they ever go out of sync.
+        """
+        self._execute_transaction(
+            ("DELETE FROM artist_rating_stats;", ()),
+            ("DELETE FROM album_rating_stats;", ()),
+            ("INSERT INTO album_rating_stats (album_id, song_avg_sum, rated_song_count, rating_sum, rating_count) "
+             "SELECT album, SUM(avg_rating), COUNT(*), SUM(rating_sum), SUM(rating_count) "
+             "FROM songs JOIN song_rating_stats AS srs ON srs.song_id = songs.song_id GROUP BY album;", ()),
+            ("INSERT INTO artist_rating_stats "
+             "(artist_id, album_avg_sum, rated_album_count, rating_sum, rating_count) "
+             "SELECT artist_id, SUM(avg_rating), COUNT(*), SUM(rating_sum), SUM(rating_count) "
+             "FROM artist_album_connector AS abc JOIN album_rating_stats AS ars ON ars.album_id = abc.album_id "
+             "GROUP BY artist_id;", ()),
+        )
@@ -1,8 +1,11 @@
 import random
 import time
 
+from config import consts
 from repositories.base import BaseRepository
-from typing import List, Tuple
+from repositories.genre_song_sampler import GenreSongSampler
+from repositories.ids import IdsRepository
+from typing import Callable, List, Optional, Tuple
 
 
 class RecommendationsDataProcessing:
@@ -32,6 +35,115 @@ class RecommendationsDataProcessing:
 
 
 class RecommendationsRepository(BaseRepository):
+    """
+    Besides the recommendation queries, maintains the user_genre_profile table - each user's taste profile.
+    A user's score for a genre is the sum of the ratings of the songs the user likes (rated above 3, or added to
+    favorites, which counts as a 5), for every artist of the song's album that has that genre.
+    This is the same score RecommendationsDataProcessing.get_best_genres computes out of
+    get_recommendation_info_by_liked_songs, kept up to date as the user comments and adds favorites.
+    Links between artists and genres or albums are not propagated to the profiles,
+    those are picked up by rebuild_taste_profiles.
+    """
+
+    # Adds a delta to the user's score for every genre of every artist of an album.
+    _PROFILE_DELTA_QUERY = ("INSERT INTO user_genre_profile (artist_id, genre_id, score) "
+                            "SELECT * FROM (SELECT %s AS user_id, agc.genre_id, %s * COUNT(*) AS delta "
+                            "FROM artist_album_connector AS abc "
+                            "JOIN artist_genre_connector AS agc ON agc.artist_id = abc.artist_id "
+                            "WHERE abc.album_id = %s GROUP BY agc.genre_id) AS deltas "
+                            "ON DUPLICATE KEY UPDATE score = score + deltas.delta;")
+
+    def __init__(self):
+        self._sampler = GenreSongSampler(self._get_genre_song_ids, consts.RECOMMENDATION_SAMPLER_TTL)
+
+    def create_tables(self) -> None:
+        """
+        Creates the user_genre_profile table if it does not exist yet.
+        """
+        self._execute_query("""
+            CREATE TABLE IF NOT EXISTS user_genre_profile (
+                artist_id INT NOT NULL,
+                genre_id INT NOT NULL,
+                score INT NOT NULL,
+                PRIMARY KEY (artist_id, genre_id),
+                INDEX user_genre_profile_score (artist_id, score)
+            );
+        """)
+
+    @staticmethod
+    def lock_user(execute: Callable, user_id: Optional[int]) -> Optional[int]:
+        """
+        Locks a user for the rest of the transaction, so that changes to the same user's taste profile are applied
+        one after the other.
+        :param execute: the execute function of the current transaction.
+        :param user_id: the id of the user.
+        :return: the user's id, or None if there is no such user.
+        """
+        user = execute("SELECT artist_id FROM artists WHERE artist_id = %s FOR UPDATE;", user_id)
+        return user[0][0] if len(user) > 0 else None
+
+    @staticmethod
+    def apply_comment(execute: Callable, user_id: int, song_id: int, album_id: int, rating: int) -> None:
+        """
+        Adds a new comment to the user's taste profile, if its rating means the user likes the song.
+        Must run in the same transaction as the insert of the comment, after lock_user.
+        """
+        if rating <= 3:
+            return
+        # A song that is both rated 5 and a favorite is only counted once, as the UNION in the full query does.
+        if rating == 5 and len(execute("SELECT 1 FROM favorite_songs WHERE artist_id = %s AND song_id = %s;",
+                                       user_id, song_id)) > 0:
+            return
+        execute(RecommendationsRepository._PROFILE_DELTA_QUERY, user_id, rating, album_id)
+
+    @staticmethod
+    def apply_favorite(execute: Callable, user_id: int, song_id: int, album_id: int) -> None:
+        """
+        Adds a new favorite song to the user's taste profile.
+        Must run in the same transaction as the insert of the favorite, after lock_user.
+        """
+        if len(execute("SELECT 1 FROM comment_on_song WHERE commenter_id = %s AND song_id = %s AND rating = 5;",
+                       user_id, song_id)) > 0:
+            return
+        execute(RecommendationsRepository._PROFILE_DELTA_QUERY, user_id, 5, album_id)
+
+    def rebuild_taste_profiles(self) -> None:
+        """
+        Recomputes user_genre_profile from scratch out of the comments and favorite songs.
+        Used to backfill the table, and to apply changes to artists' genres and albums to the profiles.
+        """
+        self._execute_transaction(
+            ("DELETE FROM user_genre_profile;", ()),
+            ("INSERT INTO user_genre_profile (artist_id, genre_id, score) "
+             "SELECT liked.user_id, agc.genre_id, SUM(liked.rating) FROM "
+             "((SELECT commenter_id AS user_id, song_id, rating FROM comment_on_song WHERE rating > 3) UNION "
+             "(SELECT artist_id AS user_id, song_id, 5 AS rating FROM favorite_songs)) AS liked "
+             "JOIN songs ON songs.song_id = liked.song_id "
+             "JOIN artist_album_connector AS abc ON abc.album_id = songs.album "
+             "JOIN artist_genre_connector AS agc ON agc.artist_id = abc.artist_id "
+             "GROUP BY liked.user_id, agc.genre_id;", ()),
+        )
+
+    def clear_sampler(self) -> None:
+        """
+        Drops the song ids the genre song sampler loaded, e.g. to measure recommendations without them.
+        """
+        self._sampler.clear()
+
+    def get_best_genres(self, username: str, count: int) -> dict:
+        """
+        Returns the user's best genres out of the user's taste profile.
+        :param username: The username of the user.
+        :param count: The number of genres to return.
+        :return: A dictionary of the best genres for the user, along with the total rating of that genre,
+        ordered from best to worst. Empty if the user does not like any song.
+        """
+        user_id = IdsRepository.get_instance().get_artist_id(username)
+        genres = self._execute_query("SELECT genre_name, score FROM user_genre_profile AS ugp "
+                                     "JOIN genres ON genres.genre_id = ugp.genre_id "
+                                     "WHERE ugp.artist_id = %s "
+                                     "ORDER BY score DESC LIMIT %s;", user_id, count)
+        return {genre: score for genre, score in genres}
 
     def get_recommendation_info_by_liked_songs(self, username: str) -> List[Tuple]:
         """
@@ -41,6 +153,7 @@ class RecommendationsRepository(BaseRepository):
         genre name, artist name, artist_spotify_id, album name, album spotify id, song name, song duration,
         song key, song release date, song in major or not, song energy, song spotify id, song rating according to user.
         """
+        user_id = IdsRepository.get_instance().get_artist_id(username)
         return self._execute_query("SELECT genre_name, artist_name, artist_spotify_id, album_name, album_spotify_id, "
                                    "song_name, duration, song_key, release_date, is_major, energy, "
                                    "song_spotify_id, rating "
@@ -61,21 +174,57 @@ class RecommendationsRepository(BaseRepository):
                                    "(SELECT s.song_id, song_name, album, duration, song_key, release_Date, is_major, "
                                    "energy, song_spotify_id, likely_songs.rating "
                                    "FROM songs AS s JOIN "
-                                   "((SELECT song_id, rating FROM comment_on_song WHERE commenter_id = "
-                                   "(SELECT artists.artist_id FROM artists WHERE artist_name = %s) "
+                                   "((SELECT song_id, rating FROM comment_on_song WHERE commenter_id = %s "
                                    "AND rating > 3) UNION "
-                                   "(SELECT song_id, 5 AS rating FROM favorite_songs WHERE artist_id "
-                                   "= (SELECT artists.artist_id FROM artists WHERE artist_name = %s))) "
+                                   "(SELECT song_id, 5 AS rating FROM favorite_songs WHERE artist_id = %s)) "
                                    "AS likely_songs ON s.song_id = likely_songs.song_id) AS likely_songs_info "
                                    "ON likely_songs_info.album = a.album_id) AS likely_albums ON "
                                    "abc.album_id = likely_albums.album_id) "
                                    "AS likely_artists ON likely_artists.artist_id = artists.artist_id) "
                                    "AS artist_info ON artist_info.artist_id = agc.artist_id) "
-                                   "AS genres_info ON genres.genre_id = genres_info.genre_id;", username, username)
+                                   "AS genres_info ON genres.genre_id = genres_info.genre_id;", user_id, user_id)
+
+    def _get_genre_song_ids(self, genre: str) -> List[int]:
+        """
+        Gets the ids of all the songs in a genre - songs on an album of an artist with that genre.
+        :param genre: The name of the genre.
+        """
+        songs = self._execute_query("SELECT DISTINCT songs.song_id FROM songs "
+                                    "JOIN artist_album_connector AS abc ON abc.album_id = songs.album "
+                                    "JOIN artist_genre_connector AS agc ON agc.artist_id = abc.artist_id "
+                                    "WHERE agc.genre_id = %s;", IdsRepository.get_instance().get_genre_id(genre))
+        return [song[0] for song in songs]
+
+    def _get_genre_songs_by_ids(self, genre: str, song_ids: List[int]) -> List[Tuple]:
+        """
+        Gets songs of a genre by their ids, each with one of its artists that has that genre.
+        :param genre: The name of the genre.
+        :param song_ids: The ids of the songs.
+        :return: A row per song, in the order of song_ids, in the format of get_recommendations_by_liked_genres.
+        """
+        if len(song_ids) == 0:
+            return []
+        placeholders = ', '.join(['%s'] * len(song_ids))
+        rows = self._execute_query("SELECT songs.song_id, song_name, duration, song_key, release_date, is_major, "
+                                   "energy, song_spotify_id, artists.artist_id, artist_name, artist_spotify_id, "
+                                   "albums.album_id, album_name, album_spotify_id FROM songs "
+                                   "JOIN albums ON albums.album_id = songs.album "
+                                   "JOIN artist_album_connector AS abc ON abc.album_id = albums.album_id "
+                                   "JOIN artists ON artists.artist_id = abc.artist_id "
+                                   "JOIN artist_genre_connector AS agc ON agc.artist_id = artists.artist_id "
+                                   "WHERE agc.genre_id = %s "
+                                   f"AND songs.song_id IN ({placeholders});",
+                                   IdsRepository.get_instance().get_genre_id(genre), *song_ids)
+        rows_by_song = {}
+        for row in rows:
+            rows_by_song.setdefault(row[0], []).append(row)
+        # A song with several artists of the genre is recommended once, with one of them.
+        return [random.choice(rows_by_song[song_id]) for song_id in song_ids if song_id in rows_by_song]
 
     def get_recommendations_by_liked_genres(self, genres: List, limit: int) -> dict:
         """
         Gets recommendations on albums, songs and artists via the user's liked genres.
+        The songs of each genre are drawn uniformly at random.
         :param genres: A dict containing the user's preferred genres and the rating of each genre.
         :param limit: The number of recommendations to return.
         :return: A list of tuples containing the following information, in this order:
@@ -84,28 +233,7 @@ class RecommendationsRepository(BaseRepository):
         """
         results_dict = {}
         for genre in genres:
-            results_dict[genre] = self._execute_query("SELECT song_id, song_name, duration, song_key, release_date, "
-                                                      " is_major, energy, song_spotify_id, "
-                                                      "genre_artists_albums.artist_id, "
-                                                      "genre_artists_albums.artist_name, "
-                                                      "genre_artists_albums.artist_spotify_id, "
-                                                      "genre_artists_albums.album_id, genre_artists_albums.album_name, "
-                                                      "genre_artists_albums.album_spotify_id "
-                                                      " FROM songs JOIN "
-                                                      "(SELECT artist_id, artist_name, artist_spotify_id, "
-                                                      "albums.album_id, album_name, album_spotify_id FROM albums JOIN( "
-                                                      "(SELECT abc.artist_id, artist_name, artist_spotify_id, album_id "
-                                                      "FROM artist_album_connector AS abc JOIN "
-                                                      "(SELECT artists.artist_id, artist_name, artist_spotify_id FROM "
-                                                      "artists WHERE artist_id IN( "
-                                                      "SELECT artist_id FROM artist_genre_connector WHERE genre_id = "
-                                                      "(SELECT genre_id FROM genres WHERE genre_name = %s))) "
-                                                      "AS genre_artists ON "
-                                                      "abc.artist_id = genre_artists.artist_id)) AS gab_nfull "
-                                                      "ON gab_nfull.album_id = albums.album_id) AS "
-                                                      "genre_artists_albums "
-                                                      "ON songs.album = genre_artists_albums.album_id "
-                                                      "ORDER BY RAND() LIMIT %s", genre, limit)
+            results_dict[genre] = self._get_genre_songs_by_ids(genre, self._sampler.sample(genre, limit))
         return results_dict
 
 
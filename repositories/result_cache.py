@@ -0,0 +1,127 @@
+import functools
+import inspect
+from typing import Callable, Dict, Hashable, List, Optional
+
+from config import consts
+from repositories.lru_cache import LruCache
+
+_MISSING = object()
+
+
+class ResultCache:
+    """
+    The cache of a single repository method decorated with cached_result, along with its counters.
+    """
+
+    def __init__(self, name: str, ttl: float, size: int):
+        self.name = name
+        self.entries = LruCache(size, ttl)
+        # Bumped by every invalidation, so that results computed before it are not cached after it.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def invalidate(self) -> None:
+        self.entries.clear()
+        self.generation += 1
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+        }
+
+
+_caches: Dict[str, ResultCache] = {}
+
+
+def _first_items(rows: List, count: int, item_key: Optional[Callable]) -> List:
+    """
+    :return: the rows of the first count items. With an item_key, consecutive rows with the same key are one item.
+    """
+    if item_key is None:
+        return rows[:count]
+    items = 0
+    last_key = _MISSING
+    for i, row in enumerate(rows):
+        key = item_key(row)
+        if key != last_key:
+            if items == count:
+                return rows[:i]
+            items += 1
+            last_key = key
+    return list(rows)
+
+
+def cached_result(name: str, ttl: float, size: int = 64, limit_arg: Optional[str] = None, min_limit: int = 0,
+                  item_key: Optional[Callable] = None) -> Callable:
+    """
+    Caches the results of a repository method, by its arguments, for ttl seconds.
+    For methods that return the first N items of a ranking, the limit argument is left out of the cache key:
+    the method is called with a limit of at least min_limit, and smaller limits are served by slicing its result,
+    so e.g. a cached top 100 also answers top 50. Such methods must return their rows in rank order.
+    :param name: the name of the cache, for invalidate_results and the stats.
+    :param ttl: how long (in seconds) a result is cached.
+    :param size: the maximal number of results (different arguments) cached.
+    :param limit_arg: the name of the method's argument that limits the number of items it returns, if it has one.
+    :param min_limit: the minimal limit the method is called with.
+    :param item_key: returns the item a row belongs to, for methods that return several consecutive rows per item.
+    By default, every row is an item.
+    """
+    def decorator(method: Callable) -> Callable:
+        cache = _caches[name] = ResultCache(name, ttl, size)
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not consts.RESULT_CACHE_ENABLED:
+                return method(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key_args = {arg: value for arg, value in bound.arguments.items() if arg not in ('self', limit_arg)}
+            key: Hashable = tuple(key_args.items())
+            limit = int(bound.arguments[limit_arg]) if limit_arg is not None else None
+            # Left to fail in the database, as it did before the cache.
+            if limit is not None and limit < 0:
+                return method(*args, **kwargs)
+            # A cached entry is a (limit it was fetched with, result) pair.
+            entry = cache.entries.get(key, _MISSING)
+            if entry is not _MISSING and (limit is None or entry[0] >= limit):
+                cache.hits += 1
+            else:
+                cache.misses += 1
+                generation = cache.generation
+                if limit is not None:
+                    bound.arguments[limit_arg] = max(limit, min_limit)
+                entry = (bound.arguments.get(limit_arg), method(*bound.args, **bound.kwargs))
+                if cache.generation == generation:
+                    cache.entries.put(key, entry)
+            if limit is None:
+                return entry[1]
+            return _first_items(entry[1], limit, item_key)
+
+        wrapper.result_cache = cache
+        return wrapper
+
+    return decorator
+
+
+def invalidate_results(*names: str) -> None:
+    """
+    Drops every cached result of the named caches. Called by the write paths that change those results.
+    """
+    for name in names:
+        _caches[name].invalidate()
+
+
+def result_cache_stats() -> dict:
+    """
+    :return: the size and hit rate of every result cache, by name.
+    """
+    return {name: cache.stats() for name, cache in _caches.items()}
@@ -1,4 +1,9 @@
 from repositories.base import BaseRepository
+from repositories.ids import IdsRepository
+from repositories.rating_stats import RatingStatsRepository
+from repositories.recommendations import RecommendationsRepository
+from repositories.result_cache import invalidate_results
+from repositories.songs import SongRepository
 from typing import List, Tuple
 
 
@@ -13,11 +18,23 @@ class CommentsRepository(BaseRepository):
         :param comment: The comment to add.
         :param rating: The rating of the comment.
         """
-        self._execute_query("""
-            INSERT INTO comment_on_song VALUES ((SELECT song_id FROM songs WHERE song_name = %s
-             AND album = (SELECT album_id FROM albums WHERE album_name = %s)),
-            (SELECT artist_id FROM artists WHERE artist_name = %s), %s, %s); 
-        """, song_name, album_name, artist_name, comment, rating)
+        # The rating aggregates and the user's taste profile are updated in the same transaction,
+        # so they never disagree with the comments.
+        ids = IdsRepository.get_instance()
+        song_id = ids.get_song_id(song_name, album_name)
+        if song_id is None:
+            raise Exception(f"song {song_name} in album {album_name} does not exist")
+        album_id = ids.get_album_id(album_name)
+        with self._transaction() as execute:
+            RatingStatsRepository.lock_album_for_rating(execute, album_id)
+            user_id = RecommendationsRepository.lock_user(execute, ids.get_artist_id(artist_name))
+            # A missing user fails on the NOT NULL constraint.
+            execute("INSERT INTO comment_on_song VALUES (%s, %s, %s, %s);", song_id, user_id, comment, rating)
+            RatingStatsRepository.apply_rating(execute, song_id, album_id, rating)
+            RecommendationsRepository.apply_comment(execute, user_id, song_id, album_id, rating)
+        SongRepository.get_instance().add_rating_to_leaderboard(song_id, rating)
+        invalidate_results('top_rated_songs', 'top_rated_songs_per_year', 'top_rated_songs_per_years',
+                           'highest_ranked_albums', 'highest_rated_artists')
 
     def get_comments_on_song(self, song_name: str, album_name: str) -> List[Tuple]:
         """
@@ -29,8 +46,6 @@ class CommentsRepository(BaseRepository):
         """
         return self._execute_query("""
             SELECT artist_name, comment_text, rating FROM artists JOIN
-            (SELECT * FROM comment_on_song WHERE song_id = 
-            (SELECT song_id FROM songs WHERE song_name = %s
-             AND album = (SELECT album_id FROM albums WHERE album_name = %s)))
+            (SELECT * FROM comment_on_song WHERE song_id = %s)
              AS co ON co.commenter_id = artists.artist_id;
-        """, song_name, album_name)
+        """, IdsRepository.get_instance().get_song_id(song_name, album_name))
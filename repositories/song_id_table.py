@@ -0,0 +1,42 @@
+import random
+from array import array
+from typing import List, Optional
+
+
+class SongIdTable:
+    """
+    A dense, in-memory array of the ids of all the songs.
+    The song ids themselves have gaps (rows deleted during the import), so picking random ids out of their range
+    misses. Picking random positions in this array does not, which lets random songs be drawn in O(k)
+    instead of the database sorting the whole songs table with ORDER BY RAND().
+    """
+
+    def __init__(self):
+        self._song_ids = array('I')
+
+    @property
+    def max_song_id(self) -> int:
+        return self._song_ids[-1] if len(self._song_ids) > 0 else 0
+
+    def __len__(self):
+        return len(self._song_ids)
+
+    def add(self, song_id: int) -> None:
+        """
+        Adds a song's id to the table.
+        Ids must be added in ascending order. Ids that are not above the largest id in the table are ignored,
+        so overlapping loads of new songs do not add a song twice.
+        """
+        if song_id > self.max_song_id:
+            self._song_ids.append(song_id)
+
+    def sample(self, k: int, seed: Optional[int] = None) -> List[int]:
+        """
+        Draws up to k distinct song ids uniformly at random.
+        :param k: the number of ids to draw.
+        :param seed: if given, the same seed draws the same ids, as long as no songs were added in between.
+        :return: the drawn ids, in random order.
+        """
+        rng = random.Random(seed) if seed is not None else random
+        positions = rng.sample(range(len(self._song_ids)), min(k, len(self._song_ids)))
+        return [self._song_ids[position] for position in positions]
@@ -0,0 +1,109 @@
+import os
+import pickle
+import unicodedata
+from array import array
+from typing import Dict, List, Optional, Set
+
+
+class SongSearchIndex:
+    """
+    An in-memory trigram inverted index over song names, for the approximate (substring) song search.
+    Every song name is split into its 3 character substrings, and each of those maps to the (ascending) list of
+    the songs whose names contain it.
+    A search looks up the query's rarest trigram and checks the query against the names in its list only,
+    instead of MySQL scanning every song name with LIKE '%...%'.
+    Names are compared case and accent insensitively, like the database's default collation does.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self):
+        # Songs are stored by their position in these arrays, which is what the posting lists hold.
+        self._song_ids = array('I')
+        self._names: List[str] = []
+        self._postings: Dict[str, array] = {}
+        self.max_song_id = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """
+        :return: the text without accents and case folded, as it is stored in and searched against the index.
+        """
+        decomposed = unicodedata.normalize('NFKD', text)
+        return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+    @staticmethod
+    def _grams(text: str) -> Set[str]:
+        return {text[i:i + SongSearchIndex.GRAM_SIZE] for i in range(len(text) - SongSearchIndex.GRAM_SIZE + 1)}
+
+    def __len__(self):
+        return len(self._song_ids)
+
+    def add(self, song_id: int, song_name: str) -> None:
+        """
+        Adds a song to the index.
+        Songs must be added in ascending song id order. Songs with an id that was already indexed are ignored,
+        so overlapping loads of new songs do not index a song twice.
+        :param song_id: the id of the song.
+        :param song_name: the name of the song.
+        """
+        if song_id <= self.max_song_id:
+            return
+        self.max_song_id = song_id
+        position = len(self._song_ids)
+        name = self.normalize(song_name)
+        self._song_ids.append(song_id)
+        self._names.append(name)
+        for gram in self._grams(name):
+            posting = self._postings.get(gram)
+            if posting is None:
+                posting = self._postings[gram] = array('I')
+            posting.append(position)
+
+    def search(self, query: str, limit: Optional[int] = None) -> Optional[List[int]]:
+        """
+        Finds the songs whose names contain the query.
+        :param query: the text to search for.
+        :param limit: the maximal number of songs to return, the ones with the lowest ids. None for all of them.
+        :return: the ids of the matching songs in ascending order, or None if the query is too short to be
+        answered by the index, in which case the caller should fall back to searching the database.
+        """
+        query = self.normalize(query)
+        grams = self._grams(query)
+        if len(grams) == 0:
+            return None
+        postings = []
+        for gram in grams:
+            posting = self._postings.get(gram)
+            # A trigram no song has means no song can contain the query.
+            if posting is None:
+                return []
+            postings.append(posting)
+        # Having every trigram of the query does not mean having the query itself, so every candidate is verified.
+        names = self._names
+        song_ids = self._song_ids
+        matches = []
+        for position in min(postings, key=len):
+            if query in names[position]:
+                matches.append(song_ids[position])
+                # A short query (a single common trigram) can match tens of thousands of songs.
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def save(self, path: str) -> None:
+        """
+        Saves a snapshot of the index to a file, so it can be loaded on startup instead of built from the database.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> 'SongSearchIndex':
+        """
+        Loads a snapshot saved by save.
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
@@ -1,19 +1,148 @@
+import os
+import time
+
+from config import consts
 from repositories.base import BaseRepository
-from typing import List, Tuple
+from repositories.ids import IdsRepository
+from repositories.result_cache import cached_result, invalidate_results
+from repositories.song_id_table import SongIdTable
+from repositories.song_leaderboard import SongLeaderboard
+from repositories.song_search_index import SongSearchIndex
+from typing import Dict, List, Optional, Tuple
 
 
 class SongRepository(BaseRepository):
 
+    def __init__(self):
+        # Set by load_search_index once the index is ready. Until then, searches go to the database.
+        self._search_index = None
+        # Set by load_song_indexes once the table is ready. Until then, random songs are drawn by the database.
+        self._song_id_table = None
+        # Set by keep_leaderboard_synced once the leaderboard is loaded. Until then, the database ranks the top songs.
+        self._leaderboard = None
+        # The ratings applied while a new leaderboard is being loaded, which are replayed on it before it replaces the
+        # current one. None when no leaderboard is being loaded.
+        self._pending_ratings: Optional[List[Tuple[int, int]]] = None
+
+    def load_song_indexes(self) -> None:
+        """
+        Loads the in-memory song id table, then the song name search index if it is enabled.
+        Takes a while on the full catalog, so it is meant to be run in the background on startup.
+        """
+        song_id_table = SongIdTable()
+        self._update_song_id_table(song_id_table)
+        self._song_id_table = song_id_table
+        # Catch up with songs that were added while the table was loading.
+        self._update_song_id_table(song_id_table)
+        if consts.SONG_SEARCH_INDEX_ENABLED:
+            self.load_search_index()
+
+    def _update_song_id_table(self, song_id_table: SongIdTable) -> None:
+        """
+        Adds every song newer than the newest song in the table to the table.
+        """
+        songs = self._execute_query("SELECT song_id FROM songs WHERE song_id > %s ORDER BY song_id;",
+                                    song_id_table.max_song_id)
+        for song in songs:
+            song_id_table.add(song[0])
+
+    def load_search_index(self) -> None:
+        """
+        Loads the song name search index - from its snapshot file if there is one, otherwise from the database -
+        and brings it up to date with the songs in the database.
+        Takes a while on the full catalog, so it is meant to be run in the background on startup.
+        """
+        path = consts.SONG_SEARCH_INDEX_SNAPSHOT
+        index = SongSearchIndex.load(path) if path and os.path.exists(path) else SongSearchIndex()
+        indexed = len(index)
+        self._update_search_index(index)
+        if path and len(index) != indexed:
+            index.save(path)
+        self._search_index = index
+        # Catch up with songs that were added while the index was loading.
+        self._update_search_index(index)
+
+    def _update_search_index(self, index: SongSearchIndex) -> None:
+        """
+        Adds every song newer than the newest song in the index to the index.
+        """
+        songs = self._execute_query("SELECT song_id, song_name FROM songs WHERE song_id > %s ORDER BY song_id;",
+                                    index.max_song_id)
+        for i, (song_id, song_name) in enumerate(songs):
+            index.add(song_id, song_name)
+            # Indexing is pure python work, so yield every once in a while to let other greenlets serve requests.
+            if i % 10000 == 0:
+                time.sleep(0)
+
+    def keep_leaderboard_synced(self) -> None:
+        """
+        Loads the top songs leaderboard, then reloads it every LEADERBOARD_RESYNC_INTERVAL seconds, which corrects
+        any drift from the database (e.g. ratings added by other server processes).
+        Runs forever, so it is meant to be run in the background on startup.
+        """
+        while True:
+            try:
+                self._load_leaderboard()
+            except Exception as e:
+                print(f"failed loading the top songs leaderboard: {e}")
+            time.sleep(consts.LEADERBOARD_RESYNC_INTERVAL)
+
+    def _load_leaderboard(self) -> None:
+        """
+        Loads a new leaderboard from the database, and replaces the current one with it.
+        The ratings applied while it loads are recorded, and replayed on it before the swap. The replay and the swap
+        do not yield, so no rating is applied in between. A rating committed right before the load started may be
+        counted twice until the next reload.
+        """
+        prior_mean = self._execute_query("SELECT SUM(rating_sum) / SUM(rating_count) FROM song_rating_stats;")[0][0]
+        leaderboard = SongLeaderboard(consts.LEADERBOARD_MIN_RATINGS, consts.LEADERBOARD_PRIOR_WEIGHT,
+                                      float(prior_mean or 0))
+        self._pending_ratings = []
+        try:
+            for songs in self._stream_query("SELECT song_id, rating_sum, rating_count FROM song_rating_stats;"):
+                for song_id, rating_sum, rating_count in songs:
+                    leaderboard.set(song_id, rating_sum, rating_count)
+                # Yield between batches to let other greenlets serve requests.
+                time.sleep(0)
+            for song_id, rating in self._pending_ratings:
+                leaderboard.add_rating(song_id, rating)
+            self._leaderboard = leaderboard
+        finally:
+            self._pending_ratings = None
+
+    def add_rating_to_leaderboard(self, song_id: int, rating: int) -> None:
+        """
+        Applies a new rating to the top songs leaderboard. Called once the rating is committed.
+        """
+        if self._leaderboard is not None:
+            self._leaderboard.add_rating(song_id, rating)
+        if self._pending_ratings is not None:
+            self._pending_ratings.append((song_id, rating))
+
     def approx_song_search_with_artist_and_album(self, song_name: str) -> List[Tuple]:
         """
         Returns a list of songs that are similar to the song_name parameter, along with their album, artist, and
         the additional information about them.
+        Uses the song search index when it is ready, falling back to searching the database.
+        The index returns at most SONG_SEARCH_MAX_RESULTS songs, the ones with the lowest ids.
         :param song_name: The name of the song to search for.
         :return: A list of songs that are similar to the song_name parameter, with the following info in this order:
         song name, song duration, song key, song release date, song in major or not, song energy,
         song spotify id, artist name, album id, album name.
         Each song can have more than one entry if the song is performed by more than 1 artist.
         """
+        song_ids = None
+        # LIKE wildcards in the query are left for the database to interpret.
+        if self._search_index is not None and '%' not in song_name and '_' not in song_name:
+            song_ids = self._search_index.search(song_name, consts.SONG_SEARCH_MAX_RESULTS)
+        if song_ids is None:
+            return self._approx_song_search_in_db(song_name)
+        return self.get_songs_with_artist_and_album_by_ids(song_ids)
+
+    def _approx_song_search_in_db(self, song_name: str) -> List[Tuple]:
+        """
+        Like approx_song_search_with_artist_and_album, but always scans the song names in the database.
+        """
         return self._execute_query("SELECT "
                                    "s.song_name, s.duration, s.song_key, s.release_date, s.is_major,"
                                    " s.energy, s.song_spotify_id, art_alb_full.ar_name AS artist_name,"
@@ -30,6 +159,30 @@ class SongRepository(BaseRepository):
                                    "ON s.album =  art_alb_full.al_id WHERE s.song_name LIKE CONCAT('%', %s, '%');",
                                    song_name)
 
+    def get_songs_with_artist_and_album_by_ids(self, song_ids: List[int]) -> List[Tuple]:
+        """
+        Returns songs by their ids, along with their album, artist, and the additional information about them.
+        :param song_ids: The ids of the songs.
+        :return: A list of songs with the same info as approx_song_search_with_artist_and_album, ordered by song id.
+        Each song can have more than one entry if the song is performed by more than 1 artist.
+        """
+        song_ids = sorted(song_ids)
+        results = []
+        # In batches of ascending ids, so the concatenated results are still ordered by song id.
+        for start in range(0, len(song_ids), consts.DB_ID_BATCH_SIZE):
+            batch = song_ids[start:start + consts.DB_ID_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            results += self._execute_query("SELECT "
+                                           "s.song_name, s.duration, s.song_key, s.release_date, s.is_major,"
+                                           " s.energy, s.song_spotify_id, art.artist_name, alb.album_id,"
+                                           " alb.album_name "
+                                           "FROM songs AS s "
+                                           "JOIN albums AS alb ON alb.album_id = s.album "
+                                           "JOIN artist_album_connector AS abc ON abc.album_id = alb.album_id "
+                                           "JOIN artists AS art ON art.artist_id = abc.artist_id "
+                                           f"WHERE s.song_id IN ({placeholders}) ORDER BY s.song_id;", *batch)
+        return results
+
     def exact_song_search_with_artist_and_album(self, song_name: str) -> List[Tuple]:
         """
         Returns a list of songs with the same name as the song name, along with their album, artist, and
@@ -65,9 +218,8 @@ class SongRepository(BaseRepository):
         song id, song name, album id, song duration, song key, song release date, song in major or not, song energy,
         song spotify id.
         """
-        return self._execute_query("SELECT * FROM songs AS s WHERE"
-                                   " s.album = (SELECT album_id FROM albums WHERE album_name = %s)"
-                                   " AND s.song_name = %s;", album, song)
+        return self._execute_query("SELECT * FROM songs AS s WHERE s.song_id = %s;",
+                                   IdsRepository.get_instance().get_song_id(song, album))
 
     def get_songs_in_album(self, album: str) -> List[Tuple]:
         """
@@ -77,8 +229,8 @@ class SongRepository(BaseRepository):
         song id, song name, album id, song duration, song key, song release date, song in major or not, song energy,
         song spotify id.
         """
-        return self._execute_query("SELECT * FROM songs AS s WHERE "
-                                   "s.album = (SELECT album_id FROM albums WHERE album_name = %s);", album)
+        return self._execute_query("SELECT * FROM songs AS s WHERE s.album = %s;",
+                                   IdsRepository.get_instance().get_album_id(album))
 
     def get_song_rating(self, song: str, album: str) -> List[Tuple]:
         """
@@ -87,20 +239,25 @@ class SongRepository(BaseRepository):
         :param album: The name of the album the song belongs to.
         :return: A single rating value for the song, averaged from all the ratings given to it.
         """
-        return self._execute_query("SELECT AVG(rating) FROM comment_on_song "
-                                   "WHERE song_id = (SELECT song_id FROM songs "
-                                   "WHERE song_name = %s "
-                                   "AND album = (SELECT album_id FROM albums WHERE album_name = %s));", song, album)
+        return self._execute_query("SELECT (SELECT avg_rating FROM song_rating_stats WHERE song_id = %s);",
+                                   IdsRepository.get_instance().get_song_id(song, album))
 
+    @cached_result('top_rated_songs', ttl=consts.RESULT_CACHE_LEADERBOARD_TTL, limit_arg='limit',
+                   min_limit=consts.RESULT_CACHE_MIN_LIMIT, item_key=lambda row: (row[1], row[2]))
     def get_top_rated_songs(self, limit: int) -> List[Tuple]:
         """
         Returns the top rated songs.
+        The songs are ranked by the in-memory leaderboard once it is loaded, for up to LEADERBOARD_MAX_SIZE songs.
         :param limit: The number of top rated songs to return.
         :return: A list of the top rated songs with the following info in this order:
         artist name, album name, song name, song duration, song key, song release date, song in major or not,
         song energy, song spotify id, rating.
+        Ordered from the highest rated song, songs with the same rating by song id, the rows of each song one after
+        the other.
         """
-        return self._execute_query("""
+        if self._leaderboard is not None and 0 <= limit <= consts.LEADERBOARD_MAX_SIZE:
+            return self._get_rated_songs_by_ids(self._leaderboard.top(limit))
+        return self._execute_shared_query("""
             SELECT artist_name, album_name, song_name, duration, song_key, release_date, is_major, energy,
              song_spotify_id, avg_rating FROM artists JOIN 
             (SELECT artist_id, abc.album_id, album_name, song_id, song_name, duration, song_key, release_date, is_major,
@@ -109,40 +266,98 @@ class SongRepository(BaseRepository):
             SELECT songs.song_id, song_name, album, duration, song_key, release_Date, is_major, energy, song_spotify_id,
              avg_rating
             FROM songs JOIN
-                (SELECT AVG(rating) as avg_rating, song_id FROM comment_on_song GROUP BY song_id ORDER BY avg_rating
-                 DESC LIMIT %s)
+                (SELECT avg_rating, song_id FROM song_rating_stats ORDER BY avg_rating DESC, song_id LIMIT %s)
             AS rtngs 
             ON songs.song_id = rtngs.song_id
             GROUP BY songs.song_id) AS best_songs ON albums.album_id = best_songs.album)
-            AS bs_albums ON abc.album_id = bs_albums.album_id) AS bsa_artists ON bsa_artists.artist_id = artists.artist_id;
+            AS bs_albums ON abc.album_id = bs_albums.album_id) AS bsa_artists ON bsa_artists.artist_id = artists.artist_id
+            ORDER BY bsa_artists.avg_rating DESC, bsa_artists.song_id;
         """, limit)
 
-    def get_top_rated_songs_per_year(self, rel_date: str, lim: int) -> List[Tuple]:
+    def _get_rated_songs_by_ids(self, song_ids: List[int]) -> List[Tuple]:
+        """
+        Returns rated songs by their ids, in the format of get_top_rated_songs, in the order of song_ids.
+        """
+        if len(song_ids) == 0:
+            return []
+        placeholders = ', '.join(['%s'] * len(song_ids))
+        return self._execute_shared_query(f"""
+        SELECT artist_name, album_name, song_name, duration, song_key, release_date, is_major, energy,
+         song_spotify_id, srs.avg_rating
+        FROM songs JOIN song_rating_stats AS srs ON srs.song_id = songs.song_id
+        JOIN albums ON albums.album_id = songs.album
+        JOIN artist_album_connector AS abc ON abc.album_id = albums.album_id
+        JOIN artists ON artists.artist_id = abc.artist_id
+        WHERE songs.song_id IN ({placeholders}) ORDER BY FIELD(songs.song_id, {placeholders});
+        """, *song_ids, *song_ids)
+
+    @cached_result('top_rated_songs_per_year', ttl=consts.RESULT_CACHE_LEADERBOARD_TTL, limit_arg='lim',
+                   min_limit=consts.RESULT_CACHE_MIN_LIMIT, item_key=lambda row: (row[1], row[2]))
+    def get_top_rated_songs_per_year(self, year: int, lim: int) -> List[Tuple]:
         """
         Returns the top rated songs per year.
-        :param rel_date: A date string containing the year the songs were released.
+        The songs are read off the year's part of the (release_year, avg_rating) index of song_rating_stats,
+        which is kept up to date by every new rating.
+        :param year: The year the songs were released.
         :param lim: How many songs to get.
         :return: A list of the top rated songs per year with the following info in this order:
         artist name, album name, song name, song duration, song key, song release date, song in major or not,
         song energy, song spotify id, rating.
+        Ordered from the highest rated song, the rows of each song one after the other.
         """
-        return self._execute_query("""
+        return self._execute_shared_query("""
         SELECT artist_name, album_name, song_name, duration, song_key, release_date, is_major, energy,
-         song_spotify_id, avg_rating FROM artists JOIN(
-        SELECT artist_id, abc.album_id, album_name, song_id, song_name, duration, song_key, release_date,
-         is_major, energy, song_spotify_id, avg_rating  FROM artist_album_connector AS abc JOIN
-        (SELECT * FROM albums JOIN(
-        SELECT year_songs.song_id, song_name, album, duration, song_key, release_Date, is_major, energy,
-         song_spotify_id, avg_rating
-        FROM (SELECT * FROM songs WHERE YEAR(release_date) = YEAR(STR_TO_DATE(%s, "%Y-%m-%d"))) AS year_songs
-        JOIN (SELECT AVG(rating) as avg_rating, song_id FROM comment_on_song GROUP BY song_id)
-        AS rtngs 
-        ON year_songs.song_id = rtngs.song_id
-        GROUP BY year_songs.song_id
-        ORDER BY avg_rating DESC
-        LIMIT %s) AS top ON albums.album_id = top.album) AS top_with_albums ON top_with_albums.album_id = abc.album_id)
-        AS top_with_artist_ids ON top_with_artist_ids.artist_id = artists.artist_id;
-        """, rel_date, lim)
+         song_spotify_id, top.avg_rating
+        FROM (SELECT song_id, avg_rating FROM song_rating_stats WHERE release_year = %s
+              ORDER BY avg_rating DESC, song_id LIMIT %s) AS top
+        JOIN songs ON songs.song_id = top.song_id
+        JOIN albums ON albums.album_id = songs.album
+        JOIN artist_album_connector AS abc ON abc.album_id = albums.album_id
+        JOIN artists ON artists.artist_id = abc.artist_id
+        ORDER BY top.avg_rating DESC, top.song_id;
+        """, year, lim)
+
+    def get_top_rated_songs_per_years(self, from_year: int, to_year: int, lim: int) -> Dict[int, List[Tuple]]:
+        """
+        Returns the top rated songs of each year in a range of years.
+        Years outside of the range of years the songs were released in are left out.
+        :param from_year: The first year of the range.
+        :param to_year: The last year of the range (inclusive).
+        :param lim: How many songs to get per year.
+        :return: A dictionary from each year to its top rated songs, in the format of get_top_rated_songs_per_year.
+        """
+        max_year, min_year = self.get_max_and_min_song_years()
+        if max_year is None:
+            return {}
+        from_year, to_year = max(from_year, min_year), min(to_year, max_year)
+        songs_per_year = {year: [] for year in range(from_year, to_year + 1)}
+        if from_year <= to_year:
+            for row in self._get_top_rated_songs_in_years(from_year, to_year, lim):
+                songs_per_year[row[0]].append(row[1:])
+        return songs_per_year
+
+    @cached_result('top_rated_songs_per_years', ttl=consts.RESULT_CACHE_LEADERBOARD_TTL)
+    def _get_top_rated_songs_in_years(self, from_year: int, to_year: int, lim: int) -> List[Tuple]:
+        """
+        Returns the top rated songs of every year in a range of years, in a single query, instead of a query per year.
+        Each year's songs are numbered in rank order over the range's part of the (release_year, avg_rating) index,
+        and the first lim of each year are kept.
+        :return: the rows of get_top_rated_songs_per_year, each with its year first, ordered by year and then from the
+        highest rated song.
+        """
+        return self._execute_shared_query("""
+        SELECT ranked.release_year, artist_name, album_name, song_name, duration, song_key, release_date, is_major,
+         energy, song_spotify_id, ranked.avg_rating
+        FROM (SELECT song_id, release_year, avg_rating,
+               ROW_NUMBER() OVER (PARTITION BY release_year ORDER BY avg_rating DESC, song_id) AS position
+              FROM song_rating_stats WHERE release_year BETWEEN %s AND %s) AS ranked
+        JOIN songs ON songs.song_id = ranked.song_id
+        JOIN albums ON albums.album_id = songs.album
+        JOIN artist_album_connector AS abc ON abc.album_id = albums.album_id
+        JOIN artists ON artists.artist_id = abc.artist_id
+        WHERE ranked.position <= %s
+        ORDER BY ranked.release_year, ranked.avg_rating DESC, ranked.song_id;
+        """, from_year, to_year, lim)
 
     def add_song(self, song_name: str, album_name: str, artist_name: str, spotify_id: str, dur: int,
                  scale: str, rel_date: str, is_major: bool, energy: float) -> None:
@@ -159,27 +374,69 @@ class SongRepository(BaseRepository):
         :param energy: the song's energy.
         :return: True if the song was added successfully, False otherwise.
         """
+        # No rating aggregates need updating here: a new song has no ratings, and the procedure only links the
+        # artist to the album when it creates a new album, which has no ratings either.
         self._execute_query("CALL add_song(%s, %s, %s, %s, %s, %s, %s, %s, %s);", song_name, album_name,
                             artist_name, spotify_id, dur, scale, rel_date, is_major, energy)
+        # The procedure creates the album and the artist too, if they do not exist yet.
+        ids = IdsRepository.get_instance()
+        ids.invalidate_song(song_name, album_name)
+        ids.invalidate_album(album_name)
+        ids.invalidate_artist(artist_name)
+        invalidate_results('song_years')
+        if self._song_id_table is not None:
+            self._update_song_id_table(self._song_id_table)
+        if self._search_index is not None:
+            self._update_search_index(self._search_index)
 
+    @cached_result('song_years', ttl=consts.RESULT_CACHE_CATALOG_TTL)
     def get_max_and_min_song_years(self) -> Tuple:
         """
         Returns the max and min year of songs in the database.
         :return: A list containing a single tuple with the max and min year of songs in the database.
         """
-        return self._execute_query("SELECT MAX(YEAR(release_date)) AS latest_song_date,"
-                                   " MIN(YEAR(release_date)) AS oldest_song_date FROM songs;")[0]
+        return self._execute_shared_query("SELECT YEAR(MAX(release_date)) AS latest_song_date,"
+                                          " YEAR(MIN(release_date)) AS oldest_song_date FROM songs;")[0]
+
+    def get_random(self, limit: int, seed: Optional[int] = None) -> List[Tuple]:
+        """
+        Returns random songs.
+        Songs are drawn out of the in-memory song id table when it is ready, falling back to the database.
+        :param limit: The number of songs to return.
+        :param seed: If given, the same seed returns the same songs, as long as no songs were added in between.
+        :return: A list of songs with the following info in this order:
+        artist name, album name, song name, song duration, song key, song release date, song in major or not,
+        song energy, song spotify id.
+        Each song can have more than one entry if the song is performed by more than 1 artist.
+        """
+        if self._song_id_table is None:
+            return self._get_random_from_db(limit, seed)
+        song_ids = self._song_id_table.sample(limit, seed)
+        if len(song_ids) == 0:
+            return []
+        placeholders = ', '.join(['%s'] * len(song_ids))
+        return self._execute_query(f"""
+        SELECT artist_name, album_name, song_name, duration, song_key, release_date, is_major, energy, song_spotify_id
+        FROM songs JOIN albums ON albums.album_id = songs.album
+        JOIN artist_album_connector AS abc ON abc.album_id = albums.album_id
+        JOIN artists ON artists.artist_id = abc.artist_id
+        WHERE songs.song_id IN ({placeholders}) ORDER BY FIELD(songs.song_id, {placeholders});
+        """, *song_ids, *song_ids)
 
-    def get_random(self, limit: int) -> List[Tuple]:
-        return self._execute_query("""
+    def _get_random_from_db(self, limit: int, seed: Optional[int] = None) -> List[Tuple]:
+        """
+        Like get_random, but sorts the whole songs table randomly in the database.
+        """
+        return self._execute_query(f"""
         SELECT artist_name, album_name, song_name, duration, song_key, release_date, is_major, energy, song_spotify_id
         FROM artists JOIN(
         SELECT artist_id, album_name, song_name, duration, song_key, release_date, is_major, energy, song_spotify_id
          FROM artist_album_connector AS abc JOIN
         (SELECT * FROM albums JOIN
-        (SELECT * FROM songs ORDER BY RAND() LIMIT %s) AS s ON albums.album_id = s.album) AS a
+        (SELECT * FROM songs ORDER BY {'RAND(%s)' if seed is not None else 'RAND()'} LIMIT %s) AS s
+         ON albums.album_id = s.album) AS a
         ON abc.album_id = a.album_id) AS a_id ON a_id.artist_id = artists.artist_id;
-        """, limit)
+        """, *([seed] if seed is not None else []), limit)
 
 
 if __name__ == '__main__':
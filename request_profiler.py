@@ -0,0 +1,223 @@
+import collections
+import cProfile
+import hmac
+import io
+import itertools
+import pstats
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import greenlet
+
+from metrics import Metrics
+
+
+class _Profile:
+    """
+    A profiler of the greenlet serving a single request. cProfile profiles a whole thread, and the thread runs every
+    greenlet, so the profiler is paused whenever the request's greenlet switches out (to wait on the database, the
+    connection pool or the client's socket) and resumed when it switches back. The profile is thus of the request's
+    own Python work, and the time it was switched out is counted separately.
+    """
+
+    def __init__(self):
+        self._greenlet = greenlet.getcurrent()
+        self._profiler = cProfile.Profile()
+        self._previous_trace = None
+        self._resumed = None
+        self.running_time = 0.0
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            origin, target = args
+            if target is self._greenlet:
+                self._resume()
+            elif origin is self._greenlet:
+                self._pause()
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def _resume(self):
+        self._resumed = time.perf_counter()
+        self._profiler.enable()
+
+    def _pause(self):
+        self._profiler.disable()
+        if self._resumed is not None:
+            self.running_time += time.perf_counter() - self._resumed
+            self._resumed = None
+
+    def start(self) -> None:
+        self._previous_trace = greenlet.settrace(self._trace)
+        self._resume()
+
+    def stop(self) -> None:
+        self._pause()
+        greenlet.settrace(self._previous_trace)
+
+    def stats(self, sort: str, limit: int) -> str:
+        """
+        :return: the profile as pstats text, of the limit functions that come first by sort.
+        """
+        text = io.StringIO()
+        pstats.Stats(self._profiler, stream=text).sort_stats(sort).print_stats(limit)
+        return text.getvalue()
+
+
+class RequestProfiles:
+    """
+    Profiles single requests on demand: a request with the PROFILE_HEADER header set to the admin token runs under
+    cProfile, and its profile is kept, along with the split of its time between database queries and everything else.
+    Only one request is profiled at a time; requests asking for a profile while another one is running are served
+    without one.
+    The latest profiles are kept in a bounded ring buffer, served on /admin/profiles, which needs the same token.
+    """
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_ID_HEADER = 'X-Profile-Id'
+    # The WSGI environ key of a profiled request's profile id.
+    PROFILE_ID_KEY = 'profile.id'
+
+    def __init__(self, token: str, metrics: Metrics, size: int, stats_limit: int = 50):
+        """
+        :param token: the secret the header must hold for a request to be profiled. Empty for no profiling at all.
+        :param metrics: counts the time each request spends on queries.
+        :param size: the maximal number of profiles kept. The oldest ones are dropped first.
+        :param stats_limit: the maximal number of functions in each profile's stats.
+        """
+        self._token = token
+        self.metrics = metrics
+        self._profiles = collections.deque(maxlen=size)
+        self._stats_limit = stats_limit
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def is_requested(self, environ) -> bool:
+        """
+        :return: whether a request asks to be profiled, with the right token.
+        """
+        if not self._token:
+            return False
+        header = environ.get('HTTP_' + self.PROFILE_HEADER.upper().replace('-', '_'))
+        return header is not None and hmac.compare_digest(header.encode(), self._token.encode())
+
+    def start(self) -> Optional[_Profile]:
+        """
+        :return: a started profile of the current request, or None if another request is being profiled.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        profile = _Profile()
+        profile.start()
+        return profile
+
+    def finish(self, profile: _Profile, environ, status: str, elapsed: float, db_time: list) -> None:
+        """
+        Stops a profile and keeps it.
+        :param status: the response's status code.
+        :param elapsed: the seconds from receiving the request to sending the end of its response.
+        :param db_time: the time the request spent on queries and their number, as counted by metrics.
+        """
+        try:
+            profile.stop()
+        finally:
+            self._lock.release()
+        self._profiles.append({
+            'id': environ[self.PROFILE_ID_KEY],
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'method': environ.get('REQUEST_METHOD', ''),
+            'path': environ.get('PATH_INFO', ''),
+            'query_string': environ.get('QUERY_STRING', ''),
+            'status': status,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            # The request's time split the same way as in /metrics: queries (executing and fetching rows) versus
+            # everything else.
+            'db_ms': round(db_time[0] * 1000, 3),
+            'python_ms': round(max(elapsed - db_time[0], 0.0) * 1000, 3),
+            'queries': db_time[1],
+            # The time the request's greenlet actually ran, which is what the profile covers. The rest it spent
+            # switched out, waiting on IO or on other greenlets.
+            'running_ms': round(profile.running_time * 1000, 3),
+            'stats': profile.stats('cumulative', self._stats_limit),
+        })
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def summaries(self) -> list:
+        """
+        :return: every kept profile without its stats, newest first.
+        """
+        return [{key: value for key, value in profile.items() if key != 'stats'}
+                for profile in reversed(self._profiles)]
+
+    def get(self, profile_id: int) -> Optional[dict]:
+        """
+        :return: the kept profile with this id, or None if there is no such profile.
+        """
+        for profile in self._profiles:
+            if profile['id'] == profile_id:
+                return profile
+        return None
+
+
+class _ProfiledResponse:
+    """
+    Wraps a profiled request's WSGI response, so the profile also covers producing its body (e.g. streamed rows),
+    and is finished once the server closes it.
+    """
+
+    def __init__(self, response, finish):
+        self._response = response
+        self._finish = finish
+
+    def __iter__(self):
+        return iter(self._response)
+
+    def close(self):
+        try:
+            if hasattr(self._response, 'close'):
+                self._response.close()
+        finally:
+            self._finish()
+
+
+class ProfilingMiddleware:
+    """
+    WSGI middleware running the requests that ask for it under a profiler (see RequestProfiles), and telling the
+    client the id of their profile in the PROFILE_ID_HEADER header.
+    Set inside MetricsMiddleware, so the time a profiled request spends on queries is counted the same way.
+    """
+
+    def __init__(self, wsgi_app, profiles: RequestProfiles):
+        self._wsgi_app = wsgi_app
+        self._profiles = profiles
+
+    def __call__(self, environ, start_response):
+        profiles = self._profiles
+        if not profiles.is_requested(environ):
+            return self._wsgi_app(environ, start_response)
+        start = time.perf_counter()
+        profile = profiles.start()
+        if profile is None:
+            return self._wsgi_app(environ, start_response)
+        db_time = profiles.metrics.request_db_time() or profiles.metrics.start_request()
+        profile_id = profiles.next_id()
+        environ[RequestProfiles.PROFILE_ID_KEY] = profile_id
+        status = ['500']
+
+        def profiled_start_response(response_status, headers, exc_info=None):
+            status[0] = response_status.split(' ', 1)[0]
+            headers = list(headers) + [(RequestProfiles.PROFILE_ID_HEADER, str(profile_id))]
+            return start_response(response_status, headers, exc_info)
+
+        def finish() -> None:
+            profiles.finish(profile, environ, status[0], time.perf_counter() - start, db_time)
+
+        try:
+            response = self._wsgi_app(environ, profiled_start_response)
+        except Exception:
+            finish()
+            raise
+        return _ProfiledResponse(response, finish)
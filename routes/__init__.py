@@ -4,3 +4,5 @@ from routes.songs import songs_routes
 from routes.song_comments import comment_routes
 from routes.favorite_songs import favorite_songs_routes
 from routes.genres import genres_routes
+from routes.admin import admin_routes
+from routes.metrics import metrics_routes
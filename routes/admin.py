@@ -0,0 +1,141 @@
+import hmac
+
+from flask import Blueprint, jsonify, request
+
+from app_conf import db_pool, profiles, query_flights, slow_queries, statement_cache
+from config import consts
+from repositories.ids import IdsRepository
+from repositories.result_cache import result_cache_stats
+
+admin_routes = Blueprint('admin', __name__)
+
+# The header the admin token is sent in.
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+
+@admin_routes.before_request
+def require_admin_token():
+    """
+    Only lets requests with the ADMIN_TOKEN in their X-Admin-Token header through to the admin routes, as they expose
+    the server's internals and change its settings. While no token is set, the admin routes are not served at all.
+    """
+    if not consts.ADMIN_TOKEN:
+        return jsonify({'error': "Not found"}), 404
+    token = request.headers.get(ADMIN_TOKEN_HEADER, '')
+    if not hmac.compare_digest(token.encode(), consts.ADMIN_TOKEN.encode()):
+        return jsonify({'error': "Forbidden"}), 403
+
+
+@admin_routes.route('/pool_stats', methods=['GET'])
+def get_pool_stats():
+    """
+    Returns the state of the database connection pool - its size, how many connections are in use,
+    and how long requests waited to check out a connection.
+    """
+    return jsonify(db_pool.stats()), 200
+
+
+@admin_routes.route('/name_id_cache', methods=['GET'])
+def get_name_id_cache_stats():
+    """
+    Returns the size and hit rate of the name to id caches of each kind of name.
+    """
+    return jsonify(IdsRepository.get_instance().stats()), 200
+
+
+@admin_routes.route('/result_cache', methods=['GET'])
+def get_result_cache_stats():
+    """
+    Returns the size and hit rate of the cached results of each cached repository method.
+    """
+    return jsonify(result_cache_stats()), 200
+
+
+@admin_routes.route('/single_flight', methods=['GET'])
+def get_single_flight_stats():
+    """
+    Returns how many of the heavy read queries ran, and how many shared the result of an identical query in flight.
+    """
+    return jsonify(query_flights.stats()), 200
+
+
+@admin_routes.route('/statement_cache', methods=['GET'])
+def get_statement_cache_stats():
+    """
+    Returns the hit rate of the prepared statement cache, and the average query latency with and without
+    prepared statements.
+    """
+    return jsonify(statement_cache.stats()), 200
+
+
+@admin_routes.route('/statement_cache', methods=['PUT'])
+def set_statement_cache_enabled():
+    """
+    Turns the use of prepared statements on or off, e.g. to compare the query latency with and without them.
+    Expects a json body of the form {"enabled": true / false}.
+    """
+    try:
+        enabled = request.json["enabled"]
+    except Exception as e:
+        return str(e), 400
+    if not isinstance(enabled, bool):
+        return "enabled must be true or false", 400
+    statement_cache.enabled = enabled
+    return jsonify(statement_cache.stats()), 200
+
+
+@admin_routes.route('/slow_queries', methods=['GET'])
+def get_slow_queries():
+    """
+    Returns the latest queries that took longer than the slow query threshold, newest first - each one's normalized
+    text, argument types, duration and the repository method that ran it - and the EXPLAIN plan of each query.
+    """
+    return jsonify(slow_queries.entries()), 200
+
+
+@admin_routes.route('/slow_queries', methods=['PUT'])
+def set_slow_query_threshold():
+    """
+    Changes the slow query threshold, e.g. to lower it while looking into a slow route.
+    Expects a json body of the form {"threshold_ms": number}. 0 logs no queries.
+    """
+    try:
+        threshold_ms = request.json["threshold_ms"]
+    except Exception as e:
+        return str(e), 400
+    if not isinstance(threshold_ms, (int, float)) or isinstance(threshold_ms, bool):
+        return "threshold_ms must be a number", 400
+    slow_queries.threshold = threshold_ms / 1000
+    return jsonify(slow_queries.entries()), 200
+
+
+@admin_routes.route('/slow_queries', methods=['DELETE'])
+def clear_slow_queries():
+    """
+    Empties the slow query log, so that the queries still slow afterwards (e.g. after adding an index) are explained
+    again.
+    """
+    slow_queries.clear()
+    return jsonify(slow_queries.entries()), 200
+
+
+@admin_routes.route('/profiles', methods=['GET'])
+def get_profiles():
+    """
+    Returns the latest profiled requests, newest first - each one's route, status, and how its time split between
+    database queries and everything else - without their profiles.
+    A request is profiled by sending it with an X-Profile header holding the admin token. Its profile's id is
+    returned in the X-Profile-Id header of its response.
+    """
+    return jsonify(profiles.summaries()), 200
+
+
+@admin_routes.route('/profiles/<int:profile_id>', methods=['GET'])
+def get_profile(profile_id: int):
+    """
+    Returns a profiled request, along with its profile, as cProfile stats text sorted by cumulative time.
+    """
+    profile = profiles.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'No such profile'}), 404
+    return jsonify(profile), 200
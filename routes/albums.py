@@ -1,8 +1,10 @@
 import string
 
 from flask import Blueprint, jsonify, request, app
+from config import consts
 from repositories.albums import AlbumsRepository
-from repositories.recommendations import RecommendationsRepository, RecommendationsDataProcessing
+from repositories.recommendations import RecommendationsRepository
+from routes.streaming import get_keyset_page_args, stream_json_array
 import math
 
 albums_routes = Blueprint('albums', __name__)
@@ -64,13 +66,18 @@ def add_artist_album_connector():
 def get_all_albums():
     """
     WEB API
-    Get all albums with their ratings.
-    :return: (album_id, album_name, rating)
+    Get all albums, streamed as a json array.
+    Paged by the query params after_id (the last album_id of the previous page) and limit, both optional.
+    :return: (album_id, album_name, album_spotify_id), ordered by album_id.
     """
-    albums = AlbumsRepository.get_instance().get_all_albums()
-    return jsonify([{"album_id": album[0],
-                     "album_name": album[1],
-                     "album_spotify_id": album[2]} for album in albums])
+    try:
+        after_id, limit = get_keyset_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    albums = AlbumsRepository.get_instance().get_all_albums(after_id, limit)
+    return stream_json_array(albums, lambda album: {"album_id": album[0],
+                                                    "album_name": album[1],
+                                                    "album_spotify_id": album[2]})
 
 
 # CHANGE: request.args.get -> route param
@@ -97,13 +104,18 @@ def get_album_by_name(album_name: str):
 def get_all_albums_ratings():
     """
     WEB API
-    Get all albums with their ratings.
-    :return: (album_id, album_name, rating)
+    Get all albums with their ratings, streamed as a json array.
+    Paged by the query params after_id (the last album_id of the previous page) and limit, both optional.
+    :return: (album_id, album_name, rating), ordered by album_id.
     """
-    res = AlbumsRepository.get_instance().get_all_albums_ratings()
-    return jsonify([{"album_id": rec[0],
-                     "album_name": rec[1],
-                     "album_rating": rec[2]} for rec in res])
+    try:
+        after_id, limit = get_keyset_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    res = AlbumsRepository.get_instance().get_all_albums_ratings(after_id, limit)
+    return stream_json_array(res, lambda rec: {"album_id": rec[0],
+                                               "album_name": rec[1],
+                                               "album_rating": rec[2]})
 
 
 @albums_routes.route('/get_x_highest_ranked_albums', methods=["GET"])
@@ -130,14 +142,13 @@ def get_album_recommendations(limit: int, username: string):
     :return: A <limit> long list of recommended songs.
     """
     try:
-        limit = int(limit)
-        # Get info about the user's preferences
+        # Each genre's songs are looked up by an IN (...) list of limit ids, so the limit is capped.
+        limit = min(int(limit), consts.RECOMMENDATIONS_MAX_LIMIT)
         recommendations_rep = RecommendationsRepository.get_instance()
-        recommendations_info = recommendations_rep.get_recommendation_info_by_liked_songs(username)
-        if recommendations_info is None or len(recommendations_info) == 0:
+        # Get the user's top 3 genres out of the user's taste profile
+        best_genres = recommendations_rep.get_best_genres(username, 3)
+        if len(best_genres) == 0:
             return jsonify({'error': "No recommendations found"}), 404
-        # Process the preferences to get the user's top 3 genres
-        best_genres = RecommendationsDataProcessing.get_best_genres(recommendations_info, 3)
         # Get recommendations by those genres
         recommendations = recommendations_rep.get_recommendations_by_liked_genres(best_genres, limit)
         # TEST RESULT: dict per Genre
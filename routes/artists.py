@@ -1,15 +1,34 @@
 import itertools
 import math
 
+from config import consts
 from repositories import ArtistsRepository
 from flask import Blueprint, jsonify, request
 
-from repositories.recommendations import RecommendationsRepository, RecommendationsDataProcessing
+from repositories.recommendations import RecommendationsRepository
 from routes.songs import SongWithArtistAndAlbum
+from routes.streaming import get_keyset_page_args, stream_json_array
 
 artists_routes = Blueprint('artists', __name__)
 
 
+@artists_routes.route('/', methods=["GET"])
+def get_all_artists():
+    """
+    Get all artists, streamed as a json array.
+    Paged by the query params after_id (the last artist_id of the previous page) and limit, both optional.
+    :return: (artist_id, artist_name, artist_spotify_id), ordered by artist_id.
+    """
+    try:
+        after_id, limit = get_keyset_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    artists = ArtistsRepository.get_instance().get_all_artists(after_id, limit)
+    return stream_json_array(artists, lambda artist: {"artist_id": artist[0],
+                                                      "artist_name": artist[1],
+                                                      "artist_spotify_id": artist[2]})
+
+
 @artists_routes.route('/login', methods=["POST"])
 def check_artist_in_db():
     if not ArtistsRepository.get_instance().login_artist_check(request.json["name"],
@@ -85,14 +104,13 @@ def get_recommendations(limit: int, username: str):
     :return: JSON of the reccomendations
     """
     try:
-        limit = int(limit)
-        # Get info about the user's preferences
+        # Each genre's songs are looked up by an IN (...) list of limit ids, so the limit is capped.
+        limit = min(int(limit), consts.RECOMMENDATIONS_MAX_LIMIT)
         recommendations_rep = RecommendationsRepository.get_instance()
-        recommendations_info = recommendations_rep.get_recommendation_info_by_liked_songs(username)
-        if recommendations_info is None or len(recommendations_info) == 0:
+        # Get the user's top 3 genres out of the user's taste profile
+        best_genres = recommendations_rep.get_best_genres(username, 3)
+        if len(best_genres) == 0:
             return jsonify({'error': "No recommendations found"}), 404
-        # Process the preferences to get the user's top 3 genres
-        best_genres = RecommendationsDataProcessing.get_best_genres(recommendations_info, 3)
         # Get recommendations by those genres
         recommendations = recommendations_rep.get_recommendations_by_liked_genres(best_genres, limit)
         if recommendations is None or len(recommendations) == 0:
@@ -1,6 +1,6 @@
 from flask import Blueprint, jsonify, request
 from repositories.favorite_songs import FavoriteSongsRepository
-from routes.songs import SongWithArtistAndAlbum
+from routes.songs import SongWithArtistAndAlbum, group_song_rows
 
 favorite_songs_routes = Blueprint('favorite_songs_routes', __name__)
 
@@ -20,24 +20,18 @@ def add_favorite_song():
 def get_favorite_songs(artist_name: str):
     try:
         songs = FavoriteSongsRepository.get_instance().get_favorite_songs(artist_name)
-        song_list = []
-        for song in songs:
-            song_item = SongWithArtistAndAlbum(
-                artist_name=song[0],
-                album_name=song[2],
-                song_name=song[4],
-                duration=song[5],
-                song_key=song[6],
-                release_date=song[7],
-                is_major=song[8],
-                energy=song[9],
-                song_spotify_id=song[10],
-                album_id=""
-            )
-            if song_item not in song_list:
-                song_list.append(song_item)
-            else:
-                song_list[song_list.index(song_item)].add_artist(song[0])
+        song_list = group_song_rows(songs, lambda song: SongWithArtistAndAlbum(
+            artist_name=song[0],
+            album_name=song[2],
+            song_name=song[4],
+            duration=song[5],
+            song_key=song[6],
+            release_date=song[7],
+            is_major=song[8],
+            energy=song[9],
+            song_spotify_id=song[10],
+            album_id=""
+        ), 10, 0)
         return jsonify([song.to_dict() for song in song_list]), 200
     except Exception as e:
         return jsonify({'Error': "Illegal query"}), 400
\ No newline at end of file
@@ -0,0 +1,13 @@
+from flask import Blueprint, Response
+
+from app_conf import metrics
+
+metrics_routes = Blueprint('metrics', __name__)
+
+
+@metrics_routes.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns the per route and per query metrics, in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1,11 +1,12 @@
 import math
 import random
-from typing import List
+from typing import Callable, List
 
 from flask import Blueprint, jsonify, request
 
+from config import consts
 from repositories.songs import SongRepository
-from repositories.recommendations import RecommendationsRepository, RecommendationsDataProcessing
+from repositories.recommendations import RecommendationsRepository
 
 songs_routes = Blueprint('songs', __name__)
 
@@ -116,6 +117,14 @@ class SongWithArtistAndAlbum(Song):
         """
         self.artists.append(artist_name)
 
+    @staticmethod
+    def from_search_row(song: tuple) -> 'SongWithArtistAndAlbum':
+        """
+        Creates a SongWithArtistAndAlbum from a row returned by the song repository's song searches.
+        """
+        return SongWithArtistAndAlbum(song[0], song[1], song[2], song[3], song[4], song[5], song[6], song[7], song[8],
+                                      song[9])
+
     @staticmethod
     def from_list(song_list: list) -> list:
         """
@@ -164,11 +173,52 @@ class SongWithFullInfo(SongWithArtistAndAlbum):
             'rating': self.rating
         }
 
+    @staticmethod
+    def from_top_rated_row(song: tuple) -> 'SongWithFullInfo':
+        """
+        Creates a SongWithFullInfo from a row returned by the song repository's top rated songs queries.
+        """
+        return SongWithFullInfo(
+            artist_name=song[0],
+            album_name=song[1],
+            song_name=song[2],
+            duration=song[3],
+            song_key=song[4],
+            release_date=song[5],
+            is_major=song[6],
+            energy=song[7],
+            song_spotify_id=song[8],
+            rating=song[9]
+        )
+
+
+def group_song_rows(rows: list, make_song: Callable[[tuple], SongWithArtistAndAlbum], spotify_id_index: int,
+                    artist_index: int) -> List[SongWithArtistAndAlbum]:
+    """
+    Builds song objects out of query rows in which a song performed by more than 1 artist has a row per artist.
+    Rows of the same song (by spotify id) are merged into a single song with all of their artists.
+    Done in a single pass with a dict, rather than searching the list of songs built so far for every row.
+    :param rows: the rows returned by the repository.
+    :param make_song: creates a song object out of a row.
+    :param spotify_id_index: the index of the song's spotify id in a row.
+    :param artist_index: the index of the artist's name in a row.
+    :return: the songs, in the order their first rows appeared in.
+    """
+    songs = {}
+    for row in rows:
+        song = songs.get(row[spotify_id_index])
+        if song is None:
+            songs[row[spotify_id_index]] = make_song(row)
+        # Song already exists but appeared under a different artist.
+        else:
+            song.add_artist(row[artist_index])
+    return list(songs.values())
+
 
 @songs_routes.route('/approx/<song_name>', methods=['GET'])
 def approx_song_search_with_artist_and_album(song_name: str):
     """
-    Returns a list of songs that are like the given song name.
+    Returns a list of songs that are like the given song name, at most SONG_SEARCH_MAX_RESULTS of them.
     :param song_name: the name of the song
     :return: JSON list of songs that are like the given song name with artist and album
     """
@@ -176,15 +226,9 @@ def approx_song_search_with_artist_and_album(song_name: str):
         songs = SongRepository.get_instance().approx_song_search_with_artist_and_album(song_name)
         if songs is None or len(songs) == 0:
             return jsonify({'error': 'No songs found'}), 404
-        song_list = []
-        for song in songs:
-            song_item = SongWithArtistAndAlbum(song[0], song[1], song[2], song[3], song[4], song[5], song[6], song[7],
-                                               song[8], song[9])
-            if song_item not in song_list:
-                song_list.append(song_item)
-            # Song already exists but appeared under a different artist.
-            else:
-                song_list[song_list.index(song_item)].add_artist(song[7])
+        song_list = group_song_rows(songs, SongWithArtistAndAlbum.from_search_row, 6, 7)
+        # The database search, used until the search index is ready, is not limited by the query itself.
+        song_list = song_list[:consts.SONG_SEARCH_MAX_RESULTS]
         return jsonify([song.to_dict() for song in song_list]), 200
     except Exception as e:
         return jsonify({'error': "Illegal query"}), 500
@@ -201,15 +245,7 @@ def exact_song_search_with_artist_and_album(song_name: str):
         songs = SongRepository.get_instance().exact_song_search_with_artist_and_album(song_name)
         if songs is None or len(songs) == 0:
             return jsonify({'error': "No songs found"}), 404
-        song_list = []
-        for song in songs:
-            song_item = SongWithArtistAndAlbum(song[0], song[1], song[2], song[3], song[4], song[5], song[6], song[7],
-                                               song[8], song[9])
-            if song_item not in song_list:
-                song_list.append(song_item)
-            # Song already exists but appeared under a different artist
-            else:
-                song_list[song_list.index(song_item)].add_artist(song[7])
+        song_list = group_song_rows(songs, SongWithArtistAndAlbum.from_search_row, 6, 7)
         return jsonify([song.to_dict() for song in song_list]), 200
     except Exception as e:
         return jsonify({'error': "Illegal query"}), 500
@@ -314,24 +350,7 @@ def get_top_songs(number_of_songs: int):
         if songs is None or len(songs) == 0:
             return jsonify({'error': "Our database appears to have been gone up in flames."
                                      " We deeply apologize for the inconvenience."}), 500
-        song_list = []
-        for song in songs:
-            song_item = SongWithFullInfo(
-                artist_name=song[0],
-                album_name=song[1],
-                song_name=song[2],
-                duration=song[3],
-                song_key=song[4],
-                release_date=song[5],
-                is_major=song[6],
-                energy=song[7],
-                song_spotify_id=song[8],
-                rating=song[9]
-            )
-            if song_item not in song_list:
-                song_list.append(song_item)
-            else:
-                song_list[song_list.index(song_item)].add_artist(song[0])
+        song_list = group_song_rows(songs, SongWithFullInfo.from_top_rated_row, 8, 0)
         return jsonify([song.to_dict() for song in song_list]), 200
     except TypeError:
         return jsonify({'error': "Illegal argument - must be an integer"}), 404
@@ -349,30 +368,13 @@ def get_top_songs_per_year(number_of_songs: int, year: str):
     """
     try:
         number_of_songs = int(number_of_songs)
-        # Make the year a value that can be processed by MySql's STR_TO_DATE function
-        year += '-01-01'
-        songs = SongRepository.get_instance().get_top_rated_songs_per_year(year, number_of_songs)
+        if not year.isdigit():
+            return jsonify({'error': "No songs found for the specified year"}), 404
+        songs = SongRepository.get_instance().get_top_rated_songs_per_year(int(year), number_of_songs)
         if songs is None or len(songs) == 0:
             return jsonify({'error': "No songs found for the specified year"}), 404
-        song_list = []
         # Convert the songs to song objects
-        for song in songs:
-            song_item = SongWithFullInfo(
-                artist_name=song[0],
-                album_name=song[1],
-                song_name=song[2],
-                duration=song[3],
-                song_key=song[4],
-                release_date=song[5],
-                is_major=song[6],
-                energy=song[7],
-                song_spotify_id=song[8],
-                rating=song[9]
-            )
-            if song_item not in song_list:
-                song_list.append(song_item)
-            else:
-                song_list[song_list.index(song_item)].add_artist(song[0])
+        song_list = group_song_rows(songs, SongWithFullInfo.from_top_rated_row, 8, 0)
         return jsonify([song.to_dict() for song in song_list]), 200
     except TypeError:
         return jsonify({'error': "Illegal argument - must be an integer"}), 404
@@ -380,6 +382,30 @@ def get_top_songs_per_year(number_of_songs: int, year: str):
         return jsonify({'error': "Illegal query"}), 500
 
 
+@songs_routes.route('/top_songs_per_years/<int:number_of_songs>/<int:from_year>/<int:to_year>', methods=['GET'])
+def get_top_songs_per_years(number_of_songs: int, from_year: int, to_year: int):
+    """
+    Returns the top songs of every year in a range of years, for timeline views.
+    :param number_of_songs: number of songs to get per year
+    :param from_year: the first year of the range
+    :param to_year: the last year of the range (inclusive)
+    :return: JSON of the top songs of each year in the range, by year.
+    Only the years songs were released in are included, with an empty list for years without rated songs.
+    """
+    try:
+        # Every year of the range gets number_of_songs songs, so it is capped.
+        number_of_songs = min(number_of_songs, consts.TOP_SONGS_PER_YEARS_MAX_LIMIT)
+        songs_per_year = SongRepository.get_instance().get_top_rated_songs_per_years(from_year, to_year,
+                                                                                     number_of_songs)
+        result = {}
+        for year, songs in songs_per_year.items():
+            song_list = group_song_rows(songs, SongWithFullInfo.from_top_rated_row, 8, 0)
+            result[year] = [song.to_dict() for song in song_list]
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({'error': "Illegal query"}), 500
+
+
 @songs_routes.route('/get_reccomendations/<username>/<limit>', methods=['GET'])
 def get_recommendations(limit: int, username: str):
     """
@@ -390,14 +416,13 @@ def get_recommendations(limit: int, username: str):
     """
     try:
         # COPY
-        limit = int(limit)
-        # Get info about the user's preferences
+        # Each genre's songs are looked up by an IN (...) list of limit ids, so the limit is capped.
+        limit = min(int(limit), consts.RECOMMENDATIONS_MAX_LIMIT)
         recommendations_rep = RecommendationsRepository.get_instance()
-        recommendations_info = recommendations_rep.get_recommendation_info_by_liked_songs(username)
-        if recommendations_info is None or len(recommendations_info) == 0:
+        # Get the user's top 3 genres out of the user's taste profile
+        best_genres = recommendations_rep.get_best_genres(username, 3)
+        if len(best_genres) == 0:
             return jsonify({'error': "No recommendations found"}), 404
-        # Process the preferences to get the user's top 3 genres
-        best_genres = RecommendationsDataProcessing.get_best_genres(recommendations_info, 3)
         # Get recommendations by those genres
         recommendations = recommendations_rep.get_recommendations_by_liked_genres(best_genres, limit)
         if recommendations is None or len(recommendations) == 0:
@@ -436,28 +461,26 @@ def get_max_min_years():
 def get_random(limit: int):
     """
     Returns a list of random songs
+    Accepts an optional integer seed query parameter, with which the same songs are returned on every call.
     :return:
     """
     try:
-        songs = SongRepository.get_instance().get_random(limit)
-        song_list = []
-        for song in songs:
-            song_item = SongWithArtistAndAlbum(
-                artist_name=song[0],
-                album_name=song[1],
-                song_name=song[2],
-                duration=song[3],
-                song_key=song[4],
-                release_date=song[5],
-                is_major=song[6],
-                energy=song[7],
-                song_spotify_id=song[8],
-                album_id=0
-            )
-            if song_item not in song_list:
-                song_list.append(song_item)
-            else:
-                song_list[song_list.index(song_item)].add_artist(song[0])
+        seed = request.args.get('seed', type=int)
+        # The drawn songs are looked up by an IN (...) list of limit ids, so the limit is capped.
+        limit = min(limit, consts.RANDOM_SONGS_MAX_LIMIT)
+        songs = SongRepository.get_instance().get_random(limit, seed)
+        song_list = group_song_rows(songs, lambda song: SongWithArtistAndAlbum(
+            artist_name=song[0],
+            album_name=song[1],
+            song_name=song[2],
+            duration=song[3],
+            song_key=song[4],
+            release_date=song[5],
+            is_major=song[6],
+            energy=song[7],
+            song_spotify_id=song[8],
+            album_id=0
+        ), 8, 0)
         return jsonify([song.to_dict() for song in song_list]), 200
     except Exception as e:
         return jsonify({'error': "Illegal query"}), 500
@@ -0,0 +1,72 @@
+import socket
+from typing import Callable, Optional, Tuple
+
+from flask import Response, current_app, request, stream_with_context
+
+from repositories.base import RowBatches
+
+# The WSGI environ keys under which the servers that expose it (werkzeug's development server and gunicorn) put the
+# client's socket.
+_SOCKET_KEYS = ('werkzeug.socket', 'gunicorn.socket')
+
+
+def get_keyset_page_args() -> Tuple[int, Optional[int]]:
+    """
+    Reads the keyset pagination arguments of a list endpoint from the query string:
+    after_id - the last id of the previous page (default 0, the first page).
+    limit - the maximal number of items in the page (default none, all the remaining items).
+    :return: (after_id, limit).
+    :raise ValueError: if either argument is not a non-negative integer.
+    """
+    after_id = request.args.get('after_id', '0')
+    limit = request.args.get('limit')
+    if not after_id.isdigit() or (limit is not None and not limit.isdigit()):
+        raise ValueError("after_id and limit must be non-negative integers")
+    return int(after_id), int(limit) if limit is not None else None
+
+
+def _abort_connection(environ) -> None:
+    """
+    Shuts the client's connection down in the middle of a response, rather than leaving it to the server, as servers
+    differ in how they end a body that raised (a response that is not chunked looks complete whenever it ends).
+    gevent's WSGI server does not expose the socket, but closes the connection itself when a body raises.
+    """
+    for key in _SOCKET_KEYS:
+        client = environ.get(key)
+        if client is not None:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def stream_json_array(batches: RowBatches, to_dict: Callable[[Tuple], dict]) -> Response:
+    """
+    Sends rows as a json array, encoded and sent one batch at a time as the batches arrive,
+    instead of building the whole array and its json in memory first.
+    The status is sent with the first batch, so a query that fails later can not turn the response into an error.
+    The connection is closed mid-body instead, so that the client sees a broken transfer rather than a complete,
+    but truncated, array.
+    :param batches: the rows, in batches, as returned by BaseRepository._stream_query.
+    :param to_dict: converts a row to the object sent for it.
+    """
+    environ = request.environ
+
+    def generate():
+        separator = '['
+        rows_sent = 0
+        try:
+            for rows in batches:
+                yield separator + ','.join(current_app.json.dumps(to_dict(row)) for row in rows)
+                separator = ','
+                rows_sent += len(rows)
+        except Exception as e:
+            print(f"streaming {environ.get('PATH_INFO')} failed after {rows_sent} rows, closing the connection: {e}")
+            _abort_connection(environ)
+            raise
+        finally:
+            # Gives the stream's database connection back right away if the client went away mid-response.
+            batches.close()
+        yield ']' if separator == ',' else '[]'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,93 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    """
+    An execution in flight, and its outcome once it is done.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Whether the call returned or raised an Exception. It is not when the greenlet running it was killed (e.g.
+        # by GreenletExit), in which case there is no outcome to share.
+        self.completed = False
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call with some key is running, other calls with the same key wait
+    for it and share its result (or its exception) instead of running again.
+    Only meant for reads, as the waiting callers get the very same result object, and must not modify it.
+    Only uses threading primitives, which gevent's monkey patching turns into greenlet aware ones.
+    """
+
+    def __init__(self, timeout: float, enabled: bool = True):
+        """
+        :param timeout: how long (in seconds) a call waits for an identical call in flight. A call that waited that
+        long without a result runs by itself.
+        :param enabled: whether calls are coalesced at all. Can be changed at runtime.
+        """
+        self._timeout = timeout
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._executions = 0
+        self._coalesced = 0
+        self._timeouts = 0
+
+    def do(self, key: Hashable, f: Callable[[], Any]) -> Any:
+        """
+        Runs f, unless a call with the same key is already running, in which case its result is returned instead.
+        :param key: identifies identical calls.
+        :param f: the call itself.
+        """
+        if not self.enabled:
+            return f()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executions += 1
+            else:
+                self._coalesced += 1
+        if leader:
+            try:
+                call.result = f()
+                call.completed = True
+            except Exception as e:
+                call.error = e
+                call.completed = True
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+        if not call.done.wait(self._timeout):
+            with self._lock:
+                self._timeouts += 1
+            return f()
+        if not call.completed:
+            return f()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self) -> dict:
+        """
+        :return: how many calls ran, and how many shared the result of another call instead.
+        """
+        with self._lock:
+            total = self._executions + self._coalesced
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._calls),
+                'executions': self._executions,
+                'coalesced': self._coalesced,
+                'coalesced_ratio': self._coalesced / total if total else 0.0,
+                'timeouts': self._timeouts,
+            }
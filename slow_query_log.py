@@ -0,0 +1,171 @@
+import collections
+import json
+import math
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from metrics import query_fingerprint
+
+# The statements MySQL can explain. Anything else (e.g. CALL) is logged without a plan.
+_EXPLAINABLE = re.compile(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+def args_shape(args: tuple) -> List[str]:
+    """
+    :return: the type of each argument of a query, with the length of strings and sequences - never their values,
+    which may be passwords or other user data.
+    """
+    shape = []
+    for arg in args:
+        if isinstance(arg, (str, bytes, list, tuple)):
+            shape.append(f"{type(arg).__name__}[{len(arg)}]")
+        else:
+            shape.append(type(arg).__name__)
+    return shape
+
+
+class SlowQueryLog:
+    """
+    Keeps the latest queries that took longer than a threshold in a bounded ring buffer, along with the
+    EXPLAIN FORMAT=JSON plan of each of their fingerprints, and optionally appends them to a file as json lines.
+    Plans are captured in the background, by a single worker with a bounded queue, on a connection of its own, so a
+    slow query costs its request nothing but an append. Each fingerprint is explained at most once per
+    explain_interval, so a query that is slow under load does not add an EXPLAIN to every execution of it.
+    The worker only uses threading primitives, which gevent's monkey patching turns into greenlet aware ones.
+    """
+
+    def __init__(self, threshold: float, size: int, connection: Callable, explain: bool = True,
+                 explain_interval: float = 300, dump_path: Optional[str] = None, queue_size: int = 100):
+        """
+        :param threshold: the seconds a query must take to be logged. 0 or less logs nothing. Can be changed at
+        runtime.
+        :param size: the maximal number of queries kept. The oldest ones are dropped first.
+        :param connection: returns a context manager of a database connection, to run the EXPLAINs on.
+        :param explain: whether plans are captured at all.
+        :param explain_interval: the minimal number of seconds between two EXPLAINs of the same fingerprint.
+        :param dump_path: a file every logged query is also appended to, or None.
+        :param queue_size: the maximal number of queries waiting for the worker. Slow queries beyond it are kept in
+        the ring buffer only.
+        """
+        self.threshold = threshold
+        self._entries = collections.deque(maxlen=size)
+        self._connection = connection
+        self._explain = explain
+        self._explain_interval = explain_interval
+        self._dump_path = dump_path
+        self._lock = threading.Lock()
+        # fingerprint -> (time it was explained, plan or error), kept for the fingerprints still in the buffer.
+        self._plans: Dict[str, tuple] = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._worker = None
+        self._logged = 0
+        self._dropped = 0
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+    @threshold.setter
+    def threshold(self, threshold: float) -> None:
+        # Disabled as an infinite threshold, so the callers' check is a single comparison either way.
+        self._threshold = threshold if threshold > 0 else math.inf
+
+    def record(self, raw: str, args: tuple, duration: float, caller: Optional[str], failed: bool = False) -> None:
+        """
+        Logs a query that took at least the threshold, and queues it for the worker.
+        :param raw: the SQL text of the query.
+        :param args: the query's arguments. Only their shape is logged, but they are needed to explain it.
+        :param duration: the seconds it took to execute the query and fetch its rows.
+        :param caller: the repository method that ran the query.
+        :param failed: whether the query raised.
+        """
+        fingerprint, text = query_fingerprint(raw)
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'fingerprint': fingerprint,
+            'query': text,
+            'args': args_shape(args),
+            'duration_ms': round(duration * 1000, 3),
+            'caller': caller,
+            'failed': failed,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self._logged += 1
+        if not self._explain and self._dump_path is None:
+            return
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._work, name='slow-query-log', daemon=True)
+            self._worker.start()
+        try:
+            self._queue.put_nowait((entry, raw, args))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def _work(self) -> None:
+        while True:
+            entry, raw, args = self._queue.get()
+            try:
+                plan = self._plan(entry['fingerprint'], raw, args)
+                if self._dump_path is not None:
+                    with open(self._dump_path, 'a') as dump:
+                        dump.write(json.dumps(dict(entry, plan=plan)) + '\n')
+            except Exception as e:
+                print(f"Slow query log failed on {entry['fingerprint']}: {e}")
+
+    def _plan(self, fingerprint: str, raw: str, args: tuple):
+        """
+        :return: the plan of a fingerprint, explaining it first if it was not explained in the last
+        explain_interval seconds. None if it can not be explained.
+        """
+        if not self._explain or not _EXPLAINABLE.match(raw):
+            return None
+        with self._lock:
+            explained_at, plan = self._plans.get(fingerprint, (-math.inf, None))
+        if time.monotonic() - explained_at < self._explain_interval:
+            return plan
+        try:
+            with self._connection() as conn:
+                # A buffered cursor of its own, as the pool's connections may have prepared statement cursors open.
+                with conn.cursor(buffered=True) as session:
+                    session.execute("EXPLAIN FORMAT=JSON " + raw.strip(), args)
+                    plan = json.loads(session.fetchone()[0])
+                conn.commit()
+        except Exception as e:
+            plan = {'error': str(e)}
+        with self._lock:
+            self._plans[fingerprint] = (time.monotonic(), plan)
+            # Only the plans of the queries still in the buffer are kept, so the plans are bounded by it as well.
+            if len(self._plans) > self._entries.maxlen:
+                kept = {logged['fingerprint'] for logged in self._entries}
+                self._plans = {key: value for key, value in self._plans.items() if key in kept}
+        return plan
+
+    def entries(self) -> dict:
+        """
+        :return: the logged queries, newest first, and the latest plan of each of their fingerprints.
+        """
+        with self._lock:
+            entries = list(reversed(self._entries))
+            plans = {fingerprint: plan for fingerprint, (_, plan) in self._plans.items()}
+        return {
+            'threshold_ms': None if math.isinf(self._threshold) else self._threshold * 1000,
+            'logged': self._logged,
+            'dropped': self._dropped,
+            'queries': entries,
+            'plans': {entry['fingerprint']: plans[entry['fingerprint']] for entry in entries
+                      if entry['fingerprint'] in plans},
+        }
+
+    def clear(self) -> None:
+        """
+        Empties the log and forgets every plan, so the next slow execution of each query is explained again.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._plans = {}
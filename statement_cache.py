@@ -0,0 +1,143 @@
+import re
+import weakref
+from collections import OrderedDict
+from typing import Tuple
+
+# An IN list of placeholders, which the callers build with one placeholder per id. Every length is a different SQL
+# text, so such queries would only churn the cache, and long enough lists exceed the server's placeholder limit.
+_PLACEHOLDER_LIST = re.compile(r'\bIN\s*\(\s*%s\s*(?:,\s*%s\s*)*\)', re.IGNORECASE)
+
+
+class StatementCache:
+    """
+    Keeps, per connection, an LRU of server side prepared statements keyed by their SQL text.
+    Each statement lives in its own prepared cursor, so running a query that was already run on the same
+    connection skips parsing and planning it again, and sends its arguments in the binary protocol.
+    Statements belong to the server session they were prepared in, so a connection's statements are dropped when
+    the connection is closed (the pool replaces recycled and dead connections with new ones, which start empty),
+    and when the connection reconnects under the same object (its server connection id changes).
+    Connections are only used by the one greenlet that checked them out, so the per connection LRUs need no locks.
+    """
+
+    def __init__(self, size: int, enabled: bool = True):
+        """
+        :param size: the maximal number of prepared statements kept per connection. The least recently used
+        statement is closed on the server when a new one does not fit.
+        :param enabled: whether queries use prepared statements at all. Can be changed at runtime.
+        """
+        if size < 1:
+            raise ValueError(f"illegal statement cache size: {size}")
+        self._size = size
+        self.enabled = enabled
+        # connection -> (server connection id, SQL text -> (prepared cursor, the SQL text it was prepared with))
+        self._statements = weakref.WeakKeyDictionary()
+        # SQL texts the server refused to prepare, which always run as plain queries.
+        self._unpreparable = set()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        # Query latencies, split by whether prepared statements were used, to compare the two.
+        self._latency = {True: [0, 0.0], False: [0, 0.0]}
+
+    def _connection_statements(self, conn) -> OrderedDict:
+        connection_id = conn.connection_id
+        entry = self._statements.get(conn)
+        if entry is not None and entry[0] == connection_id:
+            return entry[1]
+        if entry is not None:
+            # The connection reconnected, and the old session's statements went with it.
+            self._invalidations += 1
+        statements = OrderedDict()
+        self._statements[conn] = (connection_id, statements)
+        return statements
+
+    def cursor(self, conn, raw: str) -> Tuple[object, str]:
+        """
+        Gets the prepared cursor of a query on a connection, creating it if the query was not prepared on it yet.
+        :param conn: a connection that is checked out by the caller.
+        :param raw: the SQL text of the query.
+        :return: the cursor, and the SQL text to execute it with. The cursor only skips preparing the query again
+        when it is executed with the very same string object it was prepared with.
+        """
+        statements = self._connection_statements(conn)
+        entry = statements.get(raw)
+        if entry is not None:
+            statements.move_to_end(raw)
+            self._hits += 1
+            return entry
+        self._misses += 1
+        entry = statements[raw] = (conn.cursor(prepared=True), raw)
+        if len(statements) > self._size:
+            _, (evicted, _) = statements.popitem(last=False)
+            self._evictions += 1
+            self._close(evicted)
+        return entry
+
+    def is_preparable(self, raw: str) -> bool:
+        """
+        :return: whether a query runs as a prepared statement - not while the cache is disabled, nor for queries
+        the server refused to prepare or with a variable length IN list of placeholders.
+        """
+        return self.enabled and raw not in self._unpreparable and _PLACEHOLDER_LIST.search(raw) is None
+
+    def mark_unpreparable(self, raw: str) -> None:
+        """
+        Remembers that the server can not prepare a query (not every statement type can be), so it is not tried again.
+        """
+        self._unpreparable.add(raw)
+
+    def discard(self, conn, raw: str) -> None:
+        """
+        Drops a query's prepared cursor, after it failed and may have been left in an unusable state.
+        """
+        entry = self._statements.get(conn)
+        if entry is None:
+            return
+        cursor = entry[1].pop(raw, None)
+        if cursor is not None:
+            self._close(cursor[0])
+
+    @staticmethod
+    def _close(cursor) -> None:
+        try:
+            cursor.close()
+        # Failing to deallocate the statement only leaves it on the server until the session ends.
+        except Exception:
+            pass
+
+    def record_latency(self, prepared: bool, elapsed: float) -> None:
+        """
+        Records how long (in seconds) a query took.
+        :param prepared: whether the query ran as a prepared statement.
+        """
+        latency = self._latency[prepared]
+        latency[0] += 1
+        latency[1] += elapsed
+
+    def stats(self) -> dict:
+        """
+        :return: the cache's hit rate, and the average query latency (in seconds) with and without prepared
+        statements.
+        """
+        lookups = self._hits + self._misses
+        latency = {}
+        for prepared, (count, total) in self._latency.items():
+            latency['prepared' if prepared else 'unprepared'] = {
+                'queries': count,
+                'time_total': total,
+                'time_avg': total / count if count else 0.0,
+            }
+        return {
+            'enabled': self.enabled,
+            'size_per_connection': self._size,
+            'connections': len(self._statements),
+            'statements': sum(len(statements) for _, statements in self._statements.values()),
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': self._hits / lookups if lookups else 0.0,
+            'evictions': self._evictions,
+            'invalidations': self._invalidations,
+            'unpreparable': len(self._unpreparable),
+            'latency': latency,
+        }
@@ -0,0 +1,70 @@
+import unittest
+from unittest import mock
+
+from repositories.lru_cache import LruCache
+
+
+class LruCacheTest(unittest.TestCase):
+
+    def test_evicts_the_least_recently_used_entry(self):
+        cache = LruCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # Reading a makes b the least recently used.
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_putting_an_existing_key_refreshes_it(self):
+        cache = LruCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.put('a', 10)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('a'), 10)
+        self.assertIsNone(cache.get('b'))
+
+    def test_falsy_values_are_hits(self):
+        cache = LruCache(2)
+        cache.put('missing', False)
+        self.assertIs(cache.get('missing', True), False)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_entries_expire_after_their_ttl(self):
+        cache = LruCache(2, ttl=10)
+        with mock.patch('repositories.lru_cache.time.monotonic', return_value=100.0):
+            cache.put('a', 1)
+        with mock.patch('repositories.lru_cache.time.monotonic', return_value=109.9):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('repositories.lru_cache.time.monotonic', return_value=110.0):
+            self.assertEqual(cache.get('a', 'expired'), 'expired')
+        # The expired entry is dropped, not only hidden.
+        self.assertEqual(len(cache), 0)
+
+    def test_pop_and_clear(self):
+        cache = LruCache(3)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.pop('a')
+        cache.pop('not there')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_stats(self):
+        cache = LruCache(2)
+        cache.put('a', 1)
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual(cache.stats(), {'size': 1, 'max_size': 2, 'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_illegal_size(self):
+        with self.assertRaises(ValueError):
+            LruCache(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
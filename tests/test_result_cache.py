@@ -0,0 +1,97 @@
+import unittest
+from unittest import mock
+
+from config import consts
+from repositories.result_cache import _first_items, cached_result, invalidate_results, result_cache_stats
+
+
+class Ranking:
+    """
+    A stand in for a repository, whose top method returns the rows of the first limit items of a ranking,
+    two rows per even item (e.g. a song with two artists).
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.during_call = None
+
+    @cached_result('test_ranking', ttl=60, limit_arg='limit', min_limit=10, item_key=lambda row: row[0])
+    def top(self, genre: str, limit: int):
+        self.calls.append((genre, limit))
+        if self.during_call is not None:
+            self.during_call()
+        rows = []
+        for item in range(limit):
+            rows += [(item, genre, artist) for artist in range(2 if item % 2 == 0 else 1)]
+        return rows
+
+    @cached_result('test_catalog', ttl=60)
+    def catalog(self):
+        self.calls.append('catalog')
+        return ['a', 'b']
+
+
+@mock.patch.object(consts, 'RESULT_CACHE_ENABLED', True)
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        invalidate_results('test_ranking', 'test_catalog')
+        self.ranking = Ranking()
+
+    def test_first_items_keeps_every_row_of_an_item(self):
+        rows = [(1, 'a'), (1, 'b'), (2, 'a'), (3, 'a'), (3, 'b')]
+        self.assertEqual(_first_items(rows, 2, lambda row: row[0]), rows[:3])
+        self.assertEqual(_first_items(rows, 3, lambda row: row[0]), rows)
+        self.assertEqual(_first_items(rows, 10, lambda row: row[0]), rows)
+        self.assertEqual(_first_items(rows, 0, lambda row: row[0]), [])
+        self.assertEqual(_first_items(rows, 2, None), rows[:2])
+
+    def test_smaller_limits_are_served_from_the_cached_result(self):
+        top_5 = self.ranking.top('rock', 5)
+        self.assertEqual(self.ranking.calls, [('rock', 10)])
+        self.assertEqual([row[0] for row in top_5], [0, 0, 1, 2, 2, 3, 4, 4])
+        self.ranking.top('rock', 10)
+        self.ranking.top('rock', 3)
+        self.assertEqual(len(self.ranking.calls), 1)
+
+    def test_larger_limits_and_other_arguments_miss(self):
+        self.ranking.top('rock', 5)
+        self.ranking.top('rock', 20)
+        self.ranking.top('pop', 5)
+        self.assertEqual(self.ranking.calls, [('rock', 10), ('rock', 20), ('pop', 10)])
+        # The larger result replaced the smaller one.
+        self.ranking.top('rock', 15)
+        self.assertEqual(len(self.ranking.calls), 3)
+
+    def test_negative_limits_are_not_cached(self):
+        self.ranking.top('rock', -1)
+        self.ranking.top('rock', -1)
+        self.assertEqual(self.ranking.calls, [('rock', -1), ('rock', -1)])
+
+    def test_invalidation_drops_results(self):
+        invalidations = result_cache_stats()['test_catalog']['invalidations']
+        self.ranking.catalog()
+        self.ranking.catalog()
+        invalidate_results('test_catalog')
+        self.ranking.catalog()
+        self.assertEqual(self.ranking.calls, ['catalog', 'catalog'])
+        self.assertEqual(result_cache_stats()['test_catalog']['invalidations'], invalidations + 1)
+
+    def test_results_computed_across_an_invalidation_are_not_cached(self):
+        # A write that lands while the result is being computed may or may not be in it.
+        self.ranking.during_call = lambda: invalidate_results('test_ranking')
+        self.ranking.top('rock', 5)
+        self.ranking.during_call = None
+        self.ranking.top('rock', 5)
+        self.ranking.top('rock', 5)
+        self.assertEqual(len(self.ranking.calls), 2)
+
+    def test_disabled(self):
+        with mock.patch.object(consts, 'RESULT_CACHE_ENABLED', False):
+            self.ranking.catalog()
+            self.ranking.catalog()
+        self.assertEqual(self.ranking.calls, ['catalog', 'catalog'])
+
+
+if __name__ == '__main__':
+    unittest.main()
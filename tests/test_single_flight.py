@@ -0,0 +1,107 @@
+import threading
+import time
+import unittest
+
+from single_flight import SingleFlight
+
+
+class Blocking:
+    """
+    A call that blocks until released, counting how many times it ran.
+    """
+
+    def __init__(self, result=None, error=None):
+        self.release = threading.Event()
+        self.runs = 0
+        self.result = result if result is not None else ['result']
+        self.error = error
+
+    def __call__(self):
+        self.runs += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def _run_concurrently(self, flights: SingleFlight, call, count: int, key='key') -> list:
+        """
+        Runs count identical calls in threads, releases the call once all of them are in flight, and returns what
+        each of them returned or raised.
+        """
+        outcomes = [None] * count
+
+        def run(i):
+            try:
+                outcomes[i] = flights.do(key, call)
+            except BaseException as e:
+                outcomes[i] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while flights.stats()['coalesced'] < count - 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        call.release.set()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_share_a_single_execution(self):
+        flights = SingleFlight(timeout=5)
+        call = Blocking()
+        outcomes = self._run_concurrently(flights, call, 5)
+        self.assertEqual(call.runs, 1)
+        for outcome in outcomes:
+            self.assertIs(outcome, call.result)
+        stats = flights.stats()
+        self.assertEqual((stats['executions'], stats['coalesced'], stats['in_flight']), (1, 4, 0))
+
+    def test_the_leaders_error_is_raised_by_every_caller(self):
+        flights = SingleFlight(timeout=5)
+        error = ValueError('query failed')
+        outcomes = self._run_concurrently(flights, Blocking(error=error), 3)
+        for outcome in outcomes:
+            self.assertIs(outcome, error)
+
+    def test_a_killed_leader_leaves_the_followers_to_run_by_themselves(self):
+        flights = SingleFlight(timeout=5)
+        call = Blocking(error=KeyboardInterrupt())
+        outcomes = self._run_concurrently(flights, call, 3)
+        self.assertEqual(sum(isinstance(outcome, KeyboardInterrupt) for outcome in outcomes), 3)
+        self.assertEqual(call.runs, 3)
+
+    def test_followers_that_waited_too_long_run_by_themselves(self):
+        flights = SingleFlight(timeout=0.01)
+        call = Blocking()
+        leader = threading.Thread(target=flights.do, args=('key', call))
+        leader.start()
+        while flights.stats()['in_flight'] == 0:
+            time.sleep(0.001)
+        follower_result = []
+        follower = threading.Thread(target=lambda: follower_result.append(flights.do('key', lambda: 'own')))
+        follower.start()
+        follower.join(5)
+        call.release.set()
+        leader.join(5)
+        self.assertEqual(follower_result, ['own'])
+        self.assertEqual(flights.stats()['timeouts'], 1)
+
+    def test_calls_after_completion_and_with_other_keys_run_again(self):
+        flights = SingleFlight(timeout=5)
+        self.assertEqual(flights.do('a', lambda: 1), 1)
+        self.assertEqual(flights.do('a', lambda: 2), 2)
+        self.assertEqual(flights.do('b', lambda: 3), 3)
+        self.assertEqual(flights.stats()['executions'], 3)
+
+    def test_disabled(self):
+        flights = SingleFlight(timeout=5, enabled=False)
+        self.assertEqual(flights.do('a', lambda: 1), 1)
+        self.assertEqual(flights.stats()['executions'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
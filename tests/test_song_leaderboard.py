@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+
+from repositories.song_leaderboard import SongLeaderboard
+from repositories.songs import SongRepository
+
+
+class SongLeaderboardTest(unittest.TestCase):
+
+    def test_ranks_by_average_with_ties_by_song_id(self):
+        leaderboard = SongLeaderboard()
+        leaderboard.set(3, 8, 2)
+        leaderboard.set(1, 9, 3)
+        leaderboard.set(2, 4, 1)
+        leaderboard.set(4, 5, 1)
+        self.assertEqual(leaderboard.top(10), [4, 2, 3, 1])
+        self.assertEqual(leaderboard.top(2), [4, 2])
+
+    def test_songs_need_min_count_ratings_to_be_ranked(self):
+        leaderboard = SongLeaderboard(min_count=2)
+        leaderboard.set(1, 5, 1)
+        leaderboard.set(2, 6, 2)
+        self.assertEqual(leaderboard.top(10), [2])
+        self.assertEqual(len(leaderboard), 1)
+        leaderboard.add_rating(1, 5)
+        self.assertEqual(leaderboard.top(10), [1, 2])
+
+    def test_add_rating_moves_the_song(self):
+        leaderboard = SongLeaderboard()
+        leaderboard.set(1, 4, 1)
+        leaderboard.set(2, 3, 1)
+        leaderboard.add_rating(2, 5)
+        leaderboard.add_rating(1, 1)
+        self.assertEqual(leaderboard.top(10), [2, 1])
+        leaderboard.add_rating(3, 5)
+        self.assertEqual(leaderboard.top(10), [3, 2, 1])
+        self.assertEqual(len(leaderboard), 3)
+
+    def test_prior_pulls_songs_with_few_ratings_towards_the_mean(self):
+        leaderboard = SongLeaderboard(prior_weight=2, prior_mean=3.0)
+        # A single 5 scores (3 * 2 + 5) / 3 = 3.67, below forty ratings averaging 4.5: (3 * 2 + 180) / 42 = 4.43.
+        leaderboard.set(1, 5, 1)
+        leaderboard.set(2, 180, 40)
+        self.assertEqual(leaderboard.top(10), [2, 1])
+        self.assertEqual(SongLeaderboard().top(10), [])
+
+
+class LeaderboardReloadTest(unittest.TestCase):
+
+    def test_ratings_added_during_a_reload_are_replayed(self):
+        repository = SongRepository()
+        repository._leaderboard = SongLeaderboard()
+        repository._leaderboard.set(1, 3, 1)
+
+        def stream_query(raw, *args):
+            yield [(1, 3, 1), (2, 4, 1)]
+            # Committed after the table was read, so only the current leaderboard gets it.
+            repository.add_rating_to_leaderboard(1, 5)
+            yield [(3, 2, 1)]
+
+        with mock.patch.object(repository, '_execute_query', return_value=[(3,)]), \
+                mock.patch.object(repository, '_stream_query', side_effect=stream_query):
+            repository._load_leaderboard()
+        self.assertEqual(repository._leaderboard.top(10), [1, 2, 3])
+        self.assertIsNone(repository._pending_ratings)
+        repository.add_rating_to_leaderboard(2, 5)
+        self.assertEqual(repository._leaderboard.top(10), [2, 1, 3])
+
+    def test_a_failed_reload_keeps_the_current_leaderboard(self):
+        repository = SongRepository()
+        current = repository._leaderboard = SongLeaderboard()
+
+        def stream_query(raw, *args):
+            yield [(1, 3, 1)]
+            raise ConnectionError('lost connection')
+
+        with mock.patch.object(repository, '_execute_query', return_value=[(3,)]), \
+                mock.patch.object(repository, '_stream_query', side_effect=stream_query):
+            with self.assertRaises(ConnectionError):
+                repository._load_leaderboard()
+        self.assertIs(repository._leaderboard, current)
+        self.assertIsNone(repository._pending_ratings)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from repositories.song_search_index import SongSearchIndex
+
+
+class SongSearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SongSearchIndex()
+        for song_id, song_name in enumerate(["Love Story", "Lovely Day", "Café del Mar", "abca cab", "The Lover"], 1):
+            self.index.add(song_id, song_name)
+
+    def test_finds_substrings_in_ascending_id_order(self):
+        self.assertEqual(self.index.search("love"), [1, 2, 5])
+
+    def test_ignores_case_and_accents(self):
+        self.assertEqual(self.index.search("CAFE"), [3])
+        self.assertEqual(self.index.search("café"), [3])
+
+    def test_verifies_candidates_having_every_trigram(self):
+        # "abca cab" has every trigram of "abcab" (abc, bca, cab), but not the query itself.
+        self.assertEqual(self.index.search("abcab"), [])
+        self.assertEqual(self.index.search("abca"), [4])
+
+    def test_unknown_trigram_matches_nothing(self):
+        self.assertEqual(self.index.search("xyz"), [])
+
+    def test_short_queries_are_left_to_the_database(self):
+        self.assertIsNone(self.index.search("lo"))
+        self.assertIsNone(self.index.search(""))
+
+    def test_limit_keeps_the_lowest_ids(self):
+        self.assertEqual(self.index.search("love", 2), [1, 2])
+        self.assertEqual(self.index.search("love", 10), [1, 2, 5])
+
+    def test_songs_already_indexed_are_ignored(self):
+        self.index.add(5, "Love Again")
+        self.index.add(3, "Love Again")
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.search("again"), [])
+        self.index.add(6, "Love Again")
+        self.assertEqual(self.index.search("again"), [6])
+        self.assertEqual(self.index.max_song_id, 6)
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.pickle')
+            self.index.save(path)
+            loaded = SongSearchIndex.load(path)
+        self.assertEqual(loaded.search("love"), [1, 2, 5])
+        self.assertEqual(loaded.max_song_id, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()